@@ -1,15 +1,16 @@
 import itertools
 import logging
 import threading
-
-# import time
+import time
 from dataclasses import dataclass, field
 from functools import partial
 from math import sqrt
 
 import dearpygui.dearpygui as dpg
+import numpy as np
 
 import Simulation
+from Simulation.stages import current_agents
 
 from .params import ParameterSelector
 
@@ -19,6 +20,23 @@ COLOUR = (255, 255, 255, 255)
 THICKNESS = 3
 SNAP_DISTANCE = 25
 
+# Frames shown per second by a replay at speed 1
+REPLAY_FPS = 30
+
+# Agents are drawn as one scatter series per colour, the first being the default
+PALETTE = [
+    (255, 0, 0, 255),
+    (255, 160, 0, 255),
+    (255, 255, 0, 255),
+    (0, 200, 0, 255),
+    (0, 200, 255, 255),
+    (60, 90, 255, 255),
+    (200, 0, 255, 255),
+    (255, 120, 200, 255),
+]
+MARKER_SIZE = 2
+COLOURINGS = ("None", "Destination", "Speed")
+
 
 def distance(
     p1: tuple[float, float] | list[float], p2: tuple[float, float] | list[float]
@@ -26,16 +44,40 @@ def distance(
     return sqrt((p2[0] - p1[0]) ** 2 + (p2[1] - p1[1]) ** 2)
 
 
-def iter_agents(frame: list[list[Simulation.Agent]]):
-    # for cell in frame:
-    #     for agent in cell:
-    #         yield (agent.x, agent.y), (agent.vx, agent.vy)
-    #
-    for agent in itertools.chain.from_iterable(frame):
-        # logger.debug(agent)
-        position = (agent.x, agent.y)
-        # velocity = (agent.vx, agent.vy)
-        yield position, agent.age
+def colour_groups(
+    colouring: str, count: int, dests=None, velocities=None, max_speed: float = 1.0
+):
+    """Returns the palette index of every agent for a colouring"""
+
+    if colouring == "Destination" and dests is not None:
+        return np.asarray(dests, dtype=np.int64) % len(PALETTE)
+    if colouring == "Speed" and velocities is not None:
+        speeds = np.hypot(velocities[:, 0], velocities[:, 1])
+        bands = (speeds / max_speed * len(PALETTE)).astype(np.int64)
+        return np.minimum(bands, len(PALETTE) - 1)
+    return np.zeros(count, dtype=np.int64)
+
+
+def marker_theme(colour: tuple[int, int, int, int]):
+    with dpg.theme() as theme:
+        with dpg.theme_component(dpg.mvScatterSeries):
+            dpg.add_theme_color(
+                dpg.mvPlotCol_Line, colour, category=dpg.mvThemeCat_Plots
+            )
+            dpg.add_theme_color(
+                dpg.mvPlotCol_MarkerFill, colour, category=dpg.mvThemeCat_Plots
+            )
+            dpg.add_theme_style(
+                dpg.mvPlotStyleVar_Marker,
+                dpg.mvPlotMarker_Circle,
+                category=dpg.mvThemeCat_Plots,
+            )
+            dpg.add_theme_style(
+                dpg.mvPlotStyleVar_MarkerSize,
+                MARKER_SIZE,
+                category=dpg.mvThemeCat_Plots,
+            )
+    return theme
 
 
 @dataclass
@@ -78,24 +120,67 @@ class Canvas:
         self.parent = parent
         self.edges = edges
         self.parameter_selector = parameter_selector
-        self.agent_ids = dict()
+        self.agent_series = []
+        self.max_speed = 1.0
+        self.replay = None
+        self.replay_position = 0.0
+        self.playing = False
 
         logger.debug(edges)
         self._render()
         logger.debug("rendered map")
 
     def _render(self):
-        self.run_button = dpg.add_button(
-            label="Run Sim", parent=self.parent, callback=self.start_simulation
+        themes = [marker_theme(colour) for colour in PALETTE]
+        with dpg.group(horizontal=True, parent=self.parent):
+            self.run_button = dpg.add_button(
+                label="Run Sim", callback=self.start_simulation
+            )
+            self.replay_button = dpg.add_button(
+                label="Open Replay", callback=lambda: dpg.show_item(self.file_dialog)
+            )
+            self.colouring = dpg.add_combo(
+                COLOURINGS,
+                label="Colour",
+                width=120,
+                default_value=COLOURINGS[0],
+                callback=lambda: self.seek(self.replay_position),
+            )
+        self.file_dialog = dpg.add_file_dialog(
+            directory_selector=True,
+            show=False,
+            callback=self._open_replay,
+            width=500,
+            height=400,
         )
+        with dpg.group(horizontal=True, parent=self.parent, show=False) as controls:
+            self.replay_controls = controls
+            self.play_button = dpg.add_button(
+                label="Play", width=60, callback=self.toggle_playback
+            )
+            self.frame_slider = dpg.add_slider_int(
+                label="Frame",
+                width=400,
+                min_value=0,
+                max_value=0,
+                callback=lambda sender, app_data: self.seek(app_data),
+            )
+            self.speed_slider = dpg.add_slider_float(
+                label="Speed", width=150, default_value=1.0, min_value=0.1, max_value=20
+            )
         with dpg.child_window(
             autosize_x=True, autosize_y=True, parent=self.parent
         ) as window:
             with dpg.plot(
                 width=-1, height=-1, parent=window, equal_aspects=True
             ) as self.plot:
+                dpg.add_plot_axis(dpg.mvXAxis)
                 axis = dpg.add_plot_axis(dpg.mvYAxis)
                 dpg.add_bar_series([0, 100, 200], [0, 0, 0], weight=1, parent=axis)
+                for theme in themes:
+                    series = dpg.add_scatter_series([], [], parent=axis)
+                    dpg.bind_item_theme(series, theme)
+                    self.agent_series.append(series)
             with dpg.item_handler_registry() as registry:
                 dpg.add_item_clicked_handler(
                     button=dpg.mvMouseButton_Middle, callback=self._draw
@@ -171,32 +256,94 @@ class Canvas:
 
         thread.start()
 
+    def _show_agents(self, positions, dests=None, velocities=None):
+        """Updates the agent series, with one call per colour whatever the agents"""
+
+        groups = colour_groups(
+            dpg.get_value(self.colouring),
+            len(positions),
+            dests,
+            velocities,
+            self.max_speed,
+        )
+        order = np.argsort(groups, kind="stable")
+        starts = np.searchsorted(groups[order], np.arange(len(PALETTE) + 1))
+        xs, ys = positions[order, 0], positions[order, 1]
+        for series, start, end in zip(self.agent_series, starts, starts[1:]):
+            dpg.set_value(series, [xs[start:end].tolist(), ys[start:end].tolist()])
+
+    def _clear_agents(self):
+        for series in self.agent_series:
+            dpg.set_value(series, [[], []])
+
+    def _open_replay(self, sender, app_data):
+        self.start_replay(app_data["file_path_name"])
+
+    def start_replay(self, path: str):
+        """Shows a recorded trajectory, with controls to seek and play it"""
+
+        self.playing = False
+        self.replay = Simulation.TrajectoryReader(path)
+        params = self.parameter_selector.get_params()
+        self.max_speed = params.basic_parameters.MAX_VELOCITY
+        logger.debug(f"Opened replay of {len(self.replay)} frames from {path}")
+
+        for x1, y1, x2, y2, state in self.replay.walls:
+            self._draw_edge(Edge((x1, y1), (x2, y2), int(state)))
+        self._clear_agents()
+
+        dpg.configure_item(self.frame_slider, max_value=max(len(self.replay) - 1, 0))
+        dpg.show_item(self.replay_controls)
+        self.seek(0)
+
+        thread = threading.Thread(target=self._play, args=(self.replay,), daemon=True)
+        thread.start()
+
+    def seek(self, index: int):
+        """Shows a frame of the replay"""
+
+        if self.replay is None or not len(self.replay):
+            return
+        index = min(max(int(index), 0), len(self.replay) - 1)
+        self.replay_position = float(index)
+        dpg.set_value(self.frame_slider, index)
+        self._show_frame(index)
+
+    def toggle_playback(self):
+        self.playing = not self.playing
+        dpg.configure_item(self.play_button, label="Pause" if self.playing else "Play")
+
+    def _show_frame(self, index: int):
+        # Recordings do not hold destinations, so only speeds can colour them
+        frame = self.replay.frame(index, ["positions", "velocities"])
+        self._show_agents(frame["positions"], velocities=frame["velocities"])
+
+    def _play(self, replay):
+        last = time.perf_counter()
+        while self.replay is replay:
+            time.sleep(1 / REPLAY_FPS)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            if not self.playing:
+                continue
+
+            # Skip frames rather than slow down when the speed is high
+            speed = dpg.get_value(self.speed_slider)
+            self.replay_position += elapsed * REPLAY_FPS * speed
+            if self.replay_position >= len(replay) - 1:
+                self.replay_position = len(replay) - 1
+                self.toggle_playback()
+            index = int(self.replay_position)
+            dpg.set_value(self.frame_slider, index)
+            self._show_frame(index)
+
     def run_simulation(self, sim):
         dpg.hide_item(self.run_button)
-        for agent in self.agent_ids.values():
-            dpg.delete_item(agent)
-        self.agent_ids.clear()
-        for agent in iter_agents(sim.frame):
-            position, age = agent
-            # arrow_head = position + velocity
-            i = dpg.draw_circle(
-                center=position,
-                radius=1.5,
-                color=(255, 0, 0, 255),
-                fill=(255, 0, 0, 255),
-                parent=self.plot,
-                thickness=THICKNESS,
-            )
-            self.agent_ids[age] = i
-
-        logger.debug(len(self.agent_ids))
-
-        for i, frame in enumerate(sim.run()):
-            # time.sleep(0.06)
-            c = 0
-            for agent in iter_agents(frame):
-                position, age = agent
-                # logger.debug(f"fame count: {i} position: {position}, velocity: {age}")
-                dpg.configure_item(self.agent_ids[age], center=position)
-            c += 1
+        self.replay = None
+        dpg.hide_item(self.replay_controls)
+        self.max_speed = sim.params.basic_parameters.MAX_VELOCITY
+
+        for _ in sim.run():
+            agents = current_agents(sim)
+            self._show_agents(agents.positions, agents.dests, agents.velocities)
         dpg.show_item(self.run_button)
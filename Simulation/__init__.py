@@ -1,6 +1,15 @@
 from .agent import Agent
+from .arrays import AgentArrays, AgentPool, FrameView
+from .arraysimulation import ArraySimulation
 from .boidsimulator import BoidParams, BoidSimulation
 from .floorplan import Floorplan
+from .parallel import ParallelSimulation
 from .params import Params
+from .plancache import FloorplanCache
+from .profiling import PhaseStats
+from .recorder import TrajectoryRecorder
+from .replay import TrajectoryReader
 from .simulation import Simulation
+from .sources import AgentSource
+from .stages import Stage
 from .wall import Wall
@@ -0,0 +1,443 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class AgentArrays:
+    """Structure-of-arrays storage for the agents of a simulation
+
+    Every attribute is a contiguous NumPy array indexed by the same agent slot,
+    so that the whole population can be updated with batched operations.
+
+    Attributes
+    ----------
+    positions: np.ndarray
+            (n, 2) array of agent coordinates
+    velocities: np.ndarray
+            (n, 2) array of agent velocities
+    cells: np.ndarray
+            (n,) array of the cell that each agent is in
+    dests: np.ndarray
+            (n,) array of the destination cell of each agent
+    ids: np.ndarray
+            (n,) array of agent ids (stored as `Agent.age` by the object engine)
+
+    Methods
+    -------
+    __init__(positions: np.ndarray, velocities: np.ndarray, cells: np.ndarray, dests: np.ndarray, ids: np.ndarray)
+            Wraps existing arrays
+    from_frame(frame: List[List[Agent]])
+            Builds the arrays from a frame of Agent objects
+    empty()
+            Creates arrays holding no agents
+    concatenate(parts: List[AgentArrays])
+            Joins several sets of agents
+    take(indices: np.ndarray)
+            Copies a subset of the agents
+    remove(indices: np.ndarray)
+            Removes agents in place, moving the last agents into their slots
+    """
+
+    def __init__(self, positions, velocities, cells, dests, ids):
+        """Wraps existing arrays
+
+        Parameters
+        ----------
+        positions: np.ndarray
+                (n, 2) array of agent coordinates
+        velocities: np.ndarray
+                (n, 2) array of agent velocities
+        cells: np.ndarray
+                (n,) array of the cell that each agent is in
+        dests: np.ndarray
+                (n,) array of the destination cell of each agent
+        ids: np.ndarray
+                (n,) array of agent ids
+
+        Returns
+        -------
+        None
+        """
+
+        self.positions = np.ascontiguousarray(positions, dtype=np.float64)
+        self.velocities = np.ascontiguousarray(velocities, dtype=np.float64)
+        self.cells = np.ascontiguousarray(cells, dtype=np.int64)
+        self.dests = np.ascontiguousarray(dests, dtype=np.int64)
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Builds the arrays from a frame of Agent objects
+
+        Parameters
+        ----------
+        frame: List[List[Agent]]
+                The agents of each cell
+
+        Returns
+        -------
+        AgentArrays
+                The same agents in structure-of-arrays form
+        """
+
+        agents = [agent for cell_agents in frame for agent in cell_agents]
+        return cls(
+            np.array([(agent.x, agent.y) for agent in agents]).reshape(-1, 2),
+            np.array([(agent.vx, agent.vy) for agent in agents]).reshape(-1, 2),
+            [agent.cell for agent in agents],
+            [agent.dest for agent in agents],
+            [agent.age for agent in agents],
+        )
+
+    @classmethod
+    def empty(cls):
+        """Creates arrays holding no agents
+
+        Returns
+        -------
+        AgentArrays
+                Empty arrays
+        """
+
+        return cls(np.empty((0, 2)), np.empty((0, 2)), [], [], [])
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Joins several sets of agents
+
+        Parameters
+        ----------
+        parts: List[AgentArrays]
+                The agents to join
+
+        Returns
+        -------
+        AgentArrays
+                The agents of every part, in order
+        """
+
+        if not parts:
+            return cls.empty()
+        return cls(
+            np.concatenate([part.positions for part in parts]),
+            np.concatenate([part.velocities for part in parts]),
+            np.concatenate([part.cells for part in parts]),
+            np.concatenate([part.dests for part in parts]),
+            np.concatenate([part.ids for part in parts]),
+        )
+
+    def take(self, indices):
+        """Copies a subset of the agents
+
+        Parameters
+        ----------
+        indices: np.ndarray
+                The indices (or boolean mask) of the agents to copy
+
+        Returns
+        -------
+        AgentArrays
+                The selected agents
+        """
+
+        return AgentArrays(
+            self.positions[indices],
+            self.velocities[indices],
+            self.cells[indices],
+            self.dests[indices],
+            self.ids[indices],
+        )
+
+    def remove(self, indices):
+        """Removes agents in place, moving the last agents into their slots
+
+        Only as many agents as are removed are moved, and no array is
+        reallocated: the result views the front of the same arrays, so this
+        object must not be used afterwards. The order of the agents changes.
+
+        Parameters
+        ----------
+        indices: np.ndarray
+                The distinct indices of the agents to remove
+
+        Returns
+        -------
+        AgentArrays
+                The remaining agents
+        """
+
+        indices = np.unique(indices)
+        remaining = len(self) - len(indices)
+
+        # Removed slots in the kept range are filled by the kept agents past it
+        holes = indices[indices < remaining]
+        moved = np.ones(len(self) - remaining, dtype=bool)
+        moved[indices[indices >= remaining] - remaining] = False
+        fillers = remaining + np.flatnonzero(moved)
+
+        columns = (self.positions, self.velocities, self.cells, self.dests, self.ids)
+        for column in columns:
+            column[holes] = column[fillers]
+        return AgentArrays(*(column[:remaining] for column in columns))
+
+
+class AgentPool:
+    """Fixed-capacity storage for a changing set of agents
+
+    The live agents fill the first `size` slots of preallocated buffers and
+    the slots past them form the free list, so that adding and removing agents
+    writes into the buffers without allocating per agent. The buffers are only
+    reallocated when they are full, doubling their capacity, or when less than
+    SHRINK_FRACTION of them is used.
+
+    Attributes
+    ----------
+    size: int
+            The number of live agents
+    capacity: int
+            The number of slots of the buffers
+    agents: AgentArrays
+            Views of the live agents, replaced after every change
+
+    Methods
+    -------
+    __init__(agents: AgentArrays, capacity: int)
+            Stores the agents
+    add(agents: AgentArrays)
+            Adds agents into free slots
+    remove(indices: np.ndarray)
+            Frees the slots of agents, moving the last agents into them
+    """
+
+    # The buffers shrink, to twice the live agents, once less than this fraction is used
+    SHRINK_FRACTION = 0.25
+
+    def __init__(self, agents, capacity=None):
+        """Stores the agents
+
+        Parameters
+        ----------
+        agents: AgentArrays
+                The initial agents, whose arrays are used as the buffers
+                unless a larger capacity is asked for
+        capacity: int
+                The number of slots to preallocate
+
+        Returns
+        -------
+        None
+        """
+
+        self.size = len(agents)
+        self._buffers = _columns(agents)
+        if capacity is not None and capacity > self.size:
+            self._resize(capacity)
+        self._update()
+
+    @property
+    def capacity(self):
+        return len(self._buffers[0])
+
+    def _update(self):
+        self.agents = AgentArrays(*(buffer[: self.size] for buffer in self._buffers))
+
+    def _resize(self, capacity):
+        buffers = []
+        for buffer in self._buffers:
+            resized = np.zeros((capacity, *buffer.shape[1:]), dtype=buffer.dtype)
+            resized[: self.size] = buffer[: self.size]
+            buffers.append(resized)
+        self._buffers = tuple(buffers)
+
+    def add(self, agents):
+        """Adds agents into free slots
+
+        Parameters
+        ----------
+        agents: AgentArrays
+                The agents to add
+
+        Returns
+        -------
+        None
+        """
+
+        size = self.size + len(agents)
+        if size > self.capacity:
+            self._resize(max(size, 2 * self.capacity))
+        for buffer, column in zip(self._buffers, _columns(agents)):
+            buffer[self.size : size] = column
+        self.size = size
+        self._update()
+
+    def remove(self, indices):
+        """Frees the slots of agents, moving the last agents into them
+
+        Parameters
+        ----------
+        indices: np.ndarray
+                The distinct indices of the agents to remove
+
+        Returns
+        -------
+        None
+        """
+
+        self.size = len(self.agents.remove(indices))
+        if self.size < self.capacity * self.SHRINK_FRACTION:
+            self._resize(2 * self.size)
+        self._update()
+
+
+def _columns(agents):
+    return (
+        agents.positions,
+        agents.velocities,
+        agents.cells,
+        agents.dests,
+        agents.ids,
+    )
+
+
+class AgentView:
+    """Read-only, Agent-like view of a single slot of an AgentArrays
+
+    Exposes the same attributes as `Agent` so that code written against the
+    object engine (the GUI, headless.py) can consume array-backed frames.
+    """
+
+    __slots__ = ("_agents", "_index")
+
+    def __init__(self, agents, index):
+        self._agents = agents
+        self._index = index
+
+    @property
+    def x(self):
+        return float(self._agents.positions[self._index, 0])
+
+    @property
+    def y(self):
+        return float(self._agents.positions[self._index, 1])
+
+    @property
+    def vx(self):
+        return float(self._agents.velocities[self._index, 0])
+
+    @property
+    def vy(self):
+        return float(self._agents.velocities[self._index, 1])
+
+    @property
+    def cell(self):
+        return int(self._agents.cells[self._index])
+
+    @property
+    def dest(self):
+        return int(self._agents.dests[self._index])
+
+    @property
+    def age(self):
+        return int(self._agents.ids[self._index])
+
+    def vec_to_agent(self, other):
+        return (self.x - other.x, self.y - other.y)
+
+    def __repr__(self):
+        return f"AgentView(cell={self.cell}, x={self.x}, y={self.y}, age={self.age})"
+
+
+class FrameView(Sequence):
+    """Lightweight List[List[Agent]]-compatible view over an AgentArrays
+
+    Indexing by cell number returns a list of AgentView objects for the agents
+    currently in that cell. Consumers that can work with arrays directly should
+    use the `positions`, `velocities`, `cells` and `ids` properties instead,
+    which do not create any per-agent Python objects.
+    """
+
+    def __init__(self, agents, num_cells):
+        self.agents = agents
+        self.num_cells = num_cells
+
+    def __len__(self):
+        return self.num_cells
+
+    def __getitem__(self, cell):
+        if isinstance(cell, slice):
+            return [self[i] for i in range(*cell.indices(self.num_cells))]
+        if cell < 0:
+            cell += self.num_cells
+        if not 0 <= cell < self.num_cells:
+            raise IndexError(cell)
+        return [
+            AgentView(self.agents, index)
+            for index in np.flatnonzero(self.agents.cells == cell)
+        ]
+
+    @property
+    def positions(self):
+        return self.agents.positions
+
+    @property
+    def velocities(self):
+        return self.agents.velocities
+
+    @property
+    def cells(self):
+        return self.agents.cells
+
+    @property
+    def ids(self):
+        return self.agents.ids
+
+
+def group_indices(keys):
+    """Groups array indices by key
+
+    Parameters
+    ----------
+    keys: np.ndarray
+            (n,) integer array of keys
+
+    Yields
+    ------
+    Tuple[int, np.ndarray]
+            Each distinct key along with the indices that hold it
+    """
+
+    if not len(keys):
+        return
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(keys)]))
+    for start, end in zip(starts, ends):
+        yield sorted_keys[start], order[start:end]
+
+
+def expand_ranges(starts, counts):
+    """Concatenates the index ranges [start, start + count)
+
+    Parameters
+    ----------
+    starts: np.ndarray
+            (n,) array of range starts
+    counts: np.ndarray
+            (n,) array of range lengths
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+            For every index in the concatenated ranges, the range it came
+            from and the index itself
+    """
+
+    total = counts.sum()
+    owners = np.repeat(np.arange(len(counts)), counts)
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.repeat(starts, counts) + within
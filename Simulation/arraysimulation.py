@@ -0,0 +1,673 @@
+import logging
+
+import numpy as np
+
+from .arrays import AgentArrays, AgentPool, FrameView, group_indices
+from .geometry import perpendiculars, segments_intersect
+from .kernels import fused_step, resolve_backend
+from .neighbours import SpatialHash
+from .profiling import PhaseTimer
+from .simulation import Simulation
+from .streams import make_rng
+
+logger = logging.getLogger("Simulation.ArrayCore")
+
+
+class ArraySimulation(Simulation):
+    """Array-backed engine for the simulation.
+
+    Behaves like `Simulation`, but keeps the agents in an `AgentArrays`
+    (structure-of-arrays) and moves the whole population with batched NumPy
+    operations. Unlike the object engine, all forces of a frame are computed
+    from the same state before any agent is moved.
+
+    With the "numba" backend, the candidate walls, neighbours and doors are
+    still found with NumPy, but the forces are accumulated and the agents
+    moved by the compiled kernel of `kernels.fused_step`.
+
+    Attributes
+    ----------
+    agents: AgentArrays
+                    The positions, velocities, cells, destinations and ids of the agents
+    pool: AgentPool
+                    The preallocated storage that `agents` views
+    frame: FrameView
+                    A List[List[Agent]]-compatible view of `agents`
+    rng: np.random.Generator
+                    The random number stream of the simulation
+    backend: str
+                    The backend that moves the agents, "numpy" or "numba"
+    neighbours: SpatialHash
+                    Buckets of agents used to find nearby agents, rebuilt every frame
+    ghosts: AgentArrays
+                    Agents simulated elsewhere that push on the agents of this simulation
+    crossings: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+                    The agents that crossed a door in the last frame (indexed
+                    before any agent was removed), the doors, and the cells
+                    they came from and went to
+    exited: np.ndarray
+                    The ids of the agents removed at their destination in the last frame
+
+    Methods
+    -------
+    initializeFrame(self: ArraySimulation, agents: AgentArrays)
+                    Initializes the agent arrays
+    setAgents(self: ArraySimulation, agents: AgentArrays)
+                    Replaces the agents of the simulation
+    nextFrame(self: ArraySimulation)
+                    Calculates the next frame, gathering the door crossings of its steps
+    population(self: ArraySimulation)
+                    Returns the number of agents in the simulation
+    removeArrived(self: ArraySimulation)
+                    Removes the agents in their destination cell, freeing their slots of the pool
+    addAgents(self: ArraySimulation, positions: np.ndarray, cells: np.ndarray, dest: int)
+                    Adds agents at rest into free slots of the pool
+    moveAgents(self: ArraySimulation, dt: float, timer: PhaseTimer)
+                    Implements movement of all the agents in one batch
+    randomForces(self: ArraySimulation)
+                    Calculates the random forces on every agent
+    wallCandidates(self: ArraySimulation)
+                    Finds the walls that may push on each agent
+    wallForces(self: ArraySimulation)
+                    Calculates the wall forces on every agent
+    agentPairs(self: ArraySimulation)
+                    Finds the pairs of agents that push on each other
+    agentForces(self: ArraySimulation)
+                    Calculates the agent-agent forces on every agent
+    seeThroughDoors(self: ArraySimulation, positions: np.ndarray, cells: np.ndarray, i: np.ndarray, j: np.ndarray)
+                    Checks which pairs of agents are in the same cell or see each other through a door
+    goalVectors(self: ArraySimulation)
+                    Finds the vectors from the agents to the doors that attract them
+    goalForces(self: ArraySimulation)
+                    Calculates the goal forces on every agent
+    integrate(self: ArraySimulation, forces: np.ndarray, dt: float)
+                    Updates velocities and positions from the forces
+    fusedStep(self: ArraySimulation, dt: float, timer: PhaseTimer)
+                    Moves the agents with the compiled kernel
+    updateCells(self: ArraySimulation, old_positions: np.ndarray)
+                    Moves the agents that crossed a door of their cell to the cell behind it
+    """
+
+    def __init__(
+        self,
+        params,
+        floorplan,
+        agents=None,
+        rng=None,
+        backend="auto",
+        profiler=None,
+        sources=(),
+    ):
+        """Initialized the simulation
+
+        Parameters
+        ----------
+        params: Params
+                        The parameters of the simulation
+        floorplan: Floorplan
+                        The floorplan of the simulation
+        agents: AgentArrays
+                        The initial agents, randomly placed as in `Simulation` if None
+        rng: np.random.Generator | np.random.SeedSequence | int
+                        The random number stream, or a seed for it. Defaults to
+                        a stream seeded with RANDOM_SEED, so that runs are reproducible
+        backend: str
+                        "numpy", "numba", or "auto" to use numba if it is installed
+        profiler: PhaseStats
+                        Receives the time spent in each phase of every frame
+        sources: List[AgentSource]
+                        Sources that release agents over time
+
+        Returns
+        -------
+        None
+        """
+
+        self.params = params
+        self.floorplan = floorplan
+        self.rng = make_rng(params.basic_parameters.RANDOM_SEED if rng is None else rng)
+        self.backend = resolve_backend(backend)
+        self.profiler = profiler
+        self.sources = list(sources)
+        self.ghosts = None
+        self.initializeFrame(agents)
+
+    def initializeFrame(self, agents=None):
+        """Creates the first frame of the simulation as arrays
+
+        Parameters
+        ----------
+        agents: AgentArrays
+                        The initial agents, randomly placed as in `Simulation` if None
+
+        Returns
+        -------
+        None
+        """
+
+        if agents is None:
+            super().initializeFrame()
+            agents = AgentArrays.from_frame(self.frame)
+        self.setAgents(agents)
+        self.time = 0.0
+        self._nextId = int(agents.ids.max()) + 1 if len(agents) else 0
+
+        # Door segments between each pair of cells
+        self._doorsBetween = {
+            pair: np.array([door.endpoints for door in doors], dtype=np.float64)
+            for pair, doors in self.floorplan.doors_between.items()
+        }
+        self._doorPairKeys = np.array(
+            [low * self.floorplan.num_cells + high for low, high in self._doorsBetween],
+            dtype=np.int64,
+        )
+        empty = np.empty(0, dtype=np.int64)
+        self.crossings = (empty, empty, empty, empty)
+        self.exited = empty
+        self.neighbours = SpatialHash(self.params.repulsion_factors.AGENT_FORCE_MARGIN)
+
+    def setAgents(self, agents):
+        """Replaces the agents of the simulation
+
+        Parameters
+        ----------
+        agents: AgentArrays
+                        The new agents
+
+        Returns
+        -------
+        None
+        """
+
+        self.pool = AgentPool(agents)
+        self._poolChanged()
+
+    def _poolChanged(self):
+        self.agents = self.pool.agents
+        self.frame = FrameView(self.agents, self.floorplan.num_cells)
+
+    def nextFrame(self):
+        """Calculates the next frame, gathering the door crossings of its steps
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None
+        """
+
+        # The substeps of a frame are timed as one frame
+        timer = PhaseTimer() if self.profiler is not None else None
+        substeps, dt = self.substeps()
+        if substeps == 1:
+            self.moveAgents(dt, timer)
+        else:
+            crossings = []
+            for _ in range(substeps):
+                self.moveAgents(dt, timer)
+                crossings.append(self.crossings)
+            self.crossings = tuple(np.concatenate(column) for column in zip(*crossings))
+        if timer is not None:
+            self.profiler.record(timer.times)
+
+        if self.params.basic_parameters.REMOVE_ARRIVED:
+            self.removeArrived()
+        if self.sources:
+            self.spawnAgents()
+        self.time += self.params.basic_parameters.DT
+
+    def population(self):
+        """Returns the number of agents in the simulation
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        int
+                The number of agents
+        """
+
+        return len(self.agents)
+
+    def removeArrived(self):
+        """Removes the agents in their destination cell, freeing their slots of the pool
+
+        The last agents are moved into the freed slots, so removing k agents
+        costs O(k) and nothing is reallocated (see `AgentPool`). The ids of
+        the removed agents are kept in `exited` until the next frame.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None
+        """
+
+        arrived = np.flatnonzero(self.agents.cells == self.agents.dests)
+        self.exited = self.agents.ids[arrived]
+        if not len(arrived):
+            return
+
+        self.pool.remove(arrived)
+        self._poolChanged()
+
+    def addAgents(self, positions, cells, dest):
+        """Adds agents at rest into free slots of the pool
+
+        Parameters
+        ----------
+        positions: np.ndarray
+                (k, 2) array of the positions of the new agents
+        cells: np.ndarray
+                (k,) array of their cells
+        dest: int
+                Their destination cell
+
+        Returns
+        -------
+        None
+        """
+
+        count = len(positions)
+        ids = np.arange(self._nextId, self._nextId + count)
+        self._nextId += count
+        self.pool.add(
+            AgentArrays(
+                positions, np.zeros((count, 2)), cells, np.full(count, dest), ids
+            )
+        )
+        self._poolChanged()
+
+    def moveAgents(self, dt=1.0, timer=None):
+        """Implements movement of all the agents in one batch
+
+        Parameters
+        ----------
+        dt: float
+                The time covered by the step
+        timer: PhaseTimer
+                Laps the phases of the step if given
+
+        Returns
+        -------
+        None
+        """
+
+        old_positions = self.agents.positions.copy()
+        if self.backend == "numba":
+            self.fusedStep(dt, timer)
+        else:
+            forces = self.randomForces()
+            if timer is not None:
+                timer.lap("random")
+            forces += self.wallForces()
+            if timer is not None:
+                timer.lap("wall")
+            forces += self.agentForces()
+            if timer is not None:
+                timer.lap("agent")
+            forces += self.goalForces()
+            if timer is not None:
+                timer.lap("goal")
+            self.integrate(forces, dt)
+        if timer is not None:
+            timer.lap("integrate")
+
+        self.updateCells(old_positions)
+        if timer is not None:
+            timer.lap("cells")
+
+    def randomForces(self):
+        """Calculates the random forces on every agent
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        np.ndarray
+                (n, 2) array of forces
+        """
+
+        constant = self.params.repulsion_factors.RANDOM_FORCE_CONSTANT
+        return self.rng.uniform(-constant, constant, size=(len(self.agents), 2))
+
+    def wallCandidates(self):
+        """Finds the walls that may push on each agent
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+                The agent of each candidate, and the endpoints of its wall
+        """
+
+        wall_index = self.floorplan.wall_index(
+            self.params.repulsion_factors.WALL_FORCE_MARGIN
+        )
+        i, walls = wall_index.candidates(self.agents.positions, self.agents.cells)
+        return i, wall_index.starts[walls], wall_index.ends[walls]
+
+    def wallForces(self):
+        """Calculates the wall forces on every agent
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        np.ndarray
+                (n, 2) array of forces
+        """
+
+        factors = self.params.repulsion_factors
+        positions = self.agents.positions
+        i, starts, ends = self.wallCandidates()
+
+        per, on_wall = perpendiculars(positions[i], starts, ends)
+        per_length = np.hypot(per[:, 0], per[:, 1])
+        in_range = (
+            on_wall & (per_length != 0) & (per_length <= factors.WALL_FORCE_MARGIN)
+        )
+        force_per_length = np.divide(
+            factors.WALL_FORCE_CONSTANT,
+            per_length,
+            out=np.zeros_like(per_length),
+            where=in_range,
+        )
+        per *= force_per_length[:, np.newaxis]
+
+        n = len(positions)
+        return np.stack(
+            (
+                np.bincount(i, weights=per[:, 0], minlength=n),
+                np.bincount(i, weights=per[:, 1], minlength=n),
+            ),
+            axis=1,
+        )
+
+    def agentPairs(self):
+        """Finds the pairs of agents that push on each other
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+                The positions of the agents followed by the ghosts, and the
+                index arrays i, j of the pairs, with i always a real agent
+        """
+
+        factors = self.params.repulsion_factors
+        positions = self.agents.positions
+        cells = self.agents.cells
+        n = len(positions)
+
+        # Ghost agents push on the agents but are not moved themselves
+        if self.ghosts is not None and len(self.ghosts):
+            positions = np.concatenate((positions, self.ghosts.positions))
+            cells = np.concatenate((cells, self.ghosts.cells))
+
+        self.neighbours.cell_size = factors.AGENT_FORCE_MARGIN
+        self.neighbours.build(positions)
+        i, j = self.neighbours.pairs(factors.AGENT_FORCE_MARGIN)
+        real = i < n
+        i, j = i[real], j[real]
+
+        # Agents in different cells only interact through a door between them
+        visible = self.seeThroughDoors(positions, cells, i, j)
+        return positions, i[visible], j[visible]
+
+    def agentForces(self):
+        """Calculates the agent-agent forces on every agent
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        np.ndarray
+                (n, 2) array of forces
+        """
+
+        positions, i, j = self.agentPairs()
+        vec = positions[i] - positions[j]
+        vec_length = np.hypot(vec[:, 0], vec[:, 1])
+        force_per_length = np.divide(
+            self.params.repulsion_factors.AGENT_FORCE_CONSTANT,
+            vec_length**3,
+            out=np.zeros_like(vec_length),
+            where=vec_length != 0,
+        )
+        vec *= force_per_length[:, np.newaxis]
+
+        n = len(self.agents)
+        return np.stack(
+            (
+                np.bincount(i, weights=vec[:, 0], minlength=n),
+                np.bincount(i, weights=vec[:, 1], minlength=n),
+            ),
+            axis=1,
+        )
+
+    def seeThroughDoors(self, positions, cells, i, j):
+        """Checks which pairs of agents are in the same cell or see each other through a door
+
+        Parameters
+        ----------
+        positions: np.ndarray
+                (n, 2) array of agent positions
+        cells: np.ndarray
+                (n,) array of agent cells
+        i: np.ndarray
+        j: np.ndarray
+                Index arrays of the pairs of agents
+
+        Returns
+        -------
+        np.ndarray
+                Whether each pair can interact
+        """
+
+        visible = cells[i] == cells[j]
+
+        crossing = np.flatnonzero(~visible)
+        if not len(crossing):
+            return visible
+
+        # Only cells connected by a door can see each other
+        num_cells = self.floorplan.num_cells
+        low = np.minimum(cells[i[crossing]], cells[j[crossing]])
+        high = np.maximum(cells[i[crossing]], cells[j[crossing]])
+        keys = low * num_cells + high
+        connected = np.isin(keys, self._doorPairKeys)
+        crossing, keys = crossing[connected], keys[connected]
+
+        for pair, group in group_indices(keys):
+            doors = self._doorsBetween[divmod(int(pair), num_cells)]
+            pairs = crossing[group]
+            a = positions[i[pairs], np.newaxis, :]
+            b = positions[j[pairs], np.newaxis, :]
+            visible[pairs] = np.any(
+                segments_intersect(a, b, doors[:, 0], doors[:, 1]), axis=1
+            )
+
+        return visible
+
+    def goalVectors(self):
+        """Finds the vectors from the agents to the doors that attract them
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                The agents attracted by a door, and (k, 2) array of the vectors
+                from those agents to their doors
+        """
+
+        positions = self.agents.positions
+
+        # Goal forces are not applicable to agents in their destination
+        moving = np.flatnonzero(self.agents.cells != self.agents.dests)
+        if not len(moving):
+            return moving, np.empty((0, 2))
+
+        nodes, vec = self.floorplan.choose_exit_doors(
+            positions[moving], self.agents.cells[moving], self.agents.dests[moving]
+        )
+        return moving[nodes != -1], vec[nodes != -1]
+
+    def goalForces(self):
+        """Calculates the goal forces on every agent
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        np.ndarray
+                (n, 2) array of forces
+        """
+
+        forces = np.zeros_like(self.agents.positions)
+        moving, vec = self.goalVectors()
+
+        vec_length = np.hypot(vec[:, 0], vec[:, 1])
+        force_per_length = np.divide(
+            self.params.repulsion_factors.GOAL_FORCE_CONSTANT,
+            vec_length**3,
+            out=np.zeros_like(vec_length),
+            where=vec_length != 0,
+        )
+        forces[moving] = vec * force_per_length[:, np.newaxis]
+
+        return forces
+
+    def integrate(self, forces, dt=1.0):
+        """Updates velocities and positions from the forces
+
+        Velocities are clamped to MAX_VELOCITY and agents are reflected off the
+        bounds of the simulation space.
+
+        Parameters
+        ----------
+        forces: np.ndarray
+                (n, 2) array of the forces on each agent
+        dt: float
+                The time covered by the step
+
+        Returns
+        -------
+        None
+        """
+
+        basic = self.params.basic_parameters
+        positions = self.agents.positions
+        velocities = self.agents.velocities
+
+        # Update velocity
+        velocities += forces * dt
+        speed = np.hypot(velocities[:, 0], velocities[:, 1])
+        too_fast = speed > basic.MAX_VELOCITY
+        velocities[too_fast] *= (basic.MAX_VELOCITY / speed[too_fast])[:, np.newaxis]
+
+        # Update position
+        positions += velocities * dt
+
+        # Reflect off walls
+        bounds = np.array([basic.WIDTH, basic.HEIGHT], dtype=np.float64)
+        below = positions < 0
+        above = positions > bounds
+        positions[below] = -positions[below]
+        positions[above] = (2 * bounds - positions)[above]
+        velocities[below | above] *= -1
+
+    def fusedStep(self, dt=1.0, timer=None):
+        """Moves the agents with the compiled kernel
+
+        Finds the candidate forces like the NumPy path, then accumulates them,
+        clamps the velocities and integrates in a single compiled loop.
+
+        Parameters
+        ----------
+        dt: float
+                The time covered by the step
+        timer: PhaseTimer
+                Times finding the candidates of each force if given, the
+                caller laps the kernel as the integration
+
+        Returns
+        -------
+        None
+        """
+
+        basic = self.params.basic_parameters
+        factors = self.params.repulsion_factors
+        forces = self.randomForces()
+        if timer is not None:
+            timer.lap("random")
+        wall_agents, wall_starts, wall_ends = self.wallCandidates()
+        if timer is not None:
+            timer.lap("wall")
+        points, pair_i, pair_j = self.agentPairs()
+        if timer is not None:
+            timer.lap("agent")
+        goal_agents, goal_vectors = self.goalVectors()
+        if timer is not None:
+            timer.lap("goal")
+
+        fused_step(
+            self.agents.positions,
+            self.agents.velocities,
+            forces,
+            points,
+            wall_agents,
+            wall_starts,
+            wall_ends,
+            pair_i,
+            pair_j,
+            goal_agents,
+            goal_vectors,
+            float(factors.WALL_FORCE_MARGIN),
+            float(factors.WALL_FORCE_CONSTANT),
+            float(factors.AGENT_FORCE_CONSTANT),
+            float(factors.GOAL_FORCE_CONSTANT),
+            float(basic.MAX_VELOCITY),
+            float(basic.WIDTH),
+            float(basic.HEIGHT),
+            float(dt),
+        )
+
+    def updateCells(self, old_positions):
+        """Moves the agents that crossed a door of their cell to the cell behind it
+
+        Parameters
+        ----------
+        old_positions: np.ndarray
+                (n, 2) array of the positions before the agents moved
+
+        Returns
+        -------
+        None
+        """
+
+        cells = self.agents.cells
+        new_cells, doors = self.floorplan.cross_doors(
+            old_positions,
+            self.agents.positions,
+            cells,
+            self.params.repulsion_factors.WALL_FORCE_MARGIN,
+        )
+
+        # Record the crossings of this frame
+        crossed = np.flatnonzero(doors != -1)
+        self.crossings = (crossed, doors[crossed], cells[crossed], new_cells[crossed])
+        cells[:] = new_cells
@@ -0,0 +1,437 @@
+"""Scaling benchmarks of the simulation engines
+
+Every scenario builds a grid floorplan sized to hold its agents at a fixed
+density, then times the construction of the floorplan and of the simulation,
+the frames per second and the time spent in each phase of a frame, and
+measures the peak memory traced while setting up and stepping it once. The
+results are plain dictionaries, so they can be stored as JSON and compared
+against a baseline with `compare_results`.
+"""
+
+import logging
+import math
+import platform
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+
+import numpy as np
+
+from .arraysimulation import ArraySimulation
+from .boidsimulator import BoidParams, Boids, BoidSimulation
+from .layouts import grid_layout
+from .params import Params
+from .profiling import PhaseStats
+from .simulation import Simulation
+
+logger = logging.getLogger("Simulation.Benchmark")
+
+VERSION = 1
+
+# Engines that can be benchmarked, the boids ignore the floorplan
+ENGINES = ("object", "array", "boids")
+FLOORPLAN_ENGINES = ("object", "array")
+
+# Sizes swept by default, each with the other size held at its base value
+AGENT_COUNTS = (100, 1000, 10000, 100000)
+CELL_COUNTS = (2, 10, 100, 1000)
+BASE_AGENTS = 1000
+BASE_CELLS = 2
+
+# Floor area per agent in the left half of the floorplan, where agents start
+AREA_PER_AGENT = 4.0
+
+# Floorplans are built this many times and the fastest build is reported, so
+# that one-time warm-up costs of the first build do not count
+FLOORPLAN_REPEATS = 3
+
+# Relative change of a metric reported as a regression by default
+TOLERANCE = 0.2
+
+# Durations below this many seconds are too noisy to compare
+MIN_SECONDS = 0.01
+
+
+@dataclass
+class Scenario:
+    """One engine at one size
+
+    Attributes
+    ----------
+    engine: str
+            "object", "array" or "boids"
+    agents: int
+            The number of agents
+    cells: int
+            The number of rooms of the floorplan, 0 for the boids
+    """
+
+    engine: str
+    agents: int
+    cells: int
+
+    @property
+    def name(self):
+        return f"{self.engine}-a{self.agents}-c{self.cells}"
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurements of one scenario
+
+    Attributes
+    ----------
+    name: str
+            The name of the scenario
+    engine: str
+            The engine benchmarked
+    agents: int
+            The number of agents
+    cells: int
+            The number of rooms of the floorplan
+    frames: int
+            The number of frames timed
+    seconds: float
+            Wall-clock seconds taken by the timed frames
+    fps: float
+            Frames per second
+    floorplan_seconds: float
+            Seconds taken to construct the floorplan
+    setup_seconds: float
+            Seconds taken to construct the simulation
+    peak_memory: int
+            Peak bytes traced while setting up the scenario and stepping it
+            once, None if not measured
+    phases: Dict[str, float]
+            Mean seconds per frame of each phase, empty for the boids
+    skipped: bool
+            Whether the scenario was skipped because a smaller one was over
+            the time budget
+    """
+
+    name: str
+    engine: str
+    agents: int
+    cells: int
+    frames: int = 0
+    seconds: float = 0.0
+    fps: float = 0.0
+    floorplan_seconds: float = 0.0
+    setup_seconds: float = 0.0
+    peak_memory: Optional[int] = None
+    phases: Dict[str, float] = field(default_factory=dict)
+    skipped: bool = False
+
+
+def grid_shape(cells):
+    """Returns the most square grid of rooms with a given number of rooms
+
+    Parameters
+    ----------
+    cells: int
+            The number of rooms
+
+    Returns
+    -------
+    Tuple[int, int]
+            The number of rows and columns
+    """
+
+    rows = max(d for d in range(1, math.isqrt(cells) + 1) if cells % d == 0)
+    return rows, cells // rows
+
+
+def build_floorplan(agents, cells):
+    """Builds the floorplan of a scenario, with every agent heading to the last room
+
+    Parameters
+    ----------
+    agents: int
+            The number of agents
+    cells: int
+            The number of rooms
+
+    Returns
+    -------
+    Tuple[Params, Floorplan, float]
+            The parameters sized to the floorplan, the floorplan, and the
+            fewest seconds taken to construct it over `FLOORPLAN_REPEATS` builds
+    """
+
+    rows, cols = grid_shape(cells)
+    # Agents start in the left half, keep them at AREA_PER_AGENT
+    size = max(10.0, math.sqrt(2 * agents * AREA_PER_AGENT / cells))
+    seconds = math.inf
+    for _ in range(FLOORPLAN_REPEATS):
+        start = time.perf_counter()
+        floorplan = grid_layout(
+            rows, cols, room_size=size, distribution=[0] * cells + [agents]
+        )
+        seconds = min(seconds, time.perf_counter() - start)
+
+    params = Params()
+    params.basic_parameters.WIDTH = cols * size
+    params.basic_parameters.HEIGHT = rows * size
+    return params, floorplan, seconds
+
+
+def _setup(scenario, seed, profiler):
+    if scenario.engine == "boids":
+        rng = np.random.default_rng(seed)
+        edge = math.sqrt(scenario.agents * AREA_PER_AGENT)
+        boids = Boids(
+            rng.random((scenario.agents, 2)) * edge, rng.random((scenario.agents, 2))
+        )
+        start = time.perf_counter()
+        simulation = BoidSimulation(boids, BoidParams())
+        return simulation.update_agents, 0.0, time.perf_counter() - start
+
+    params, floorplan, floorplan_seconds = build_floorplan(
+        scenario.agents, scenario.cells
+    )
+    engine = ArraySimulation if scenario.engine == "array" else Simulation
+    start = time.perf_counter()
+    simulation = engine(params, floorplan, rng=seed, profiler=profiler)
+    return simulation.nextFrame, floorplan_seconds, time.perf_counter() - start
+
+
+def run_scenario(scenario, frames=20, seed=0, time_budget=30.0, memory=True):
+    """Benchmarks one scenario
+
+    Parameters
+    ----------
+    scenario: Scenario
+            The engine and size to benchmark
+    frames: int
+            The most frames to time
+    seed: int
+            The seed of the simulation
+    time_budget: float
+            Seconds after which no more frames are timed, at least one always is
+    memory: bool
+            Whether to measure the peak memory, which sets up the scenario
+            and steps it once more under tracemalloc
+
+    Returns
+    -------
+    BenchmarkResult
+            The measurements
+    """
+
+    result = BenchmarkResult(
+        scenario.name, scenario.engine, scenario.agents, scenario.cells
+    )
+    profiler = None if scenario.engine == "boids" else PhaseStats()
+    step, result.floorplan_seconds, result.setup_seconds = _setup(
+        scenario, seed, profiler
+    )
+
+    start = time.perf_counter()
+    while result.frames < frames:
+        step()
+        result.frames += 1
+        result.seconds = time.perf_counter() - start
+        if result.seconds > time_budget:
+            break
+    result.fps = result.frames / result.seconds if result.seconds else math.inf
+    if profiler is not None:
+        result.phases = profiler.means()
+
+    if memory:
+        tracemalloc.start()
+        try:
+            _setup(scenario, seed, None)[0]()
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def sweep(
+    engines=ENGINES,
+    agent_counts=AGENT_COUNTS,
+    cell_counts=CELL_COUNTS,
+    base_agents=BASE_AGENTS,
+    base_cells=BASE_CELLS,
+):
+    """Returns the scenarios varying one size at a time
+
+    Parameters
+    ----------
+    engines: Iterable[str]
+            The engines to benchmark
+    agent_counts: Iterable[int]
+            The numbers of agents, benchmarked with `base_cells` rooms
+    cell_counts: Iterable[int]
+            The numbers of rooms, benchmarked with `base_agents` agents, only
+            for the engines that use a floorplan
+    base_agents: int
+            The number of agents while the rooms vary
+    base_cells: int
+            The number of rooms while the agents vary
+
+    Returns
+    -------
+    List[Scenario]
+            The scenarios, smallest first for every engine
+    """
+
+    scenarios = []
+    for engine in engines:
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        if engine in FLOORPLAN_ENGINES:
+            sizes = [(agents, base_cells) for agents in agent_counts]
+            sizes += [(base_agents, cells) for cells in cell_counts]
+        else:
+            sizes = [(agents, 0) for agents in agent_counts]
+        for agents, cells in sorted(set(sizes)):
+            scenarios.append(Scenario(engine, agents, cells))
+    return scenarios
+
+
+def run_benchmarks(scenarios, frames=20, seed=0, time_budget=30.0, memory=True):
+    """Benchmarks scenarios, skipping those larger than one over the time budget
+
+    Parameters
+    ----------
+    scenarios: Iterable[Scenario]
+            The scenarios, smallest first for every engine
+    frames: int
+            The most frames to time per scenario
+    seed: int
+            The seed of the simulations
+    time_budget: float
+            Seconds a scenario may take. Once a single frame takes longer,
+            the scenarios of the engine with at least as many agents and
+            rooms are skipped
+    memory: bool
+            Whether to measure the peak memory
+
+    Yields
+    ------
+    BenchmarkResult
+            The measurements of every scenario in turn
+    """
+
+    too_slow = []
+    for scenario in scenarios:
+        if any(
+            engine == scenario.engine
+            and agents <= scenario.agents
+            and cells <= scenario.cells
+            for engine, agents, cells in too_slow
+        ):
+            yield BenchmarkResult(
+                scenario.name,
+                scenario.engine,
+                scenario.agents,
+                scenario.cells,
+                skipped=True,
+            )
+            continue
+
+        result = run_scenario(scenario, frames, seed, time_budget, memory)
+        if result.seconds / result.frames > time_budget:
+            too_slow.append((scenario.engine, scenario.agents, scenario.cells))
+        yield result
+
+
+def environment():
+    """Returns a description of the machine the benchmarks run on
+
+    Returns
+    -------
+    Dict[str, str]
+            The Python and NumPy versions, the platform and the processor
+    """
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+
+def to_document(results):
+    """Returns benchmark results as a JSON serialisable document
+
+    Parameters
+    ----------
+    results: Iterable[BenchmarkResult]
+            The results
+
+    Returns
+    -------
+    Dict
+            The version of the format, the environment and the results
+    """
+
+    return {
+        "version": VERSION,
+        "environment": environment(),
+        "results": [asdict(result) for result in results],
+    }
+
+
+def compare_results(document, baseline, tolerance=TOLERANCE):
+    """Finds the metrics that regressed against a baseline
+
+    The frames per second regress when they drop, and the floorplan
+    construction time and the peak memory when they grow, by more than the
+    tolerance. Scenarios missing from either document or skipped in either
+    are ignored, as are durations too short to compare.
+
+    Parameters
+    ----------
+    document: Dict
+            The results, as returned by `to_document`
+    baseline: Dict
+            The baseline results, in the same format
+    tolerance: float
+            The relative change allowed
+
+    Returns
+    -------
+    List[Dict]
+            The scenario, metric, baseline value, new value and relative
+            change of the value of every regression
+    """
+
+    if baseline.get("version") != VERSION:
+        raise ValueError(f"Unsupported baseline version {baseline.get('version')}")
+
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in document["results"]:
+        old = previous.get(result["name"])
+        if old is None or old["skipped"] or result["skipped"]:
+            continue
+
+        checks = [("fps", 1 / old["fps"], 1 / result["fps"])]
+        if max(old["floorplan_seconds"], result["floorplan_seconds"]) >= MIN_SECONDS:
+            checks.append(
+                (
+                    "floorplan_seconds",
+                    old["floorplan_seconds"],
+                    result["floorplan_seconds"],
+                )
+            )
+        if old["peak_memory"] and result["peak_memory"]:
+            checks.append(("peak_memory", old["peak_memory"], result["peak_memory"]))
+
+        # Every check compares a cost, where higher is worse
+        for metric, old_cost, new_cost in checks:
+            if old_cost and new_cost > old_cost * (1 + tolerance):
+                regressions.append(
+                    {
+                        "name": result["name"],
+                        "metric": metric,
+                        "baseline": old[metric],
+                        "value": result[metric],
+                        "change": result[metric] / old[metric] - 1,
+                    }
+                )
+    return regressions
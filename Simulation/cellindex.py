@@ -0,0 +1,279 @@
+import logging
+from math import floor
+
+import numpy as np
+
+from .arrays import expand_ranges
+from .neighbours import bucket_keys
+
+logger = logging.getLogger("Simulation.CellIndex")
+
+# Arrays an index is made of, besides its bucket size
+ARRAYS = ("segment_offsets", "starts", "ends", "bounds", "keys", "cell_ids")
+
+
+class CellIndex:
+    """Uniform grid over the cell polygons for point-in-cell queries
+
+    Every cell is registered in each bucket overlapped by its bounding box.
+    A point is then only tested against the cells of its own bucket, with an
+    exact even-odd ray casting test over the walls (doors included) of each
+    candidate cell. Cell 0 is the outside of the floorplan: it is never
+    indexed and is returned for points that lie in no other cell.
+
+    Attributes
+    ----------
+    bucket_size: float
+            The width of each bucket
+    bounds: np.ndarray
+            (num_cells, 2, 2) array of the lower and upper corners of each cell
+    segment_offsets: np.ndarray
+            (num_cells + 1,) offsets of the walls of each cell into the segment arrays
+    starts: np.ndarray
+    ends: np.ndarray
+            (s, 2) arrays of the endpoints of the walls of every cell
+
+    Methods
+    -------
+    __init__(cells: List[List[Wall]], bucket_size: float)
+            Builds the grid
+    find_cell(x: float, y: float)
+            Given the coordinates of a point, find the cell it lies in
+    find_cells(xs: np.ndarray, ys: np.ndarray)
+            Given the coordinates of many points, find the cells they lie in
+    in_cell(cell: int, x: float, y: float)
+            Tells whether a point lies in a given cell
+    from_arrays(arrays: Dict[str, np.ndarray])
+            Restores an index from the arrays returned by `to_arrays`
+    to_arrays()
+            Returns the arrays the index is made of
+    """
+
+    def __init__(self, cells, bucket_size=None):
+        """Builds the grid
+
+        Parameters
+        ----------
+        cells: List[List[Wall]]
+                The list of walls for each cell polygon
+        bucket_size: float
+                The width of each bucket, defaults to the mean cell extent
+
+        Returns
+        -------
+        None
+        """
+
+        num_cells = len(cells)
+        counts = np.array([len(walls) for walls in cells], dtype=np.int64)
+        counts[:1] = 0
+        self.segment_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        endpoints = np.array(
+            [wall.endpoints for walls in cells[1:] for wall in walls],
+            dtype=np.float64,
+        ).reshape(-1, 2, 2)
+        self.starts = endpoints[:, 0]
+        self.ends = endpoints[:, 1]
+
+        # Bounding box of each cell, empty for the outside and cells without walls
+        self.bounds = np.empty((num_cells, 2, 2))
+        self.bounds[:, 0] = np.inf
+        self.bounds[:, 1] = -np.inf
+        for cell in range(1, num_cells):
+            start, end = self.segment_offsets[cell], self.segment_offsets[cell + 1]
+            if start == end:
+                continue
+            points = endpoints[start:end].reshape(-1, 2)
+            self.bounds[cell] = (points.min(axis=0), points.max(axis=0))
+
+        indexed = np.flatnonzero(np.isfinite(self.bounds[:, 0, 0]))
+        extents = self.bounds[indexed, 1] - self.bounds[indexed, 0]
+        self.bucket_size = bucket_size or (
+            max(float(extents.max(axis=1).mean()), 1e-9) if len(indexed) else 1.0
+        )
+
+        # Buckets overlapped by the bounding box of each cell
+        low = np.floor(self.bounds[indexed, 0] / self.bucket_size).astype(np.int64)
+        high = np.floor(self.bounds[indexed, 1] / self.bucket_size).astype(np.int64)
+        spans = high - low + 1
+        owners, entries = expand_ranges(
+            np.zeros(len(indexed), dtype=np.int64), spans[:, 0] * spans[:, 1]
+        )
+        gx = low[owners, 0] + entries // spans[owners, 1]
+        gy = low[owners, 1] + entries % spans[owners, 1]
+
+        keys = bucket_keys(gx, gy)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.cell_ids = indexed[owners][order]
+
+        # Per-bucket tuples for scalar queries, built on the first one
+        self._buckets = None
+
+        logger.debug("Indexed %d cells into %d bucket entries", len(indexed), len(keys))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Restores an index from the arrays returned by `to_arrays`
+
+        Parameters
+        ----------
+        arrays: Dict[str, np.ndarray]
+                The arrays of the index
+
+        Returns
+        -------
+        CellIndex
+                The index
+        """
+
+        index = cls.__new__(cls)
+        for name in ARRAYS:
+            setattr(index, name, arrays[name])
+        index.bucket_size = float(arrays["bucket_size"])
+        index._buckets = None
+        return index
+
+    def to_arrays(self):
+        """Returns the arrays the index is made of
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+                The arrays, from which `from_arrays` rebuilds the index
+        """
+
+        arrays = {name: getattr(self, name) for name in ARRAYS}
+        arrays["bucket_size"] = np.float64(self.bucket_size)
+        return arrays
+
+    def _build_lookups(self):
+        self._buckets = {}
+        unique_keys, starts = np.unique(self.keys, return_index=True)
+        for key, start, end in zip(
+            unique_keys.tolist(), starts, np.append(starts[1:], len(self.keys))
+        ):
+            self._buckets[key] = tuple(self.cell_ids[start:end].tolist())
+        self._segments = [
+            list(zip(self.starts[start:end].tolist(), self.ends[start:end].tolist()))
+            for start, end in zip(self.segment_offsets[:-1], self.segment_offsets[1:])
+        ]
+
+    def find_cell(self, x, y):
+        """Given the coordinates of a point, find the cell it lies in
+
+        Parameters
+        ----------
+        x: float
+                The X-coordinate of the point
+        y: float
+                The Y-coordinate of the point
+
+        Returns
+        -------
+        int
+                The cell no. that the point belongs to, 0 if it is outside all cells
+        """
+
+        if self._buckets is None:
+            self._build_lookups()
+        key = bucket_keys(floor(x / self.bucket_size), floor(y / self.bucket_size))
+        for cell in self._buckets.get(key, ()):
+            if self.in_cell(cell, x, y):
+                return cell
+
+        return 0
+
+    def in_cell(self, cell, x, y):
+        """Tells whether a point lies in a given cell
+
+        Parameters
+        ----------
+        cell: int
+                The cell no.
+        x: float
+                The X-coordinate of the point
+        y: float
+                The Y-coordinate of the point
+
+        Returns
+        -------
+        bool
+                Whether the point is inside the walls of the cell, never for
+                the outside (cell 0)
+        """
+
+        if self._buckets is None:
+            self._build_lookups()
+        # Count the walls crossed by the ray from the point towards +x
+        inside = False
+        for (x1, y1), (x2, y2) in self._segments[cell]:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+    def _inside(self, xs, ys, cells):
+        # Even-odd ray casting against every wall of each cell
+        pairs, segments = expand_ranges(
+            self.segment_offsets[cells],
+            self.segment_offsets[cells + 1] - self.segment_offsets[cells],
+        )
+        x, y = xs[pairs], ys[pairs]
+        x1, y1 = self.starts[segments, 0], self.starts[segments, 1]
+        x2, y2 = self.ends[segments, 0], self.ends[segments, 1]
+        straddles = (y1 > y) != (y2 > y)
+        crossing_x = x1 + np.divide(
+            (y - y1) * (x2 - x1), y2 - y1, out=np.zeros_like(x), where=straddles
+        )
+        crossings = np.bincount(
+            pairs, weights=straddles & (x < crossing_x), minlength=len(cells)
+        )
+        return crossings % 2 == 1
+
+    def find_cells(self, xs, ys):
+        """Given the coordinates of many points, find the cells they lie in
+
+        Parameters
+        ----------
+        xs: np.ndarray
+                (n,) array of X-coordinates
+        ys: np.ndarray
+                (n,) array of Y-coordinates
+
+        Returns
+        -------
+        np.ndarray
+                (n,) array of the cell no. of each point, 0 if it is outside all cells
+        """
+
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        keys = bucket_keys(
+            np.floor(xs / self.bucket_size).astype(np.int64),
+            np.floor(ys / self.bucket_size).astype(np.int64),
+        )
+
+        # Candidate cells from the bucket of each point
+        starts = np.searchsorted(self.keys, keys, side="left")
+        counts = np.searchsorted(self.keys, keys, side="right") - starts
+        points, entries = expand_ranges(starts, counts)
+        cells = self.cell_ids[entries]
+
+        # Discard candidates whose bounding box does not contain the point
+        bounds = self.bounds[cells]
+        in_box = (
+            (bounds[:, 0, 0] <= xs[points])
+            & (xs[points] <= bounds[:, 1, 0])
+            & (bounds[:, 0, 1] <= ys[points])
+            & (ys[points] <= bounds[:, 1, 1])
+        )
+        points, cells = points[in_box], cells[in_box]
+
+        inside = self._inside(xs[points], ys[points], cells)
+
+        # Points inside several (overlapping) cells take the lowest cell no.
+        found = np.full(len(xs), np.iinfo(np.int64).max)
+        np.minimum.at(found, points[inside], cells[inside])
+        found[found == np.iinfo(np.int64).max] = 0
+        return found
@@ -0,0 +1,214 @@
+"""Compact encoding of the positions of recorded trajectories
+
+Positions are quantized to a fixed resolution relative to an origin (the
+lower corner of the floorplan). A keyframe stores the quantized positions as
+int32, and the frames after it store int16 deltas against it, as long as no
+agent moved too far and no agent was added. When agents were only removed,
+a bitmask of the keyframe rows still present precedes the deltas. Every chunk
+starts with a keyframe so it can be decoded on its own, and may be compressed
+as a whole.
+"""
+
+import lzma
+import zlib
+
+import numpy as np
+
+KEY_DTYPE = np.dtype(np.int32)
+DELTA_DTYPE = np.dtype(np.int16)
+
+# Kinds of frames, as stored in the keyframes column
+DELTA = 0
+KEYFRAME = 1
+SUBSET_DELTA = 2
+
+# Compressors understood by `compress`, by name
+COMPRESSIONS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def compress(data, compression):
+    """Compresses a chunk
+
+    Parameters
+    ----------
+    data: bytes
+            The chunk
+    compression: str
+            "zlib", "lzma", or None to keep the chunk as is
+
+    Returns
+    -------
+    bytes
+            The compressed chunk
+    """
+
+    if compression is None:
+        return data
+    return COMPRESSIONS[compression][0](data)
+
+
+def decompress(data, compression):
+    """Decompresses a chunk compressed by `compress`
+
+    Parameters
+    ----------
+    data: bytes
+            The compressed chunk
+    compression: str
+            The compression it was compressed with
+
+    Returns
+    -------
+    bytes
+            The chunk
+    """
+
+    if compression is None:
+        return data
+    return COMPRESSIONS[compression][1](data)
+
+
+def quantize(points, origin, resolution):
+    """Returns the points as integer multiples of the resolution from the origin
+
+    Parameters
+    ----------
+    points: np.ndarray
+            (n, 2) array of points
+    origin: np.ndarray
+            The point quantized to (0, 0)
+    resolution: float
+            The size of one quantization step
+
+    Returns
+    -------
+    np.ndarray
+            (n, 2) int64 array of the quantized points
+    """
+
+    return np.rint((points - origin) / resolution).astype(np.int64)
+
+
+def encode_positions(positions, counts, ids, origin, resolution, keyframe_interval):
+    """Encodes the positions of consecutive frames as keyframes and deltas
+
+    Parameters
+    ----------
+    positions: np.ndarray
+            (rows, 2) array of the positions of every frame, one after the other
+    counts: np.ndarray
+            (frames,) number of rows of each frame
+    ids: np.ndarray
+            (rows,) agent ids of the rows, sorted within each frame. A frame
+            is only delta encoded if its ids are among those of its keyframe
+    origin: np.ndarray
+            The point quantized to (0, 0)
+    resolution: float
+            The size of one quantization step
+    keyframe_interval: int
+            The most frames from one keyframe to the next
+
+    Returns
+    -------
+    Tuple[bytes, np.ndarray]
+            The encoded positions, and (frames,) uint8 kinds of the frames
+    """
+
+    quantized = quantize(positions, origin, resolution)
+    if len(quantized) and np.abs(quantized).max() > np.iinfo(KEY_DTYPE).max:
+        raise ValueError(
+            f"Positions are too far from the origin for a resolution of {resolution}"
+        )
+
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    kinds = np.full(len(counts), DELTA, dtype=np.uint8)
+    limit = np.iinfo(DELTA_DTYPE).max
+    parts = []
+    key = key_ids = None
+    since_key = 0
+    for frame in range(len(counts)):
+        rows = slice(offsets[frame], offsets[frame + 1])
+        if key is not None and since_key < keyframe_interval:
+            # Rows of the keyframe holding the agents of this frame
+            present = np.searchsorted(key_ids, ids[rows])
+            same = np.array_equal(ids[rows], key_ids)
+            if same or np.array_equal(
+                key_ids[present[present < len(key_ids)]], ids[rows]
+            ):
+                delta = quantized[rows] - (key if same else key[present])
+                if np.abs(delta).max(initial=0) <= limit:
+                    if not same:
+                        mask = np.zeros(len(key_ids), dtype=bool)
+                        mask[present] = True
+                        parts.append(np.packbits(mask).tobytes())
+                        kinds[frame] = SUBSET_DELTA
+                    parts.append(delta.astype(DELTA_DTYPE).tobytes())
+                    since_key += 1
+                    continue
+
+        key, key_ids, since_key = quantized[rows], ids[rows], 1
+        kinds[frame] = KEYFRAME
+        parts.append(key.astype(KEY_DTYPE).tobytes())
+
+    return b"".join(parts), kinds
+
+
+def decode_positions(data, counts, keyframes, frame, origin, resolution):
+    """Decodes the positions of one frame of a chunk encoded by `encode_positions`
+
+    Parameters
+    ----------
+    data: bytes
+            The encoded positions of the chunk
+    counts: np.ndarray
+            (frames,) number of rows of each frame of the chunk
+    keyframes: np.ndarray
+            (frames,) kinds of the frames of the chunk
+    frame: int
+            The frame of the chunk to decode
+    origin: np.ndarray
+            The point quantized to (0, 0)
+    resolution: float
+            The size of one quantization step
+
+    Returns
+    -------
+    np.ndarray
+            (n, 2) array of the positions of the frame
+    """
+
+    kinds = np.asarray(keyframes)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    # Size of each frame, the masks of subset deltas cover the rows of their keyframe
+    is_key = kinds == KEYFRAME
+    key_of_frame = np.maximum.accumulate(np.where(is_key, np.arange(len(kinds)), 0))
+    mask_bytes = (counts[key_of_frame] + 7) // 8
+    sizes = np.where(
+        is_key, counts * 2 * KEY_DTYPE.itemsize, counts * 2 * DELTA_DTYPE.itemsize
+    )
+    sizes += np.where(kinds == SUBSET_DELTA, mask_bytes, 0)
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+
+    key = int(key_of_frame[frame])
+    quantized = np.frombuffer(
+        data, dtype=KEY_DTYPE, count=int(counts[key]) * 2, offset=int(starts[key])
+    ).reshape(-1, 2)
+    if key != frame:
+        offset = int(starts[frame])
+        if kinds[frame] == SUBSET_DELTA:
+            mask = np.frombuffer(
+                data, dtype=np.uint8, count=int(mask_bytes[frame]), offset=offset
+            )
+            quantized = quantized[
+                np.unpackbits(mask, count=len(quantized)).astype(bool)
+            ]
+            offset += int(mask_bytes[frame])
+        delta = np.frombuffer(
+            data, dtype=DELTA_DTYPE, count=int(counts[frame]) * 2, offset=offset
+        ).reshape(-1, 2)
+        quantized = quantized + delta
+    return quantized.astype(np.int64) * resolution + origin
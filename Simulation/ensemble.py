@@ -0,0 +1,260 @@
+import logging
+import multiprocessing
+import time
+from dataclasses import asdict, dataclass, fields
+
+import numpy as np
+
+from .arraysimulation import ArraySimulation
+from .streams import seed_sequence
+
+logger = logging.getLogger("Simulation.Ensemble")
+
+# Percentiles reported by EnsembleStats
+PERCENTILES = (5, 50, 95)
+
+# Floorplan and sources shared by the replications of a worker process
+_floorplan = None
+_sources = ()
+
+
+@dataclass
+class RunSummary:
+    """Summary statistics of a single replication
+
+    Attributes
+    ----------
+    seed: int
+            The seed of the ensemble
+    run: int
+            The index of the replication, whose stream is
+            SeedSequence(seed, spawn_key=(run,))
+    frames: int
+            The number of frames simulated, fewer than SIMULATION_LENGTH if
+            every agent was removed on arrival
+    agents: int
+            The number of agents
+    arrived: int
+            The number of agents that reached their destination
+    evacuation_time: float
+            The frame by which every agent had arrived, nan if some never did
+    mean_arrival_time: float
+            The mean frame at which the agents that arrived did so
+    door_crossings: int
+            The total number of door crossings
+    peak_flow: int
+            The largest number of door crossings in one frame
+    mean_speed: float
+            The mean speed of the agents over the run
+    runtime: float
+            Wall-clock seconds taken by the replication
+    """
+
+    seed: int
+    run: int
+    frames: int
+    agents: int
+    arrived: int
+    evacuation_time: float
+    mean_arrival_time: float
+    door_crossings: int
+    peak_flow: int
+    mean_speed: float
+    runtime: float
+
+
+def _initialize_worker(floorplan, sources):
+    global _floorplan, _sources
+    _floorplan = floorplan
+    _sources = sources
+
+
+def run_replication(params, floorplan, seed, sources=()):
+    """Runs one replication and summarises it
+
+    Parameters
+    ----------
+    params: Params
+            The parameters of the simulation
+    floorplan: Floorplan
+            The floorplan of the simulation
+    seed: np.random.SeedSequence
+            The seed of the random number stream of the replication
+    sources: List[AgentSource]
+            The sources adding agents during the run
+
+    Returns
+    -------
+    RunSummary
+            The summary statistics of the run
+    """
+
+    start = time.perf_counter()
+
+    sim = ArraySimulation(params, floorplan, rng=seed, sources=sources)
+
+    # Arrival frame of each agent, by id, as agents may be removed on arrival
+    # and sources may add new ones
+    agents = sim.agents
+    arrival = np.full(len(agents), -1, dtype=np.int64)
+    arrival[agents.ids[agents.cells == agents.dests]] = 0
+    crossings = []
+    speed_sum = 0.0
+    agent_frames = 0
+
+    frames = 0
+    for frame in range(1, params.basic_parameters.SIMULATION_LENGTH + 1):
+        sim.nextFrame()
+        frames = frame
+        agents = sim.agents
+        if len(agents) and agents.ids.max() >= len(arrival):
+            added = int(agents.ids.max()) + 1 - len(arrival)
+            arrival = np.concatenate((arrival, np.full(added, -1, dtype=np.int64)))
+        arrived = agents.ids[agents.cells == agents.dests]
+        arrival[arrived[arrival[arrived] < 0]] = frame
+        arrival[sim.exited[arrival[sim.exited] < 0]] = frame
+        crossings.append(len(sim.crossings[0]))
+        speed_sum += np.hypot(agents.velocities[:, 0], agents.velocities[:, 1]).sum()
+        agent_frames += len(agents)
+        if not len(agents) and not sources:
+            break
+
+    arrived = arrival >= 0
+    return RunSummary(
+        seed=seed.entropy,
+        run=seed.spawn_key[-1] if seed.spawn_key else 0,
+        frames=frames,
+        agents=len(arrival),
+        arrived=int(arrived.sum()),
+        evacuation_time=float(arrival.max()) if arrived.all() else float("nan"),
+        mean_arrival_time=(
+            float(arrival[arrived].mean()) if arrived.any() else float("nan")
+        ),
+        door_crossings=int(sum(crossings)),
+        peak_flow=max(crossings, default=0),
+        mean_speed=float(speed_sum) / max(agent_frames, 1),
+        runtime=time.perf_counter() - start,
+    )
+
+
+def _run_in_worker(task):
+    params, seed = task
+    return run_replication(params, _floorplan, seed, _sources)
+
+
+def run_ensemble(params, floorplan, runs, workers=None, seed=0, sources=()):
+    """Runs many replications of one scenario in a process pool
+
+    The floorplan and the sources are built once by the caller and sent
+    once to each worker process. Every replication gets its own random number stream, spawned
+    from `seed`.
+
+    Parameters
+    ----------
+    params: Params
+            The parameters of the simulation
+    floorplan: Floorplan
+            The floorplan of the simulation
+    runs: int
+            The number of replications
+    workers: int
+            The number of worker processes, defaults to the number of CPUs
+    seed: int | np.random.SeedSequence
+            The seed from which the streams of the replications are spawned
+    sources: List[AgentSource]
+            The sources adding agents during every run
+
+    Yields
+    ------
+    RunSummary
+            The summary of each replication, in the order they finish
+    """
+
+    seeds = seed_sequence(seed).spawn(runs)
+    tasks = [(params, run_seed) for run_seed in seeds]
+    with multiprocessing.Pool(
+        workers, initializer=_initialize_worker, initargs=(floorplan, sources)
+    ) as pool:
+        yield from pool.imap_unordered(_run_in_worker, tasks)
+
+
+class EnsembleStats:
+    """Aggregates the summaries of replications as they finish
+
+    Attributes
+    ----------
+    summaries: List[RunSummary]
+            The summaries added so far
+
+    Methods
+    -------
+    add(summary: RunSummary)
+            Adds the summary of a finished replication
+    aggregate()
+            Returns the mean and percentiles of every metric
+    to_records()
+            Returns the summaries as a list of dictionaries
+    """
+
+    # Metrics of RunSummary that are aggregated
+    METRICS = [
+        field.name
+        for field in fields(RunSummary)
+        if field.name not in ("seed", "run", "frames", "agents")
+    ]
+
+    def __init__(self):
+        self.summaries = []
+
+    def __len__(self):
+        return len(self.summaries)
+
+    def add(self, summary):
+        """Adds the summary of a finished replication
+
+        Parameters
+        ----------
+        summary: RunSummary
+                The summary to add
+
+        Returns
+        -------
+        None
+        """
+
+        self.summaries.append(summary)
+
+    def aggregate(self):
+        """Returns the mean and percentiles of every metric
+
+        Replications in which not every agent arrived are left out of the
+        evacuation time statistics, and counted in `incomplete_runs`.
+
+        Returns
+        -------
+        Dict[str, Dict[str, float]]
+                For every metric, its mean and percentiles (as "p5", "p50", ...)
+        """
+
+        result = {"runs": len(self.summaries)}
+        for metric in self.METRICS:
+            values = np.array([getattr(s, metric) for s in self.summaries], float)
+            values = values[~np.isnan(values)]
+            if not len(values):
+                result[metric] = None
+                continue
+            result[metric] = {"mean": float(values.mean())}
+            for percentile, value in zip(
+                PERCENTILES, np.percentile(values, PERCENTILES)
+            ):
+                result[metric][f"p{percentile}"] = float(value)
+
+        result["incomplete_runs"] = sum(
+            bool(np.isnan(summary.evacuation_time)) for summary in self.summaries
+        )
+        return result
+
+    def to_records(self):
+        """Returns the summaries as a list of dictionaries"""
+
+        return [asdict(summary) for summary in self.summaries]
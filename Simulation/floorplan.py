@@ -1,11 +1,36 @@
+import heapq
+import json
 import logging
 from collections import defaultdict
-from math import inf
+from math import hypot, inf
 
+import numpy as np
+
+from .arrays import expand_ranges
+from .cellindex import CellIndex
+from .geometry import segments_intersect
+from .plancache import bytes_key, geometry_key
 from .wall import Wall
+from .wallindex import WallIndex
 
 logger = logging.getLogger("Simulation.Floorplan")
 
+# Version of the floorplan file format
+VERSION = 1
+
+# Default margin of the wall index used to find the walls crossed by a movement
+CROSSING_MARGIN = 5.0
+
+# Door lookup tables laid out by cell, stored in the floorplan cache
+DOOR_TABLES = (
+    "door_offsets",
+    "door_walls",
+    "door_centres",
+    "door_segments",
+    "door_ids",
+    "door_targets",
+)
+
 
 class Floorplan:
     """Contains information and behaviours regarding the floorplan of the simulation space
@@ -18,22 +43,68 @@ class Floorplan:
             The list of walls for each cell
     distribution: List[int]
             The intended distribution of each person amongst the cells
-    distances: List[List[float]]
-            The distances between every pair of doors
     doors: List[List[Wall]]
             THe list of doors for each cell
+    door_nodes: List[Wall]
+            Every door of the floorplan, indexed by its node number
+    adjacency_starts: np.ndarray
+            (doors + 1,) offsets of the neighbours of each door node
+    adjacency_nodes: np.ndarray
+    adjacency_weights: np.ndarray
+            The neighbouring door nodes of every door node and their distances
+    doors_between: Dict[Tuple[int, int], List[Wall]]
+            The doors connecting each pair of cells, keyed by (lower cell, higher cell)
+    door_offsets: np.ndarray
+            (num_cells + 1,) offsets of the door slots of each cell, the doors
+            of cell c being the slots door_offsets[c] to door_offsets[c + 1]
+    door_walls: np.ndarray
+            (slots,) array of the index of the door in each slot among the walls of its cell
+    door_centres: np.ndarray
+            (slots, 2) array of the centre of the door in each slot
+    door_segments: np.ndarray
+            (slots, 2, 2) array of the endpoints of the door in each slot
+    door_ids: np.ndarray
+            (slots,) array of the door node in each slot
+    door_targets: np.ndarray
+            (slots,) array of the cell on the other side of the door in each slot
+    cell_index: CellIndex
+            The spatial index used to find the cell of a point
 
     Methods
     -------
-    __init__(graph: List[List[int]], walls: List[List[int]])
+    __init__(cells: List[List[Wall]], distribution: List[int], cache: FloorplanCache, key: str)
             Initializes the floorplan and stores information
+    load(path: str, cache: FloorplanCache)
+            Reads a floorplan from a file
+    save(path: str)
+            Writes the floorplan to a file
     find_cell(x: int, y: int)
             Given the coordinates of a point, find the cell it lies in
+    find_cells(xs: np.ndarray, ys: np.ndarray)
+            Given the coordinates of many points, find the cells they lie in
     find_shortest_paths()
-            Calculate the shortest path between every pair of door and cell
+            Build the sparse graph used to find shortest paths between doors
+    shortest_distances(sources: Iterable[int])
+            Dijkstra's algorithm from a set of source doors
+    distances_to_cell(cell: int)
+            Returns the shortest distance from every door to the closest door of a cell
+    exit_costs(dest: int)
+            Returns the remaining path cost through each door of every cell to a destination
+    door_slots(cells: np.ndarray)
+            Returns the door slots of many cells
+    choose_exit_doors(positions: np.ndarray, cells: np.ndarray, dests: np.ndarray)
+            Finds the door each agent should head for to reach its destination
+    cross_door(old_pos: Tuple[float, float], new_pos: Tuple[float, float], cell: int, margin: float)
+            Finds the door of a cell crossed by a movement, if any
+    cross_doors(old_positions: np.ndarray, new_positions: np.ndarray, cells: np.ndarray, margin: float)
+            Finds the doors crossed by many movements at once
+    wall_index(margin: float)
+            Returns the spatial index over the walls for a given force margin
+    sees_through_door(a: Tuple[float, float], a_cell: int, b: Tuple[float, float], b_cell: int)
+            Checks whether two points are in the same cell or see each other through a door
     """
 
-    def __init__(self, cells, distribution):
+    def __init__(self, cells, distribution, cache=None, key=None):
         """Initializes the floorplan and stores information
 
         Parameters
@@ -42,6 +113,13 @@ class Floorplan:
                         The list of walls for each cell polygon
         distribution: List[int]
                         The intended distribution of each person amongst the cells
+        cache: FloorplanCache
+                        Where the door graph, door distances and cell index are
+                        reloaded from if the geometry was seen before, and
+                        stored otherwise
+        key: str
+                        The key of the geometry in the cache, hashed from the
+                        walls of every cell if not given
 
         Returns
         -------
@@ -52,77 +130,530 @@ class Floorplan:
         self.cells = cells
         self.distribution = distribution
 
-        # Filter list of doors
-        self.doors = [
-            [wall for wall in walls if wall.state == Wall.DOOR] for walls in self.cells
-        ]
+        # Derived navigation data of the same geometry, if it is cached
+        if cache is not None and key is None:
+            key = geometry_key(self.cells)
+        cached = cache.get(key) if cache is not None else None
+
+        # Spatial indexes over the walls, built on demand for each force margin
+        self._wall_indexes = {}
+
+        if cached is None:
+            # Filter list of doors
+            self.doors = [
+                [wall for wall in walls if wall.state == Wall.DOOR]
+                for walls in self.cells
+            ]
+
+            # Spatial index over the cells, and the graph of doors
+            self.cell_index = CellIndex(self.cells)
+            self.find_shortest_paths()
+            self._build_door_tables()
+        else:
+            # Only the doors are picked out of the walls, by their position
+            offsets = cached["door_offsets"].tolist()
+            positions = cached["door_walls"].tolist()
+            self.doors = [
+                [walls[i] for i in positions[start:end]]
+                for walls, start, end in zip(self.cells, offsets, offsets[1:])
+            ]
+            self.cell_index = CellIndex.from_arrays(cached)
+            self._number_doors()
+            self._set_adjacency(
+                cached["adjacency_starts"],
+                cached["adjacency_nodes"],
+                cached["adjacency_weights"],
+            )
+            self._cell_distances = dict(
+                zip(cached["distance_cells"].tolist(), cached["distance_table"])
+            )
+            for name in DOOR_TABLES:
+                setattr(self, name, cached[name])
+
+        self.doors_between = defaultdict(list)
+        for door in self.door_nodes:
+            self.doors_between[tuple(sorted(door.connection))].append(door)
+
+        # Precompute exit costs for every destination that has agents
+        self._exit_costs = {}
+        for dest, num_agents in enumerate(self.distribution):
+            if num_agents:
+                self.exit_costs(dest)
 
-        # Find shortest distances between every pair of door and cell
-        self.find_shortest_paths()
+        if cache is not None and (
+            cached is None or len(self._cell_distances) > len(cached["distance_cells"])
+        ):
+            cache.put(key, self._navigation_arrays())
 
     def find_shortest_paths(self):
-        """Calculate the shortest path between every pair of doors
+        """Build the sparse graph used to find shortest paths between doors
+
+        Every door is a node of the graph, and the doors of each cell are
+        connected by edges weighted by the distance between their centres.
+        The edges are stored as compressed sparse rows. Shortest distances
+        are not computed here, but on demand and once per destination cell
+        by `distances_to_cell`.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None
+        """
+
+        self._number_doors()
+
+        # Both directions of every pair of doors of a cell
+        sources, targets, weights = [], [], []
+        for doors in self.doors:
+            if len(doors) < 2:
+                continue
+            nodes = np.array([door.door_node for door in doors], dtype=np.int64)
+            centres = np.array([door.center for door in doors], dtype=np.float64)
+            i, j = np.triu_indices(len(doors), 1)
+            delta = centres[i] - centres[j]
+            distances = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2)
+            sources += [nodes[i], nodes[j]]
+            targets += [nodes[j], nodes[i]]
+            weights += [distances, distances]
+
+        sources = np.concatenate(sources or [np.zeros(0, dtype=np.int64)])
+        order = np.argsort(sources, kind="stable")
+        counts = np.bincount(sources, minlength=len(self.door_nodes))
+        self._set_adjacency(
+            np.concatenate(([0], np.cumsum(counts))),
+            np.concatenate(targets or [np.zeros(0, dtype=np.int64)])[order],
+            np.concatenate(weights or [np.zeros(0)])[order],
+        )
+        self._cell_distances = {}
+
+    def _number_doors(self):
+        # Assign a node number to every door, shared by the two cells it connects
+        self.door_nodes = list(
+            dict.fromkeys(door for doors in self.doors for door in doors)
+        )
+        for node, door in enumerate(self.door_nodes):
+            door.door_node = node
+
+    def _build_door_tables(self):
+        # The doors of every cell, one after the other
+        counts = [len(doors) for doors in self.doors]
+        slots = [
+            (cell, door) for cell, doors in enumerate(self.doors) for door in doors
+        ]
+        self.door_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.door_walls = np.array(
+            [
+                position
+                for walls in self.cells
+                for position, wall in enumerate(walls)
+                if wall.state == Wall.DOOR
+            ],
+            dtype=np.int64,
+        )
+        self.door_centres = np.array(
+            [door.center for _, door in slots], dtype=np.float64
+        ).reshape(-1, 2)
+        self.door_segments = np.array(
+            [door.endpoints for _, door in slots], dtype=np.float64
+        ).reshape(-1, 2, 2)
+        self.door_ids = np.array([door.door_node for _, door in slots], dtype=np.int64)
+        self.door_targets = np.array(
+            [door.connection[door.connection[0] == cell] for cell, door in slots],
+            dtype=np.int64,
+        )
+
+    def _set_adjacency(self, starts, nodes, weights):
+        self.adjacency_starts = starts
+        self.adjacency_nodes = nodes
+        self.adjacency_weights = weights
+        self._adjacency_lists = None
+        self._distances = None
+
+    def _navigation_arrays(self):
+        cells = sorted(self._cell_distances)
+        return {
+            **self.cell_index.to_arrays(),
+            **{name: getattr(self, name) for name in DOOR_TABLES},
+            "adjacency_starts": self.adjacency_starts,
+            "adjacency_nodes": self.adjacency_nodes,
+            "adjacency_weights": self.adjacency_weights,
+            "distance_cells": np.array(cells, dtype=np.int64),
+            "distance_table": np.array(
+                [self._cell_distances[cell] for cell in cells], dtype=np.float64
+            ).reshape(len(cells), len(self.door_nodes)),
+        }
+
+    @property
+    def adjacency(self):
+        """The neighbouring door nodes of each door node and their distances
+
+        Kept for compatibility, as lists of (node, distance) pairs built from
+        the compressed sparse rows.
+        """
+
+        nodes = self.adjacency_nodes.tolist()
+        weights = self.adjacency_weights.tolist()
+        starts = self.adjacency_starts.tolist()
+        return [
+            list(zip(nodes[start:end], weights[start:end]))
+            for start, end in zip(starts, starts[1:])
+        ]
+
+    def shortest_distances(self, sources):
+        """Dijkstra's algorithm from a set of source doors
+
+        Parameters
+        ----------
+        sources: Iterable[int]
+                The door nodes to start from
+
+        Returns
+        -------
+        np.ndarray
+                The distance from every door node to the closest source
+        """
+
+        if self._adjacency_lists is None:
+            self._adjacency_lists = (
+                self.adjacency_starts.tolist(),
+                self.adjacency_nodes.tolist(),
+                self.adjacency_weights.tolist(),
+            )
+        starts, nodes, weights = self._adjacency_lists
+
+        distances = np.full(len(self.door_nodes), inf)
+        queue = []
+        for source in sources:
+            distances[source] = 0
+            queue.append((0.0, source))
+        heapq.heapify(queue)
+
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue
+            for edge in range(starts[node], starts[node + 1]):
+                neighbour = nodes[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances[neighbour]:
+                    distances[neighbour] = new_distance
+                    heapq.heappush(queue, (new_distance, neighbour))
+
+        return distances
+
+    def distances_to_cell(self, cell):
+        """Returns the shortest distance from every door to the closest door of a cell
+
+        The result is computed on the first call for each cell and cached.
+
+        Parameters
+        ----------
+        cell: int
+                The destination cell
 
-        This function uses the Flloyd-Warshall algorithm to compute the
-        All Pair Shortest Path (APSP) between every pair of doors in the floorplan.
+        Returns
+        -------
+        np.ndarray
+                The distance from every door node to the destination cell
+        """
+
+        if cell not in self._cell_distances:
+            self._cell_distances[cell] = self.shortest_distances(
+                door.door_node for door in self.doors[cell]
+            )
+        return self._cell_distances[cell]
+
+    def exit_costs(self, dest):
+        """Returns the remaining path cost through each door of every cell to a destination
 
         Parameters
         ----------
+        dest: int
+                The destination cell
 
         Returns
         -------
+        np.ndarray
+                (slots,) array laid out like `door_ids`, inf where a door
+                cannot reach the destination
         """
 
-        # Find edges of doors
-        doors = []
-        edges = []
-        for cell_no, walls in enumerate(self.cells):
-            for i in range(len(self.doors[cell_no])):
-                # Assign a node number
-                self.doors[cell_no][i].door_node = len(doors) + i
-
-                # Distance between each door and itself is 0
-                edges.append((len(doors) + i, len(doors) + i, 0))
-
-                for j in range(i + 1, len(self.doors[cell_no])):
-                    # Compute distance between each pair of edges
-                    door_center = (
-                        (
-                            self.doors[cell_no][j].endpoints[0][0]
-                            + self.doors[cell_no][j].endpoints[1][0]
-                        )
-                        / 2,
-                        (
-                            self.doors[cell_no][j].endpoints[0][1]
-                            + self.doors[cell_no][j].endpoints[1][1]
-                        )
-                        / 2,
-                    )
-                    edges.append(
-                        (
-                            len(doors) + i,
-                            len(doors) + j,
-                            self.doors[cell_no][i].distance_to_door(door_center),
-                        )
-                    )
-
-            doors += self.doors[cell_no]
-
-        # Compute adjacency matrix of the graph
-        num_doors = len(doors)
-        self.distances = [[inf] * num_doors for _ in range(num_doors)]
-        for u, v, w in edges:
-            self.distances[u][v] = w
-            self.distances[v][v] = w
-
-        # Flloyd-Warshall's algorithm
-        for k in range(num_doors):
-            for i in range(num_doors):
-                for j in range(num_doors):
-                    self.distances[i][j] = min(
-                        self.distances[i][j],
-                        self.distances[i][k] + self.distances[k][j],
-                    )
+        if dest not in self._exit_costs:
+            self._exit_costs[dest] = self.distances_to_cell(dest)[self.door_ids]
+        return self._exit_costs[dest]
+
+    def door_slots(self, cells):
+        """Returns the door slots of many cells
+
+        Parameters
+        ----------
+        cells: np.ndarray
+                (n,) array of cells
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                For every door of every cell, the index of the cell in `cells`
+                and the door slot, grouped by cell in the order of `cells`
+        """
+
+        starts = self.door_offsets[cells]
+        return expand_ranges(starts, self.door_offsets[cells + 1] - starts)
+
+    def choose_exit_doors(self, positions, cells, dests):
+        """Finds the door each agent should head for to reach its destination
+
+        The door minimising the distance to the door plus the remaining path
+        cost from the door to the destination is chosen. Every agent is only
+        compared with the doors of its own cell.
+
+        Parameters
+        ----------
+        positions: np.ndarray
+                (n, 2) array of agent positions
+        cells: np.ndarray
+                (n,) array of the current cell of each agent
+        dests: np.ndarray
+                (n,) array of the destination cell of each agent
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                The door node chosen for each agent (-1 where no door leads to
+                the destination), and the vector from each agent to the centre
+                of its door
+        """
+
+        nodes = np.full(len(positions), -1, dtype=np.int64)
+        vectors = np.zeros_like(positions)
+        agents, slots = self.door_slots(cells)
+        if not len(slots):
+            return nodes, vectors
+
+        vec = self.door_centres[slots] - positions[agents]
+        total = np.hypot(vec[:, 0], vec[:, 1])
+        pair_dests = dests[agents]
+        for dest in np.unique(pair_dests).tolist():
+            in_group = pair_dests == dest
+            total[in_group] += self.exit_costs(dest)[slots[in_group]]
+
+        # The first of the cheapest doors of every agent, the pairs of each
+        # agent being contiguous
+        order = np.lexsort((total, agents))
+        counts = np.bincount(agents, minlength=len(positions))
+        has_doors = np.flatnonzero(counts)
+        best = order[(np.cumsum(counts) - counts)[has_doors]]
+        reachable = np.isfinite(total[best])
+        best = best[reachable]
+        nodes[has_doors[reachable]] = self.door_ids[slots[best]]
+        vectors[has_doors[reachable]] = vec[best]
+        return nodes, vectors
+
+    @property
+    def distances(self):
+        """The distances between every pair of doors
+
+        Kept for compatibility; this runs Dijkstra's algorithm from every door
+        so prefer `distances_to_cell` wherever possible.
+        """
+
+        if self._distances is None:
+            self._distances = np.array(
+                [
+                    self.shortest_distances((node,))
+                    for node in range(len(self.door_nodes))
+                ]
+            ).reshape(len(self.door_nodes), len(self.door_nodes))
+        return self._distances
+
+    def cross_door(self, old_pos, new_pos, cell, margin=None):
+        """Finds the door of a cell crossed by a movement, if any
+
+        An agent can only leave its cell through one of the doors of the cell,
+        so only those doors are tested. Nothing stops an agent from being
+        pushed through a solid wall, or from moving past the cell behind a
+        door, though, so a movement that also crosses a solid wall of its
+        cells, or another door of the cell behind the door, is located again
+        with `find_cell`.
+
+        Parameters
+        ----------
+        old_pos: Tuple[float, float]
+                The position before the movement
+        new_pos: Tuple[float, float]
+                The position after the movement
+        cell: int
+                The cell at the start of the movement
+        margin: float
+                The margin of the wall index whose buckets give the solid walls
+                near the movement, movements longer than it are always located
+                again. Defaults to CROSSING_MARGIN
+
+        Returns
+        -------
+        Tuple[int, Wall]
+                The cell at the end of the movement, and the door crossed or None
+        """
+
+        line = (old_pos, new_pos)
+        crossed = [door for door in self.doors[cell] if door.intersects(line)]
+        if not crossed:
+            cells, new_cell, past = (cell,), cell, []
+        else:
+            new_cell = crossed[0].connection[crossed[0].connection[0] == cell]
+            cells = (cell, new_cell)
+            past = [door for door in self.doors[new_cell] if door is not crossed[0]]
+
+        wall_index = self.wall_index(CROSSING_MARGIN if margin is None else margin)
+        if (
+            len(crossed) > 1
+            or hypot(new_pos[0] - old_pos[0], new_pos[1] - old_pos[1])
+            > wall_index.margin
+            or any(door.intersects(line) for door in past)
+            or any(
+                wall.intersects(line)
+                for near in cells
+                for wall in wall_index.walls_near(new_pos, near)
+            )
+        ):
+            return self.find_cell(*new_pos), crossed[0] if crossed else None
+        return new_cell, crossed[0] if crossed else None
+
+    def cross_doors(self, old_positions, new_positions, cells, margin=None):
+        """Finds the doors crossed by many movements at once
+
+        Like `cross_door`, only the doors of the cells and the solid walls
+        near the movements are tested, and only the movements that cross a
+        solid wall or more than one door are located again with `find_cells`.
+
+        Parameters
+        ----------
+        old_positions: np.ndarray
+                (n, 2) array of positions before the movement
+        new_positions: np.ndarray
+                (n, 2) array of positions after the movement
+        cells: np.ndarray
+                (n,) array of the cells at the start of the movement
+        margin: float
+                The margin of the wall index whose buckets give the solid walls
+                near the movements, movements longer than it are always located
+                again. Defaults to CROSSING_MARGIN
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                The cells at the end of the movement, and the door node crossed
+                by each movement (-1 where no door was crossed)
+        """
+
+        doors = np.full(len(cells), -1, dtype=np.int64)
+        new_cells = cells.copy()
+        agents, slots = self.door_slots(cells)
+        crossed = np.flatnonzero(
+            segments_intersect(
+                old_positions[agents],
+                new_positions[agents],
+                self.door_segments[slots, 0],
+                self.door_segments[slots, 1],
+            )
+        )
+
+        # The first door crossed by each movement
+        movers, first, counts = np.unique(
+            agents[crossed], return_index=True, return_counts=True
+        )
+        crossed_slots = slots[crossed[first]]
+        doors[movers] = self.door_ids[crossed_slots]
+        new_cells[movers] = self.door_targets[crossed_slots]
+        lost = [movers[counts > 1]]
+
+        # Movers that went on through another door of the cell behind the door
+        agents, slots = self.door_slots(new_cells[movers])
+        past = slots != crossed_slots[agents]
+        agents, slots = movers[agents[past]], slots[past]
+        lost.append(
+            agents[
+                segments_intersect(
+                    old_positions[agents],
+                    new_positions[agents],
+                    self.door_segments[slots, 0],
+                    self.door_segments[slots, 1],
+                )
+            ]
+        )
+
+        # Movements through a solid wall of their cells, the walls crossed by
+        # a movement short enough being in the bucket of its end
+        wall_index = self.wall_index(CROSSING_MARGIN if margin is None else margin)
+        moves = new_positions - old_positions
+        lost.append(
+            np.flatnonzero(np.hypot(moves[:, 0], moves[:, 1]) > wall_index.margin)
+        )
+        for points, points_cells in ((None, cells), (movers, new_cells[movers])):
+            ends = new_positions if points is None else new_positions[points]
+            agents, walls = wall_index.candidates(ends, points_cells)
+            if points is not None:
+                agents = points[agents]
+            hits = segments_intersect(
+                old_positions[agents],
+                new_positions[agents],
+                wall_index.starts[walls],
+                wall_index.ends[walls],
+            )
+            lost.append(agents[hits])
+
+        lost = np.unique(np.concatenate(lost))
+        if len(lost):
+            new_cells[lost] = self.find_cells(
+                new_positions[lost, 0], new_positions[lost, 1]
+            )
+        return new_cells, doors
+
+    def wall_index(self, margin):
+        """Returns the spatial index over the walls for a given force margin
+
+        Parameters
+        ----------
+        margin: float
+                The distance up to which walls exert a force
+
+        Returns
+        -------
+        WallIndex
+                The index, built on the first call for each margin
+        """
+
+        if margin not in self._wall_indexes:
+            self._wall_indexes[margin] = WallIndex(self.cells, margin)
+        return self._wall_indexes[margin]
+
+    def sees_through_door(self, a, a_cell, b, b_cell):
+        """Checks whether two points are in the same cell or see each other through a door
+
+        Parameters
+        ----------
+        a: Tuple[float, float]
+                The first point
+        a_cell: int
+                The cell of the first point
+        b: Tuple[float, float]
+                The second point
+        b_cell: int
+                The cell of the second point
+
+        Returns
+        -------
+        bool
+                Whether the segment ab stays in one cell or crosses a door between the cells
+        """
+
+        if a_cell == b_cell:
+            return True
+
+        doors = self.doors_between.get((min(a_cell, b_cell), max(a_cell, b_cell)), ())
+        return any(door.intersects((a, b)) for door in doors)
 
     def find_cell(self, x, y):
         """Given the coordinates of a point, find the cell it lies in
@@ -139,24 +670,26 @@ class Floorplan:
         int
                 The cell no. that the point belongs to
         """
-        # for cell_no in range(1, len(self.cells)):
-        #     # Check number of walls that intersect with the line
-        #     # (0, y) -> (x, y)
-        #     intersections = 0
-        #     for wall in self.cells[cell_no]:
-        #         intersections += wall.intersects(((0, y), (x, y)))
-        #
-        #     # If the num of intersections is odd, the point is inside the cell
-        #     if intersections % 2 == 1:
-        #         logger.debug(f"{x, y} lies in cell {cell_no}")
-        #         return cell_no
-        #
-        # logger.debug(f"{x, y} lies in cell 0")
-        #
-        # # return 1 if x > 50 else 2
-        # # Outside all cells
-        # return 0
-        return (x > 50) + 1
+
+        return self.cell_index.find_cell(x, y)
+
+    def find_cells(self, xs, ys):
+        """Given the coordinates of many points, find the cells they lie in
+
+        Parameters
+        ----------
+        xs: np.ndarray
+                The X-coordinates of the points
+        ys: np.ndarray
+                The Y-coordinates of the points
+
+        Returns
+        -------
+        np.ndarray
+                The cell no. that each point belongs to
+        """
+
+        return self.cell_index.find_cells(xs, ys)
 
     @classmethod
     def make_default_layout(cls):
@@ -178,3 +711,69 @@ class Floorplan:
             cells[wall.connection[1]].append(wall)
 
         return cls([cells[i] for i in range(len(cells))], [0, 0, 50])
+
+    @classmethod
+    def load(cls, path, cache=None):
+        """Reads a floorplan from a file
+
+        The file is a JSON object with the `version` of the format, the
+        `num_cells` of the floorplan (the outside included), its
+        `distribution`, and its `walls` as [x1, y1, x2, y2, state, cell a,
+        cell b] lists. Every wall is added to the walls of both cells it
+        connects, in the order of the file.
+
+        Parameters
+        ----------
+        path: str
+                The file
+        cache: FloorplanCache
+                Where the derived navigation data is reloaded from or stored,
+                keyed by a hash of the bytes of the file
+
+        Returns
+        -------
+        Floorplan
+                The floorplan
+        """
+
+        with open(path, "rb") as file:
+            raw = file.read()
+        data = json.loads(raw)
+        if data.get("version") != VERSION:
+            raise ValueError(
+                f"Unsupported floorplan version {data.get('version')} in {path}"
+            )
+
+        cells = [[] for _ in range(data["num_cells"])]
+        for x1, y1, x2, y2, state, a, b in data["walls"]:
+            wall = Wall(((x1, y1), (x2, y2)), state, (a, b))
+            cells[a].append(wall)
+            cells[b].append(wall)
+        key = bytes_key(raw) if cache is not None else None
+        return cls(cells, data["distribution"], cache, key)
+
+    def save(self, path):
+        """Writes the floorplan to a file, in the format read by `load`
+
+        Parameters
+        ----------
+        path: str
+                The file
+
+        Returns
+        -------
+        None
+        """
+
+        walls = dict.fromkeys(wall for walls in self.cells for wall in walls)
+        data = {
+            "version": VERSION,
+            "num_cells": self.num_cells,
+            "distribution": [int(count) for count in self.distribution],
+            "walls": [
+                [*wall.endpoints[0], *wall.endpoints[1], wall.state, *wall.connection]
+                for wall in walls
+            ],
+        }
+        with open(path, "w") as file:
+            json.dump(data, file)
@@ -0,0 +1,116 @@
+"""Vectorized versions of the geometric predicates of `Wall`
+
+Every function broadcasts over leading dimensions, with points given as
+arrays whose last dimension holds the (x, y) coordinates.
+"""
+
+import numpy as np
+
+
+def orientation(a, b, c):
+    """Checks the orientation of three points, as in `Wall.orientation`
+
+    Parameters
+    ----------
+    a: np.ndarray
+    b: np.ndarray
+    c: np.ndarray
+                    Arrays of points in consideration
+
+    Returns
+    -------
+    np.ndarray
+            1 where clockwise, 2 where anti-clockwise and 0 where collinear
+    """
+
+    x = (b[..., 1] - a[..., 1]) * (c[..., 0] - b[..., 0]) - (b[..., 0] - a[..., 0]) * (
+        c[..., 1] - b[..., 1]
+    )
+    return np.where(x > 0, 1, np.where(x < 0, 2, 0))
+
+
+def on_segment(a, b, c):
+    """Checks whether points b lie on segments ac given a, b, c are collinear
+
+    Parameters
+    ----------
+    a: np.ndarray
+    b: np.ndarray
+    c: np.ndarray
+                    Arrays of points in consideration
+
+    Returns
+    -------
+    np.ndarray
+            Whether each b lies on ac
+    """
+
+    return (
+        (np.minimum(a[..., 0], c[..., 0]) <= b[..., 0])
+        & (b[..., 0] <= np.maximum(a[..., 0], c[..., 0]))
+        & (np.minimum(a[..., 1], c[..., 1]) <= b[..., 1])
+        & (b[..., 1] <= np.maximum(a[..., 1], c[..., 1]))
+    )
+
+
+def segments_intersect(p1, p2, q1, q2):
+    """Checks whether segments p1p2 intersect segments q1q2, as in `Wall.intersects`
+
+    Parameters
+    ----------
+    p1: np.ndarray
+    p2: np.ndarray
+                    The endpoints of the first segments
+    q1: np.ndarray
+    q2: np.ndarray
+                    The endpoints of the second segments
+
+    Returns
+    -------
+    np.ndarray
+            Whether each pair of segments intersects
+    """
+
+    o1 = orientation(p1, p2, q1)
+    o2 = orientation(p1, p2, q2)
+    o3 = orientation(q1, q2, p1)
+    o4 = orientation(q1, q2, p2)
+
+    # General case
+    general = (o1 != o2) & (o3 != o4)
+
+    # Special cases
+    special = (
+        ((o1 == 0) & on_segment(p1, q1, p2))
+        | ((o2 == 0) & on_segment(p1, q2, p2))
+        | ((o3 == 0) & on_segment(q1, p1, q2))
+        | ((o4 == 0) & on_segment(q1, p2, q2))
+    )
+
+    return general | special
+
+
+def perpendiculars(points, starts, ends):
+    """Returns the perpendiculars from points to segments, as in `Wall.get_perpendicular`
+
+    Parameters
+    ----------
+    points: np.ndarray
+            The points from which we are measuring
+    starts: np.ndarray
+    ends: np.ndarray
+            The endpoints of the segments
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+            The perpendicular vectors from the segments to the points, and
+            whether the foot of each perpendicular lies on its segment,
+            never the case for zero-length segments
+    """
+
+    p = points - starts
+    q = ends - starts
+    qq = np.sum(q * q, axis=-1)
+    k = np.divide(np.sum(p * q, axis=-1), qq, out=np.zeros_like(qq), where=qq != 0)
+    return p - k[..., np.newaxis] * q, (qq != 0) & (k >= 0) & (k <= 1)
@@ -0,0 +1,236 @@
+"""Compiled force kernels for the array engine
+
+The NumPy path of `ArraySimulation` computes each force on whole arrays,
+creating several temporaries per force and per frame. The kernel here fuses
+the accumulation of the wall, agent, goal and random forces, the velocity
+clamp and the integration into a single loop, compiled with Numba when it is
+installed. The candidate pairs are still found with NumPy, by the engine.
+"""
+
+import logging
+from math import sqrt
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+logger = logging.getLogger("Simulation.Kernels")
+
+# Backends understood by `resolve_backend`, besides "auto"
+BACKENDS = ("numpy", "numba")
+
+
+def available_backends():
+    """Returns the backends that can be used in this environment
+
+    Returns
+    -------
+    List[str]
+            The names of the available backends
+    """
+
+    return [backend for backend in BACKENDS if backend != "numba" or numba]
+
+
+def resolve_backend(backend="auto"):
+    """Checks a backend name, resolving "auto" to the fastest available one
+
+    Parameters
+    ----------
+    backend: str
+            "numpy", "numba", or "auto" for numba if it is installed
+
+    Returns
+    -------
+    str
+            The backend to use
+    """
+
+    if backend == "auto":
+        return "numba" if numba is not None else "numpy"
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown backend {backend!r}, expected one of {('auto',) + BACKENDS}"
+        )
+    if backend == "numba" and numba is None:
+        raise ImportError("The numba backend requires numba to be installed")
+    return backend
+
+
+def fused_step(
+    positions,
+    velocities,
+    forces,
+    points,
+    wall_agents,
+    wall_starts,
+    wall_ends,
+    pair_i,
+    pair_j,
+    goal_agents,
+    goal_vectors,
+    wall_margin,
+    wall_constant,
+    agent_constant,
+    goal_constant,
+    max_velocity,
+    width,
+    height,
+    dt,
+):
+    """Accumulates every force on the agents and moves them, in place
+
+    Parameters
+    ----------
+    positions: np.ndarray
+    velocities: np.ndarray
+            (n, 2) arrays of the agents, updated in place
+    forces: np.ndarray
+            (n, 2) array of the random forces, to which the other forces are added
+    points: np.ndarray
+            (m, 2) array of the positions of the agents followed by the ghosts
+    wall_agents: np.ndarray
+    wall_starts: np.ndarray
+    wall_ends: np.ndarray
+            The agent and wall endpoints of each candidate wall force
+    pair_i: np.ndarray
+    pair_j: np.ndarray
+            The pairs of agents that push on each other, pair_i < n
+    goal_agents: np.ndarray
+    goal_vectors: np.ndarray
+            The agents attracted by a door and the vectors to those doors
+    wall_margin, wall_constant, agent_constant, goal_constant: float
+            The repulsion factors
+    max_velocity, width, height: float
+            The basic parameters
+    dt: float
+            The time covered by the step
+
+    Returns
+    -------
+    None
+    """
+
+    # Wall forces, as in `geometry.perpendiculars`
+    for k in range(wall_agents.shape[0]):
+        a = wall_agents[k]
+        px = positions[a, 0] - wall_starts[k, 0]
+        py = positions[a, 1] - wall_starts[k, 1]
+        qx = wall_ends[k, 0] - wall_starts[k, 0]
+        qy = wall_ends[k, 1] - wall_starts[k, 1]
+        qq = qx * qx + qy * qy
+        if qq == 0:
+            continue
+        t = (px * qx + py * qy) / qq
+        if t < 0 or t > 1:
+            continue
+        per_x = px - t * qx
+        per_y = py - t * qy
+        length = sqrt(per_x * per_x + per_y * per_y)
+        if length != 0 and length <= wall_margin:
+            forces[a, 0] += per_x * (wall_constant / length)
+            forces[a, 1] += per_y * (wall_constant / length)
+
+    # Agent-agent forces, `points` also holds the ghost agents
+    for k in range(pair_i.shape[0]):
+        a = pair_i[k]
+        b = pair_j[k]
+        vec_x = points[a, 0] - points[b, 0]
+        vec_y = points[a, 1] - points[b, 1]
+        length = sqrt(vec_x * vec_x + vec_y * vec_y)
+        if length != 0:
+            forces[a, 0] += vec_x * (agent_constant / length**3)
+            forces[a, 1] += vec_y * (agent_constant / length**3)
+
+    # Goal forces
+    for k in range(goal_agents.shape[0]):
+        a = goal_agents[k]
+        vec_x = goal_vectors[k, 0]
+        vec_y = goal_vectors[k, 1]
+        length = sqrt(vec_x * vec_x + vec_y * vec_y)
+        if length != 0:
+            forces[a, 0] += vec_x * (goal_constant / length**3)
+            forces[a, 1] += vec_y * (goal_constant / length**3)
+
+    # Clamp the velocities, integrate and reflect off the bounds
+    for a in range(positions.shape[0]):
+        vx = velocities[a, 0] + forces[a, 0] * dt
+        vy = velocities[a, 1] + forces[a, 1] * dt
+        speed = sqrt(vx * vx + vy * vy)
+        if speed > max_velocity:
+            vx *= max_velocity / speed
+            vy *= max_velocity / speed
+
+        x = positions[a, 0] + vx * dt
+        y = positions[a, 1] + vy * dt
+        if x < 0:
+            x = -x
+            vx = -vx
+        elif x > width:
+            x = 2 * width - x
+            vx = -vx
+        if y < 0:
+            y = -y
+            vy = -vy
+        elif y > height:
+            y = 2 * height - y
+            vy = -vy
+
+        positions[a, 0] = x
+        positions[a, 1] = y
+        velocities[a, 0] = vx
+        velocities[a, 1] = vy
+
+
+if numba is not None:
+    fused_step = numba.njit(cache=True, nogil=True)(fused_step)
+
+
+def compare_backends(params, floorplan, frames=50, rng=None, backends=None):
+    """Runs the same simulation on several backends and compares the trajectories
+
+    Parameters
+    ----------
+    params: Params
+            The parameters of the simulation
+    floorplan: Floorplan
+            The floorplan of the simulation
+    frames: int
+            The number of frames to compare
+    rng: np.random.SeedSequence | int
+            The seed shared by the runs
+    backends: List[str]
+            The backends to compare, all the available ones by default
+
+    Returns
+    -------
+    Dict[str, float]
+            For every backend, the largest distance of an agent from its
+            position on the first backend over the run
+    """
+
+    from .arraysimulation import ArraySimulation
+    from .streams import seed_sequence
+
+    backends = backends or available_backends()
+    seed = params.basic_parameters.RANDOM_SEED if rng is None else rng
+    sims = [
+        ArraySimulation(params, floorplan, rng=seed_sequence(seed), backend=b)
+        for b in backends
+    ]
+
+    deviation = dict.fromkeys(backends, 0.0)
+    for _ in range(frames):
+        for sim in sims:
+            sim.nextFrame()
+        reference = sims[0].agents.positions
+        for backend, sim in zip(backends, sims):
+            offsets = sim.agents.positions - reference
+            distance = np.hypot(offsets[:, 0], offsets[:, 1]).max(initial=0.0)
+            deviation[backend] = max(deviation[backend], float(distance))
+
+    logger.debug("Backend deviations over %d frames: %s", frames, deviation)
+    return deviation
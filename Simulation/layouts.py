@@ -0,0 +1,410 @@
+"""Procedural generation of large floorplans
+
+Every generator returns a valid `Floorplan`: each cell is closed by its
+walls, every cell is reachable from every other one through doors, and cell
+0 is the outside. The layouts are drawn from a seeded random number stream,
+so the same arguments always give the same floorplan. Their sizes are
+controlled directly: the number of rooms sets the cells, the doors per wall
+and door probability set the doors, and `wall_segments` splits every solid
+stretch of wall into several walls.
+"""
+
+import logging
+from math import ceil
+
+import numpy as np
+
+from .floorplan import Floorplan
+from .streams import make_rng
+from .wall import Wall
+
+logger = logging.getLogger("Simulation.Layouts")
+
+
+class _Builder:
+    """Collects the walls of the cells of a floorplan being generated"""
+
+    def __init__(self, door_width, wall_segments):
+        self.door_width = door_width
+        self.wall_segments = max(1, int(wall_segments))
+        self.cells = [[]]
+
+    def cell(self):
+        self.cells.append([])
+        return len(self.cells) - 1
+
+    def add(self, start, end, state, connection):
+        wall = Wall((start, end), state, connection)
+        self.cells[connection[0]].append(wall)
+        self.cells[connection[1]].append(wall)
+
+    def solid(self, start, end, connection):
+        start, end = np.asarray(start, dtype=np.float64), np.asarray(end)
+        points = [
+            start + (end - start) * i / self.wall_segments
+            for i in range(self.wall_segments + 1)
+        ]
+        for a, b in zip(points, points[1:]):
+            self.add(tuple(a.tolist()), tuple(b.tolist()), Wall.WALL, connection)
+
+    def line(self, start, end, connection, doors=0, door_width=None):
+        """Adds the walls along a straight line, with evenly spaced doors"""
+
+        door_width = self.door_width if door_width is None else door_width
+        start, end = np.asarray(start, dtype=np.float64), np.asarray(end)
+        length = np.hypot(*(end - start))
+        if doors * door_width >= length:
+            raise ValueError(
+                f"{doors} doors of width {door_width} do not fit in a wall of length {length:g}"
+            )
+
+        # Every door is centred in an equal share of the line
+        direction = (end - start) / length
+        previous = start
+        for i in range(doors):
+            centre = start + direction * length * (i + 0.5) / doors
+            low = centre - direction * door_width / 2
+            high = centre + direction * door_width / 2
+            self.solid(previous, low, connection)
+            self.add(tuple(low.tolist()), tuple(high.tolist()), Wall.DOOR, connection)
+            previous = high
+        self.solid(previous, end, connection)
+
+    def floorplan(self, distribution):
+        if distribution is None:
+            distribution = [0] * len(self.cells)
+        return Floorplan(self.cells, distribution)
+
+
+def _widths(rng, count, length, jitter):
+    widths = rng.uniform(1 - jitter, 1 + jitter, count)
+    return widths * length / widths.sum()
+
+
+def grid_layout(
+    rows,
+    cols,
+    room_size=10.0,
+    door_width=2.0,
+    doors_per_wall=1,
+    door_probability=1.0,
+    exits=0,
+    wall_segments=1,
+    seed=0,
+    distribution=None,
+):
+    """Builds a grid of square rooms
+
+    The inner walls of a random spanning tree of the rooms always have doors,
+    so that every room is reachable, and every other inner wall has doors
+    with the given probability.
+
+    Parameters
+    ----------
+    rows: int
+            The number of rows of rooms
+    cols: int
+            The number of columns of rooms
+    room_size: float
+            The side of a room
+    door_width: float
+            The width of the doors
+    doors_per_wall: int
+            The number of doors in an inner wall that has doors
+    door_probability: float
+            The probability that an inner wall outside the spanning tree has doors
+    exits: int
+            The number of outer walls, chosen at random, with a door to the outside
+    wall_segments: int
+            The number of walls every solid stretch of wall is split into
+    seed: int
+            The seed of the layout
+    distribution: List[int]
+            The intended distribution of each person amongst the cells,
+            nobody by default
+
+    Returns
+    -------
+    Floorplan
+            The floorplan, whose cell 1 + row * cols + col is the room at
+            (col, row) and whose cell 0 is the outside
+    """
+
+    rng = make_rng(seed)
+    builder = _Builder(door_width, wall_segments)
+    for _ in range(rows * cols):
+        builder.cell()
+
+    def room(row, col):
+        return 1 + row * cols + col if 0 <= row < rows and 0 <= col < cols else 0
+
+    # Every line of the grid between two cells, as (start, end, (a, b))
+    horizontal = [
+        (
+            (col * room_size, row * room_size),
+            ((col + 1) * room_size, row * room_size),
+            (room(row - 1, col), room(row, col)),
+        )
+        for row in range(rows + 1)
+        for col in range(cols)
+    ]
+    vertical = [
+        (
+            (col * room_size, row * room_size),
+            (col * room_size, (row + 1) * room_size),
+            (room(row, col - 1), room(row, col)),
+        )
+        for col in range(cols + 1)
+        for row in range(rows)
+    ]
+    lines = horizontal + vertical
+    inner = [i for i, (_, _, (a, b)) in enumerate(lines) if a and b]
+    outer = [i for i, (_, _, (a, b)) in enumerate(lines) if not (a and b)]
+
+    # Random spanning tree of the rooms, by Kruskal's algorithm over shuffled walls
+    parent = list(range(rows * cols + 1))
+
+    def root(cell):
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    doors = [0] * len(lines)
+    for i in rng.permutation(inner):
+        a, b = (root(cell) for cell in lines[i][2])
+        if a != b:
+            parent[a] = b
+            doors[i] = doors_per_wall
+        elif rng.random() < door_probability:
+            doors[i] = doors_per_wall
+    for i in rng.choice(outer, size=min(exits, len(outer)), replace=False):
+        doors[i] = 1
+
+    for (start, end, connection), count in zip(lines, doors):
+        builder.line(start, end, connection, count)
+    return builder.floorplan(distribution)
+
+
+def _hall_layout(
+    builder,
+    rng,
+    hall_lengths,
+    hall_width,
+    rooms_per_side,
+    room_depth,
+    doors_per_room,
+    hall_door_width,
+    exits,
+    jitter,
+):
+    """Adds a row of halls along x, lined with rooms below and above
+
+    `rooms_per_side` holds the number of rooms below and above every hall.
+    """
+
+    edges = np.concatenate(([0.0], np.cumsum(hall_lengths)))
+    halls = [builder.cell() for _ in hall_lengths]
+    bottom, top = room_depth, room_depth + hall_width
+
+    # The y of the outer wall of the rooms and of their wall onto the hall
+    for side, (outside_y, hall_y) in enumerate(
+        ((0.0, bottom), (top + room_depth, top))
+    ):
+        previous, x = 0, 0.0
+        for hall, low, high, counts in zip(halls, edges, edges[1:], rooms_per_side):
+            if not counts[side]:
+                builder.solid((low, hall_y), (high, hall_y), (0, hall))
+                continue
+            if previous and x != low:
+                # The last room before a stretch without rooms
+                builder.solid((x, outside_y), (x, hall_y), (previous, 0))
+                previous = 0
+            xs = low + np.concatenate(
+                ([0.0], np.cumsum(_widths(rng, counts[side], high - low, jitter)))
+            )
+            xs[-1] = high
+            for x0, x1 in zip(xs.tolist(), xs[1:].tolist()):
+                room = builder.cell()
+                builder.solid((x0, outside_y), (x1, outside_y), (0, room))
+                builder.solid((x0, outside_y), (x0, hall_y), (previous, room))
+                builder.line((x0, hall_y), (x1, hall_y), (room, hall), doors_per_room)
+                previous, x = room, x1
+        if previous:
+            builder.solid((x, outside_y), (x, hall_y), (previous, 0))
+
+    # Halls open onto each other, and onto the outside at the ends
+    for before, after, x in zip(halls, halls[1:], edges[1:-1].tolist()):
+        builder.line((x, bottom), (x, top), (before, after), 1, hall_door_width)
+    end = float(edges[-1])
+    builder.line(
+        (0.0, bottom), (0.0, top), (0, halls[0]), int(exits >= 1), hall_door_width
+    )
+    builder.line(
+        (end, bottom), (end, top), (halls[-1], 0), int(exits >= 2), hall_door_width
+    )
+    return halls
+
+
+def corridor_layout(
+    rooms,
+    room_width=6.0,
+    room_depth=8.0,
+    corridor_width=4.0,
+    door_width=1.5,
+    doors_per_room=1,
+    exits=2,
+    jitter=0.25,
+    wall_segments=1,
+    seed=0,
+    distribution=None,
+):
+    """Builds a single corridor lined with rooms on both sides
+
+    The corridor is one cell with a door to every room, so the number of its
+    doors, and of the edges between them in the door graph, grows with the
+    number of rooms.
+
+    Parameters
+    ----------
+    rooms: int
+            The number of rooms, split between the two sides
+    room_width: float
+            The mean width of a room along the corridor
+    room_depth: float
+            The depth of a room away from the corridor
+    corridor_width: float
+            The width of the corridor
+    door_width: float
+            The width of the doors of the rooms
+    doors_per_room: int
+            The number of doors from each room to the corridor
+    exits: int
+            0, 1 or 2, the number of ends of the corridor open to the outside
+    jitter: float
+            The relative variation of the widths of the rooms
+    wall_segments: int
+            The number of walls every solid stretch of wall is split into
+    seed: int
+            The seed of the layout
+    distribution: List[int]
+            The intended distribution of each person amongst the cells,
+            nobody by default
+
+    Returns
+    -------
+    Floorplan
+            The floorplan, whose cell 1 is the corridor
+    """
+
+    rng = make_rng(seed)
+    builder = _Builder(door_width, wall_segments)
+    per_side = ceil(rooms / 2)
+    _hall_layout(
+        builder,
+        rng,
+        [max(per_side, 1) * room_width],
+        corridor_width,
+        [(per_side, rooms - per_side)],
+        room_depth,
+        doors_per_room,
+        corridor_width / 2,
+        exits,
+        jitter,
+    )
+    return builder.floorplan(distribution)
+
+
+def mall_layout(
+    atria,
+    shops_per_side=4,
+    atrium_size=20.0,
+    shop_depth=8.0,
+    door_width=2.0,
+    atrium_door_width=6.0,
+    doors_per_shop=1,
+    exits=2,
+    jitter=0.25,
+    wall_segments=1,
+    seed=0,
+    distribution=None,
+):
+    """Builds a row of square atria lined with shops above and below
+
+    Neighbouring atria open onto each other through wide doors, and the
+    atria at both ends open onto the outside.
+
+    Parameters
+    ----------
+    atria: int
+            The number of atria
+    shops_per_side: int
+            The number of shops on each side of every atrium
+    atrium_size: float
+            The side of an atrium
+    shop_depth: float
+            The depth of a shop away from its atrium
+    door_width: float
+            The width of the doors of the shops
+    atrium_door_width: float
+            The width of the doors between atria and to the outside
+    doors_per_shop: int
+            The number of doors from each shop to its atrium
+    exits: int
+            0, 1 or 2, the number of ends of the mall open to the outside
+    jitter: float
+            The relative variation of the widths of the shops
+    wall_segments: int
+            The number of walls every solid stretch of wall is split into
+    seed: int
+            The seed of the layout
+    distribution: List[int]
+            The intended distribution of each person amongst the cells,
+            nobody by default
+
+    Returns
+    -------
+    Floorplan
+            The floorplan, whose cells 1 to `atria` are the atria
+    """
+
+    rng = make_rng(seed)
+    builder = _Builder(door_width, wall_segments)
+    _hall_layout(
+        builder,
+        rng,
+        [atrium_size] * atria,
+        atrium_size,
+        [(shops_per_side, shops_per_side)] * atria,
+        shop_depth,
+        doors_per_shop,
+        atrium_door_width,
+        exits,
+        jitter,
+    )
+    return builder.floorplan(distribution)
+
+
+def layout_counts(floorplan):
+    """Counts the cells, walls and doors of a floorplan
+
+    Parameters
+    ----------
+    floorplan: Floorplan
+            The floorplan
+
+    Returns
+    -------
+    Dict[str, int]
+            The number of cells (the outside included), walls, doors, the
+            most doors of a cell and the edges of the door graph
+    """
+
+    walls = dict.fromkeys(wall for walls in floorplan.cells for wall in walls)
+    return {
+        "cells": floorplan.num_cells,
+        "walls": len(walls),
+        "doors": len(floorplan.door_nodes),
+        "max_doors_per_cell": max(map(len, floorplan.doors), default=0),
+        "door_edges": len(floorplan.adjacency_nodes) // 2,
+    }
@@ -0,0 +1,580 @@
+"""Stages that measure a run as it goes"""
+
+import csv
+import logging
+import struct
+import zlib
+
+import numpy as np
+
+from .stages import Stage, current_agents
+
+logger = logging.getLogger("Simulation.Metrics")
+
+
+class FrameMetrics(Stage):
+    """Stage that writes summary metrics of every frame to a CSV file
+
+    Every row holds the frame number, the simulation time, the number of
+    agents, those in their destination cell, those removed on arrival so
+    far, the mean speed, and the door crossings of the frame where the
+    engine reports them. With `run(every=k)` the removals and crossings are
+    only counted on the frames written.
+
+    Attributes
+    ----------
+    path: str
+            The CSV file
+    exited: int
+            The number of agents removed on arrival so far
+    rows: int
+            The number of rows written
+
+    Methods
+    -------
+    on_start(simulation: Simulation)
+            Creates the file and writes the header
+    on_frame(simulation: Simulation, frame: int)
+            Writes the metrics of a frame
+    on_finish(simulation: Simulation)
+            Closes the file
+    """
+
+    FIELDS = (
+        "frame",
+        "time",
+        "agents",
+        "at_destination",
+        "exited",
+        "mean_speed",
+        "crossings",
+    )
+
+    def __init__(self, path):
+        """Sets up the stage, the file is only created when the run starts
+
+        Parameters
+        ----------
+        path: str
+                The CSV file
+
+        Returns
+        -------
+        None
+        """
+
+        self.path = path
+        self._file = None
+
+    def on_start(self, simulation):
+        """Creates the file and writes the header
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+
+        Returns
+        -------
+        None
+        """
+
+        self._file = open(self.path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.FIELDS)
+        self.exited = 0
+        self.rows = 0
+
+    def on_frame(self, simulation, frame):
+        """Writes the metrics of a frame
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+        frame: int
+                The frame number
+
+        Returns
+        -------
+        None
+        """
+
+        agents = current_agents(simulation)
+        if frame:
+            self.exited += len(getattr(simulation, "exited", ()))
+        speeds = np.hypot(agents.velocities[:, 0], agents.velocities[:, 1])
+        crossings = getattr(simulation, "crossings", None)
+        self._writer.writerow(
+            (
+                frame,
+                frame * simulation.params.basic_parameters.DT,
+                len(agents),
+                int(np.count_nonzero(agents.cells == agents.dests)),
+                self.exited,
+                float(speeds.mean()) if len(speeds) else 0.0,
+                len(crossings[0]) if crossings is not None else "",
+            )
+        )
+        self.rows += 1
+
+    def on_finish(self, simulation):
+        """Closes the file
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+
+        Returns
+        -------
+        None
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.debug("Wrote %d rows of metrics to %s", self.rows, self.path)
+
+
+class DensityHeatmap(Stage):
+    """Stage that accumulates the density of agents over a grid of buckets
+
+    The bounds of the floorplan are split into square buckets. Every
+    `every`-th frame seen the agents are counted per bucket with a single
+    `np.bincount`, so sampling a frame costs O(agents), and the running
+    mean and maximum density and the time spent above a density threshold
+    are updated for every bucket. Each sample stands for the frames since
+    the previous one, so the stage can also be run with `run(every=k)`.
+
+    Attributes
+    ----------
+    bucket_size: float
+            The side of a bucket, in the units of the floorplan
+    every: int
+            The frames seen between two samples
+    threshold: float
+            The density, in agents per unit of area, above which a bucket is crowded
+    origin: np.ndarray
+            The lower corner of the grid
+    shape: Tuple[int, int]
+            The number of buckets along x and y
+    samples: int
+            The number of frames sampled
+    frames: int
+            The number of frames the samples stand for
+    total: np.ndarray
+            (nx, ny) sum of the agent counts of every bucket over the frames
+    peak: np.ndarray
+            (nx, ny) largest agent count of every bucket
+    above: np.ndarray
+            (nx, ny) number of frames in which every bucket was above the threshold
+
+    Methods
+    -------
+    on_start(simulation: Simulation)
+            Lays the grid over the floorplan
+    on_frame(simulation: Simulation, frame: int)
+            Adds the agents of a sampled frame
+    mean_density()
+            Returns the mean density of every bucket
+    max_density()
+            Returns the largest density of every bucket
+    time_above()
+            Returns the simulation time every bucket spent above the threshold
+    to_arrays()
+            Returns the grid and the accumulated densities
+    save(path: str)
+            Writes the arrays to a .npz file
+    save_image(path: str, field: str)
+            Writes one of the densities as a greyscale PNG image
+    """
+
+    def __init__(self, bucket_size=1.0, every=1, threshold=2.0):
+        """Sets up the heatmap, the grid is only laid when the run starts
+
+        Parameters
+        ----------
+        bucket_size: float
+                The side of a bucket, in the units of the floorplan
+        every: int
+                The frames seen between two samples
+        threshold: float
+                The density, in agents per unit of area, above which a
+                bucket is crowded
+
+        Returns
+        -------
+        None
+        """
+
+        self.bucket_size = float(bucket_size)
+        self.every = max(1, int(every))
+        self.threshold = float(threshold)
+
+    def on_start(self, simulation):
+        """Lays the grid over the floorplan
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+
+        Returns
+        -------
+        None
+        """
+
+        bounds = simulation.floorplan.cell_index.bounds
+        bounds = bounds[np.isfinite(bounds[:, 0, 0])]
+        self.origin = bounds[:, 0].min(axis=0)
+        extent = bounds[:, 1].max(axis=0) - self.origin
+        self.shape = tuple(
+            np.maximum(np.ceil(extent / self.bucket_size), 1).astype(int).tolist()
+        )
+        self.dt = simulation.params.basic_parameters.DT
+        self.samples = 0
+        self.frames = 0
+        self._seen = 0
+        self._last = None
+        self.total = np.zeros(self.shape, dtype=np.int64)
+        self.peak = np.zeros(self.shape, dtype=np.int64)
+        self.above = np.zeros(self.shape, dtype=np.int64)
+        # Agent count above which a bucket is crowded
+        self._crowded = self.threshold * self.bucket_size**2
+
+    def on_frame(self, simulation, frame):
+        """Adds the agents of a sampled frame
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+        frame: int
+                The frame number
+
+        Returns
+        -------
+        None
+        """
+
+        self._seen += 1
+        if (self._seen - 1) % self.every:
+            return
+
+        # The first sample stands for its own frame only
+        weight = 1 if self._last is None else frame - self._last
+        self._last = frame
+
+        positions = current_agents(simulation).positions
+        buckets = np.floor((positions - self.origin) / self.bucket_size).astype(
+            np.int64
+        )
+        inside = np.all((buckets >= 0) & (buckets < self.shape), axis=1)
+        flat = buckets[inside, 0] * self.shape[1] + buckets[inside, 1]
+        counts = np.bincount(flat, minlength=self.total.size).reshape(self.shape)
+
+        self.samples += 1
+        self.frames += weight
+        self.total += counts * weight
+        np.maximum(self.peak, counts, out=self.peak)
+        self.above += (counts > self._crowded) * weight
+
+    def mean_density(self):
+        """Returns the mean density of every bucket
+
+        Returns
+        -------
+        np.ndarray
+                (nx, ny) mean agents per unit of area over the frames
+        """
+
+        return self.total / (max(self.frames, 1) * self.bucket_size**2)
+
+    def max_density(self):
+        """Returns the largest density of every bucket
+
+        Returns
+        -------
+        np.ndarray
+                (nx, ny) largest agents per unit of area in any sample
+        """
+
+        return self.peak / self.bucket_size**2
+
+    def time_above(self):
+        """Returns the simulation time every bucket spent above the threshold
+
+        Returns
+        -------
+        np.ndarray
+                (nx, ny) time above the threshold
+        """
+
+        return self.above * self.dt
+
+    def to_arrays(self):
+        """Returns the grid and the accumulated densities
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+                The lower corner and bucket size of the grid, the number of
+                samples and of frames they stand for, and the mean density, max density and time above
+                the threshold of every bucket
+        """
+
+        return {
+            "origin": self.origin,
+            "bucket_size": np.float64(self.bucket_size),
+            "samples": np.int64(self.samples),
+            "frames": np.int64(self.frames),
+            "threshold": np.float64(self.threshold),
+            "mean_density": self.mean_density(),
+            "max_density": self.max_density(),
+            "time_above": self.time_above(),
+        }
+
+    def save(self, path):
+        """Writes the arrays to a .npz file
+
+        Parameters
+        ----------
+        path: str
+                The file
+
+        Returns
+        -------
+        None
+        """
+
+        np.savez(path, **self.to_arrays())
+
+    def save_image(self, path, field="mean_density"):
+        """Writes one of the densities as a greyscale PNG image
+
+        One pixel is drawn per bucket, with y pointing up, from black for 0
+        to white for the largest value.
+
+        Parameters
+        ----------
+        path: str
+                The file
+        field: str
+                "mean_density", "max_density" or "time_above"
+
+        Returns
+        -------
+        None
+        """
+
+        values = self.to_arrays()[field]
+        scale = values.max() or 1.0
+        image = np.round(255 * values / scale).astype(np.uint8).T[::-1]
+        _write_png(path, image)
+
+
+def _write_png(path, image):
+    """Writes a (height, width) uint8 array as a greyscale PNG"""
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    height, width = image.shape
+    # Every row starts with filter type 0
+    rows = np.hstack((np.zeros((height, 1), dtype=np.uint8), image))
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        )
+        file.write(chunk(b"IDAT", zlib.compress(rows.tobytes())))
+        file.write(chunk(b"IEND", b""))
+
+
+class DoorFlows(Stage):
+    """Stage that counts the agents crossing every door and their flow rate
+
+    Crossings are found by testing the movement of every agent since the
+    last frame seen against the doors of the cell it started in, so every
+    engine is supported. When the engine reports the crossings of the frame
+    just before (see `ArraySimulation.crossings`) those are used instead,
+    which also catches the agents removed on arrival and the crossings of
+    every substep.
+
+    The cumulative count of every door is kept in each direction, and the
+    crossings of the last `window` frames seen in a ring buffer, so the
+    memory does not grow with the length of the run.
+
+    Attributes
+    ----------
+    window: int
+            The number of frames seen the flow rates are averaged over
+    connections: np.ndarray
+            (doors, 2) cells connected by every door node
+    widths: np.ndarray
+            (doors,) width of every door
+    counts: np.ndarray
+            (doors, 2) crossings of every door from its first cell to its
+            second, and back
+    flow_rates: np.ndarray
+            (doors,) crossings per unit of time of every door over the window
+    peak_rates: np.ndarray
+            (doors,) largest flow rate of every door so far
+
+    Methods
+    -------
+    on_start(simulation: Simulation)
+            Sets up the counters for the doors of the floorplan
+    on_frame(simulation: Simulation, frame: int)
+            Counts the crossings since the last frame seen
+    to_arrays()
+            Returns the door connections and the counters
+    save(path: str)
+            Writes the counters of every door to a CSV file
+    """
+
+    FIELDS = ("door", "cell_a", "cell_b", "width", "a_to_b", "b_to_a", "peak_rate")
+
+    def __init__(self, window=10):
+        """Sets up the stage, the counters are only created when the run starts
+
+        Parameters
+        ----------
+        window: int
+                The number of frames seen the flow rates are averaged over
+
+        Returns
+        -------
+        None
+        """
+
+        self.window = max(1, int(window))
+
+    def on_start(self, simulation):
+        """Sets up the counters for the doors of the floorplan
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+
+        Returns
+        -------
+        None
+        """
+
+        doors = simulation.floorplan.door_nodes
+        self.dt = simulation.params.basic_parameters.DT
+        self.connections = np.array(
+            [door.connection for door in doors], dtype=np.int64
+        ).reshape(-1, 2)
+        endpoints = np.array([door.endpoints for door in doors]).reshape(-1, 2, 2)
+        self.widths = np.hypot(*(endpoints[:, 1] - endpoints[:, 0]).T)
+        self.counts = np.zeros((len(doors), 2), dtype=np.int64)
+        self.flow_rates = np.zeros(len(doors))
+        self.peak_rates = np.zeros(len(doors))
+        # Crossings and duration of the last frames seen, oldest first from _head
+        self._ring = np.zeros((self.window, len(doors)), dtype=np.int64)
+        self._durations = np.zeros(self.window)
+        self._head = 0
+        self._sums = np.zeros(len(doors), dtype=np.int64)
+        self._frame = None
+
+    def _crossings(self, simulation, frame, agents):
+        # The engine's own crossings only cover the frame just before
+        reported = getattr(simulation, "crossings", None)
+        if reported is not None and frame == self._frame + 1:
+            return reported[1], reported[2]
+
+        # Match the agents to their last position by id
+        if not len(self._ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        order = np.argsort(self._ids)
+        ids = self._ids[order]
+        slots = np.minimum(np.searchsorted(ids, agents.ids), len(ids) - 1)
+        known = ids[slots] == agents.ids
+        previous = order[slots[known]]
+        old_cells = self._cells[previous]
+        _, doors = simulation.floorplan.cross_doors(
+            self._positions[previous], agents.positions[known], old_cells
+        )
+        crossed = doors != -1
+        return doors[crossed], old_cells[crossed]
+
+    def on_frame(self, simulation, frame):
+        """Counts the crossings since the last frame seen
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being measured
+        frame: int
+                The frame number
+
+        Returns
+        -------
+        None
+        """
+
+        agents = current_agents(simulation)
+        if self._frame is not None:
+            doors, cells = self._crossings(simulation, frame, agents)
+            backwards = (cells == self.connections[doors, 1]).astype(np.int64)
+            np.add.at(self.counts, (doors, backwards), 1)
+
+            # Replace the oldest frame of the window
+            crossings = np.bincount(doors, minlength=len(self.counts))
+            self._sums += crossings - self._ring[self._head]
+            self._ring[self._head] = crossings
+            self._durations[self._head] = (frame - self._frame) * self.dt
+            self._head = (self._head + 1) % self.window
+            self.flow_rates = self._sums / self._durations.sum()
+            np.maximum(self.peak_rates, self.flow_rates, out=self.peak_rates)
+
+        self._frame = frame
+        self._ids = agents.ids.copy()
+        self._positions = agents.positions.copy()
+        self._cells = agents.cells.copy()
+
+    def to_arrays(self):
+        """Returns the door connections and the counters
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+                The cells connected by every door, its width, its crossings
+                in each direction, and its current and peak flow rates
+        """
+
+        return {
+            "connections": self.connections,
+            "widths": self.widths,
+            "counts": self.counts,
+            "flow_rates": self.flow_rates,
+            "peak_rates": self.peak_rates,
+        }
+
+    def save(self, path):
+        """Writes the counters of every door to a CSV file
+
+        Parameters
+        ----------
+        path: str
+                The CSV file
+
+        Returns
+        -------
+        None
+        """
+
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(self.FIELDS)
+            for node, (cells, width, counts, peak) in enumerate(
+                zip(self.connections, self.widths, self.counts, self.peak_rates)
+            ):
+                writer.writerow(
+                    (node, *cells.tolist(), float(width), *counts.tolist(), float(peak))
+                )
@@ -0,0 +1,225 @@
+from collections import defaultdict
+from math import floor
+
+import numpy as np
+
+from .arrays import expand_ranges
+
+# Offset used to pack two signed bucket coordinates (within +-2^30) into one int64 key
+_KEY_OFFSET = 1 << 30
+_NEIGHBOURHOOD = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def bucket_keys(gx, gy):
+    """Packs integer bucket coordinates into one int64 key per bucket"""
+    return (gx + _KEY_OFFSET) * (1 << 32) + (gy + _KEY_OFFSET)
+
+
+class SpatialHash:
+    """Uniform grid of buckets for fixed-radius neighbour queries over arrays
+
+    The grid is rebuilt from the agent positions once per frame. Buckets are
+    `cell_size` wide, so every neighbour within `cell_size` of a point lies in
+    one of the 3x3 buckets around it.
+
+    Attributes
+    ----------
+    cell_size: float
+            The width of each bucket
+    order: np.ndarray
+            Point indices sorted by bucket
+    keys: np.ndarray
+            The bucket key of each entry of `order`
+
+    Methods
+    -------
+    __init__(cell_size: float)
+            Initializes an empty grid
+    build(positions: np.ndarray)
+            Sorts the points into buckets
+    pairs(radius: float)
+            Finds every ordered pair of distinct points closer than radius
+    """
+
+    def __init__(self, cell_size):
+        """Initializes an empty grid
+
+        Parameters
+        ----------
+        cell_size: float
+                The width of each bucket, at least the largest query radius
+
+        Returns
+        -------
+        None
+        """
+
+        self.cell_size = cell_size
+        self.positions = np.empty((0, 2))
+        self.order = np.empty(0, dtype=np.int64)
+        self.keys = np.empty(0, dtype=np.int64)
+
+    def build(self, positions):
+        """Sorts the points into buckets
+
+        Parameters
+        ----------
+        positions: np.ndarray
+                (n, 2) array of points
+
+        Returns
+        -------
+        None
+        """
+
+        self.positions = positions
+        self._grid = np.floor(positions / self.cell_size).astype(np.int64)
+        keys = bucket_keys(self._grid[:, 0], self._grid[:, 1])
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def pairs(self, radius):
+        """Finds every ordered pair of distinct points closer than radius
+
+        Parameters
+        ----------
+        radius: float
+                The query radius, no larger than `cell_size`
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                Index arrays i, j such that |positions[i] - positions[j]| < radius
+        """
+
+        if radius > self.cell_size:
+            raise ValueError(
+                f"Query radius {radius} is larger than the bucket size {self.cell_size}"
+            )
+
+        found_i, found_j = [], []
+        for dx, dy in _NEIGHBOURHOOD:
+            neighbour_keys = bucket_keys(self._grid[:, 0] + dx, self._grid[:, 1] + dy)
+            starts = np.searchsorted(self.keys, neighbour_keys, side="left")
+            counts = np.searchsorted(self.keys, neighbour_keys, side="right") - starts
+            if not counts.any():
+                continue
+
+            # Pair every point with every entry of its neighbouring bucket
+            i, entries = expand_ranges(starts, counts)
+            j = self.order[entries]
+
+            vec = self.positions[i] - self.positions[j]
+            close = (i != j) & (np.einsum("ij,ij->i", vec, vec) < radius**2)
+            found_i.append(i[close])
+            found_j.append(j[close])
+
+        if not found_i:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(found_i), np.concatenate(found_j)
+
+
+class AgentGrid:
+    """Uniform grid of buckets holding Agent objects
+
+    The object engine moves agents one at a time, so unlike `SpatialHash`
+    this grid is updated in place whenever an agent moves.
+
+    Attributes
+    ----------
+    cell_size: float
+            The width of each bucket
+    buckets: Dict[Tuple[int, int], List[Agent]]
+            The agents in each bucket
+
+    Methods
+    -------
+    __init__(cell_size: float, frame: List[List[Agent]])
+            Sorts the agents of a frame into buckets
+    bucket(x: float, y: float)
+            Returns the bucket of a point
+    move(agent: Agent, old_pos: Tuple[float, float])
+            Moves an agent to the bucket of its new position
+    near(agent: Agent)
+            Yields every other agent in the 3x3 buckets around an agent
+    """
+
+    def __init__(self, cell_size, frame):
+        """Sorts the agents of a frame into buckets
+
+        Parameters
+        ----------
+        cell_size: float
+                The width of each bucket
+        frame: List[List[Agent]]
+                The agents of each cell
+
+        Returns
+        -------
+        None
+        """
+
+        self.cell_size = cell_size
+        self.buckets = defaultdict(list)
+        for agents in frame:
+            for agent in agents:
+                self.buckets[self.bucket(agent.x, agent.y)].append(agent)
+
+    def bucket(self, x, y):
+        """Returns the bucket of a point
+
+        Parameters
+        ----------
+        x: float
+                The X-coordinate of the point
+        y: float
+                The Y-coordinate of the point
+
+        Returns
+        -------
+        Tuple[int, int]
+                The bucket coordinates
+        """
+
+        return (floor(x / self.cell_size), floor(y / self.cell_size))
+
+    def move(self, agent, old_pos):
+        """Moves an agent to the bucket of its new position
+
+        Parameters
+        ----------
+        agent: Agent
+                The agent that has moved
+        old_pos: Tuple[float, float]
+                The position of the agent before it moved
+
+        Returns
+        -------
+        None
+        """
+
+        old_bucket = self.bucket(*old_pos)
+        new_bucket = self.bucket(agent.x, agent.y)
+        if old_bucket != new_bucket:
+            self.buckets[old_bucket].remove(agent)
+            self.buckets[new_bucket].append(agent)
+
+    def near(self, agent):
+        """Yields every other agent in the 3x3 buckets around an agent
+
+        Parameters
+        ----------
+        agent: Agent
+                The agent in consideration
+
+        Yields
+        ------
+        Agent
+                The candidate neighbours
+        """
+
+        bx, by = self.bucket(agent.x, agent.y)
+        for dx, dy in _NEIGHBOURHOOD:
+            for other_agent in self.buckets.get((bx + dx, by + dy), ()):
+                if other_agent is not agent:
+                    yield other_agent
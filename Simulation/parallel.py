@@ -0,0 +1,413 @@
+import logging
+import multiprocessing
+import os
+import queue
+import traceback
+from collections import defaultdict, deque
+
+import numpy as np
+
+from .arrays import AgentArrays, FrameView
+from .arraysimulation import ArraySimulation
+from .streams import make_rng, spawn_rngs
+
+logger = logging.getLogger("Simulation.Parallel")
+
+# Seconds to wait for a message before checking that the other processes are alive
+POLL_INTERVAL = 1.0
+
+
+def partition_cells(floorplan, weights, parts):
+    """Splits the cells of a floorplan into groups of connected cells
+
+    Cells are ordered by a breadth-first search over the doors, so that
+    consecutive cells tend to be neighbours, and the order is then cut into
+    groups of roughly equal total weight.
+
+    Parameters
+    ----------
+    floorplan: Floorplan
+            The floorplan to split
+    weights: np.ndarray
+            (num_cells,) array of the cost of each cell, e.g. its number of agents
+    parts: int
+            The number of groups
+
+    Returns
+    -------
+    np.ndarray
+            (num_cells,) array of the group of each cell
+    """
+
+    neighbours = defaultdict(set)
+    for low, high in floorplan.doors_between:
+        neighbours[low].add(high)
+        neighbours[high].add(low)
+
+    # Breadth-first order of the cells, component by component
+    order = []
+    visited = set()
+    for start in range(floorplan.num_cells):
+        if start in visited:
+            continue
+        visited.add(start)
+        pending = deque([start])
+        while pending:
+            cell = pending.popleft()
+            order.append(cell)
+            for other in sorted(neighbours[cell]):
+                if other not in visited:
+                    visited.add(other)
+                    pending.append(other)
+
+    # Every cell costs at least one unit so empty regions are spread out too
+    cost = np.asarray(weights, dtype=np.float64)[order] + 1
+    cumulative = np.cumsum(cost) - cost / 2
+    groups = np.minimum((cumulative / cost.sum() * parts).astype(np.int64), parts - 1)
+
+    owners = np.empty(floorplan.num_cells, dtype=np.int64)
+    owners[order] = groups
+    return owners
+
+
+def route_workers(floorplan, owners):
+    """Finds the next worker on the way from every worker to every other
+
+    Workers are linked when a door connects their cells. Groups of workers
+    that no door links are joined through their lowest ranks, so that an
+    agent pushed through a solid wall can still be handed over.
+
+    Parameters
+    ----------
+    floorplan: Floorplan
+            The floorplan of the simulation
+    owners: np.ndarray
+            (num_cells,) array of the worker owning each cell
+
+    Returns
+    -------
+    np.ndarray
+            (workers, workers) array of the neighbour through which each
+            worker (row) sends the agents of each worker (column)
+    """
+
+    workers = int(owners.max()) + 1
+    links = defaultdict(set)
+    for low, high in floorplan.doors_between:
+        if owners[low] != owners[high]:
+            links[owners[low]].add(owners[high])
+            links[owners[high]].add(owners[low])
+
+    # Join the groups of linked workers, lowest ranks first
+    group_starts = []
+    visited = set()
+    for start in range(workers):
+        if start in visited:
+            continue
+        group_starts.append(start)
+        visited.add(start)
+        pending = deque([start])
+        while pending:
+            worker = pending.popleft()
+            for other in links[worker] - visited:
+                visited.add(other)
+                pending.append(other)
+    for first, second in zip(group_starts, group_starts[1:]):
+        links[first].add(second)
+        links[second].add(first)
+
+    # Breadth-first search back from every destination, neighbours in rank order
+    hops = np.empty((workers, workers), dtype=np.int64)
+    for dest in range(workers):
+        hops[dest, dest] = dest
+        visited = {dest}
+        pending = deque([dest])
+        while pending:
+            worker = pending.popleft()
+            for other in sorted(links[worker] - visited):
+                visited.add(other)
+                hops[other, dest] = worker
+                pending.append(other)
+    return hops
+
+
+class _Parent:
+    """Liveness check of the process that started the current one"""
+
+    def __init__(self):
+        self.pid = os.getppid()
+
+    def is_alive(self):
+        return os.getppid() == self.pid
+
+
+class _Mailbox:
+    """Receives tagged messages from a queue, holding back those not asked for yet
+
+    While waiting, the processes given are checked to be alive every
+    POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, inbox, processes):
+        self.inbox = inbox
+        self.processes = processes
+        self.pending = {}
+
+    def receive(self, kind, frame, senders):
+        """Returns the message of the given kind and frame from each sender"""
+
+        received = {}
+        for sender in senders:
+            key = (kind, frame, sender)
+            if key in self.pending:
+                received[sender] = self.pending.pop(key)
+
+        while len(received) < len(senders):
+            try:
+                message = self.inbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("A simulation process stopped unexpectedly")
+                continue
+
+            if message[0] == "error":
+                raise RuntimeError(f"Worker {message[2]} failed:\n{message[3]}")
+            if message[0] == kind and message[1] == frame and message[2] in senders:
+                received[message[2]] = message[3]
+            else:
+                self.pending[message[:3]] = message[3]
+
+        return received
+
+
+def _pack(agents):
+    return (agents.positions, agents.velocities, agents.cells, agents.dests, agents.ids)
+
+
+def _worker(rank, params, floorplan, owners, agents, inboxes, results, rng, every):
+    """Steps the agents of one group of cells, exchanging boundary agents with the others"""
+
+    try:
+        frames = params.basic_parameters.SIMULATION_LENGTH
+        margin = params.repulsion_factors.AGENT_FORCE_MARGIN
+        sim = ArraySimulation(params, floorplan, agents, rng)
+
+        # Workers owning the cell on the other side of the door in each slot
+        door_owners = owners[floorplan.door_targets]
+        door_vectors = floorplan.door_segments[:, 1] - floorplan.door_segments[:, 0]
+        door_reach = margin + np.hypot(door_vectors[:, 0], door_vectors[:, 1]) / 2
+        _, own_slots = floorplan.door_slots(np.flatnonzero(owners == rank))
+        neighbours = sorted(set(door_owners[own_slots].tolist()) - {rank})
+        # An agent can cross several doors, or a solid wall, in one frame and
+        # land in the cells of any worker. Such agents are only handed to the
+        # next worker on the way, which steps them until the next frame
+        hops = route_workers(floorplan, owners)[rank]
+        routes = sorted(set(hops.tolist()) - {rank})
+        mailbox = _Mailbox(inboxes[rank], [_Parent()])
+
+        for frame in range(frames):
+            # Send the agents close to a door into a neighbour's cells as ghosts
+            agent_slots, slots = floorplan.door_slots(sim.agents.cells)
+            offsets = floorplan.door_centres[slots] - sim.agents.positions[agent_slots]
+            near = np.hypot(offsets[:, 0], offsets[:, 1]) <= door_reach[slots]
+            agent_slots, targets = agent_slots[near], door_owners[slots[near]]
+            for neighbour in neighbours:
+                boundary = np.zeros(len(sim.agents), dtype=bool)
+                boundary[agent_slots[targets == neighbour]] = True
+                inboxes[neighbour].put(
+                    ("ghosts", frame, rank, _pack(sim.agents.take(boundary)))
+                )
+            ghosts = mailbox.receive("ghosts", frame, neighbours)
+            sim.ghosts = AgentArrays.concatenate(
+                [AgentArrays(*ghosts[neighbour]) for neighbour in neighbours]
+            )
+
+            sim.nextFrame()
+
+            # Hand the agents that crossed into the cells of another worker
+            # over to it, or to the next worker on the way to it
+            agent_hops = hops[owners[sim.agents.cells]]
+            for route in routes:
+                inboxes[route].put(
+                    (
+                        "migrants",
+                        frame,
+                        rank,
+                        _pack(sim.agents.take(agent_hops == route)),
+                    )
+                )
+            migrants = mailbox.receive("migrants", frame, routes)
+            sim.setAgents(
+                AgentArrays.concatenate(
+                    [sim.agents.take(agent_hops == rank)]
+                    + [AgentArrays(*migrants[route]) for route in routes]
+                )
+            )
+
+            if (frame + 1) % every == 0 or frame + 1 == frames:
+                results.put(("frame", frame, rank, _pack(sim.agents)))
+    except Exception:
+        # Wake up the other workers too, which may be waiting on this one
+        error = ("error", None, rank, traceback.format_exc())
+        for inbox in inboxes:
+            inbox.put(error)
+        results.put(error)
+
+
+class ParallelSimulation:
+    """Runs the array engine split across worker processes by floorplan cells
+
+    The cells of the floorplan are partitioned into groups of connected cells
+    and each group is stepped by its own process. Every frame, a worker sends
+    the workers owning neighbouring cells the agents close to a door into
+    their cells, as ghosts that push on their agents, and the agents that
+    ended up in their cells. The rare agents that end up in the cells of a
+    worker that is not a neighbour are relayed through the neighbours, one
+    worker per frame.
+
+    Attributes
+    ----------
+    params: Params
+                    Starting simulation parameters
+    floorplan: Floorplan
+                    The floorplan of the simulation space
+    workers: int
+                    The number of worker processes
+    owners: np.ndarray
+                    The worker that owns each cell
+    worker_rngs: List[np.random.Generator]
+                    The random number stream of each worker
+    agents: AgentArrays
+                    The agents of the current frame, gathered from the workers
+    frame: FrameView
+                    A List[List[Agent]]-compatible view of `agents`
+
+    Methods
+    -------
+    __init__(self: ParallelSimulation, params: Params, floorplan: Floorplan, workers: int, rng: np.random.Generator)
+                    Initializes the simulation and partitions the floorplan
+    run(self: ParallelSimulation, stages: List[Stage], every: int, stop: Callable[[ParallelSimulation], bool])
+                    Runs the simulation
+    """
+
+    def __init__(self, params, floorplan, workers=None, rng=None):
+        """Initializes the simulation and partitions the floorplan
+
+        Parameters
+        ----------
+        params: Params
+                        The parameters of the simulation
+        floorplan: Floorplan
+                        The floorplan of the simulation
+        workers: int
+                        The number of worker processes, defaults to the number of CPUs
+        rng: np.random.Generator | np.random.SeedSequence | int
+                        The seed of the placement, from which the stream of
+                        every worker is spawned, RANDOM_SEED by default
+
+        Returns
+        -------
+        None
+        """
+
+        self.params = params
+        self.floorplan = floorplan
+        self.workers = max(1, min(workers or os.cpu_count() or 1, floorplan.num_cells))
+
+        # Place the agents exactly as the serial engines do, from the seed
+        # itself, and give every worker a stream spawned from it
+        seed = params.basic_parameters.RANDOM_SEED if rng is None else rng
+        self.agents = ArraySimulation(params, floorplan, rng=make_rng(seed)).agents
+        self.worker_rngs = spawn_rngs(seed, self.workers)
+        self.frame = FrameView(self.agents, floorplan.num_cells)
+
+        weights = np.bincount(self.agents.cells, minlength=floorplan.num_cells)
+        self.owners = partition_cells(floorplan, weights, self.workers)
+        logger.debug(
+            "Split %d cells across %d workers", floorplan.num_cells, self.workers
+        )
+
+    def run(self, stages=(), every=1, stop=None):
+        """Run the simulation.
+
+        Parameters
+        ----------
+        stages: List[Stage]
+                        Stages called with the simulation after every frame,
+                        e.g. to record it, and finished when the run ends
+        every: int
+                        Only gather, yield and call the stages on every k-th frame
+                        and the last one
+        stop: Callable[[ParallelSimulation], bool]
+                        Called on every gathered frame, the run ends early once it
+                        returns True. The run also ends once no agents are left
+
+        Yields
+        ------
+        FrameView
+                Constantly yields frames of simulation as they are gathered from the workers
+
+        Returns
+        -------
+        None
+        """
+
+        context = multiprocessing.get_context()
+        inboxes = [context.Queue() for _ in range(self.workers)]
+        results = context.Queue()
+        agent_owners = self.owners[self.agents.cells]
+        processes = [
+            context.Process(
+                target=_worker,
+                args=(
+                    rank,
+                    self.params,
+                    self.floorplan,
+                    self.owners,
+                    self.agents.take(agent_owners == rank),
+                    inboxes,
+                    results,
+                    self.worker_rngs[rank],
+                    every,
+                ),
+                daemon=True,
+            )
+            for rank in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        for stage in stages:
+            stage.on_start(self)
+
+        try:
+            for stage in stages:
+                stage.on_frame(self, 0)
+            yield self.frame
+
+            mailbox = _Mailbox(results, processes)
+            ranks = list(range(self.workers))
+            length = self.params.basic_parameters.SIMULATION_LENGTH
+            for frame in range(length):
+                if (frame + 1) % every and frame + 1 != length:
+                    continue
+                parts = mailbox.receive("frame", frame, ranks)
+                agents = AgentArrays.concatenate(
+                    [AgentArrays(*parts[rank]) for rank in ranks]
+                )
+                self.agents = agents.take(np.argsort(agents.ids, kind="stable"))
+                self.frame = FrameView(self.agents, self.floorplan.num_cells)
+                for stage in stages:
+                    stage.on_frame(self, frame + 1)
+                yield self.frame
+                if not len(self.agents) or (stop is not None and stop(self)):
+                    # The remaining workers are terminated below
+                    break
+            else:
+                for process in processes:
+                    process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for stage in stages:
+                stage.on_finish(self)
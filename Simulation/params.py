@@ -10,6 +10,11 @@ class Basic_Params:
     SIMULATION_LENGTH: int = 1000
     RANDOM_SEED: int = 0
     MAX_VELOCITY: float = 1.0
+    # Time covered by one frame, and the number of physics steps it is split into
+    DT: float = 1.0
+    SUBSTEPS: int = 1
+    # Whether agents leave the simulation once they reach their destination cell
+    REMOVE_ARRIVED: bool = False
 
     def __post_init__(self):
         self.POPULATION_DEMOGRAPHICS = [0.35, 0.8, 0.95, 1]
@@ -34,5 +39,5 @@ class Params:
     # Contact radius
     # The contact radius is a function of the population density
     # CONTACT_RADIUS = 3 / POPULATION_DENSITY
-    basic_parameters: Basic_Params = Basic_Params()
-    repulsion_factors: Repulsion_Factors = Repulsion_Factors()
+    basic_parameters: Basic_Params = field(default_factory=Basic_Params)
+    repulsion_factors: Repulsion_Factors = field(default_factory=Repulsion_Factors)
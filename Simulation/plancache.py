@@ -0,0 +1,157 @@
+"""On-disk cache of the navigation data derived from floorplans
+
+Building a `Floorplan` derives its door graph, the shortest distances from
+every door to the destinations of the agents and a spatial index over its
+cells, all of which only depend on the geometry. The cache stores these
+arrays in one .npz file per geometry, named after a hash of the walls of
+every cell, or of the bytes of the file the floorplan was read from, so an
+unchanged floorplan is reloaded instead of recomputed.
+Files are replaced atomically, so several processes can share a directory.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger("Simulation.PlanCache")
+
+# Bumped whenever the derived data or its layout changes, invalidating old entries
+VERSION = 3
+
+
+def geometry_key(cells):
+    """Returns a hash of the geometry of a floorplan
+
+    Parameters
+    ----------
+    cells: List[List[Wall]]
+            The list of walls for each cell
+
+    Returns
+    -------
+    str
+            The hex digest of the endpoints, states and connections of the
+            walls of every cell, in order
+    """
+
+    # One row per wall of every cell, led by the cell no.
+    table = np.array(
+        [
+            (
+                cell_no,
+                *wall.endpoints[0],
+                *wall.endpoints[1],
+                wall.state,
+                *wall.connection,
+            )
+            for cell_no, walls in enumerate(cells)
+            for wall in walls
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 8)
+    return bytes_key(table.tobytes())
+
+
+def bytes_key(data):
+    """Returns a hash of the bytes describing a floorplan, e.g. of its file
+
+    Parameters
+    ----------
+    data: bytes
+            The bytes
+
+    Returns
+    -------
+    str
+            The hex digest of the bytes
+    """
+
+    return hashlib.sha256(f"floorplan-v{VERSION}".encode() + data).hexdigest()
+
+
+class FloorplanCache:
+    """Directory of derived floorplan data, keyed by `geometry_key`
+
+    Attributes
+    ----------
+    directory: str
+            The directory holding the cache files
+
+    Methods
+    -------
+    get(key: str)
+            Returns the arrays cached for a geometry
+    put(key: str, arrays: Dict[str, np.ndarray])
+            Stores the arrays of a geometry
+    """
+
+    def __init__(self, directory):
+        """Opens a cache directory, created if needed
+
+        Parameters
+        ----------
+        directory: str
+                The directory holding the cache files
+
+        Returns
+        -------
+        None
+        """
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Returns the arrays cached for a geometry
+
+        Parameters
+        ----------
+        key: str
+                The geometry key
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+                The arrays, or None if the geometry is not cached or its
+                file cannot be read
+        """
+
+        try:
+            with np.load(self._path(key)) as data:
+                return dict(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            logger.warning("Ignoring unreadable floorplan cache %s: %s", key, error)
+            return None
+
+    def put(self, key, arrays):
+        """Stores the arrays of a geometry
+
+        Parameters
+        ----------
+        key: str
+                The geometry key
+        arrays: Dict[str, np.ndarray]
+                The arrays to store
+
+        Returns
+        -------
+        None
+        """
+
+        # Write to a temporary file first so readers never see a partial one
+        file, temporary = tempfile.mkstemp(dir=self.directory, suffix=".npz.tmp")
+        try:
+            with os.fdopen(file, "wb") as handle:
+                np.savez(handle, **arrays)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
@@ -0,0 +1,136 @@
+"""Per-phase timing of the simulation step
+
+A simulation only times its phases when its `profiler` is set. Every frame it
+then laps a `PhaseTimer` through the phases and hands the times over to
+`profiler.record`, so any object with that method can collect them.
+"""
+
+from time import perf_counter
+
+# Phases of a frame, in the order they run
+PHASES = ("random", "wall", "agent", "goal", "integrate", "cells")
+
+
+class PhaseTimer:
+    """Times the consecutive phases of one frame
+
+    Attributes
+    ----------
+    times: Dict[str, float]
+            The seconds spent in each phase so far
+
+    Methods
+    -------
+    lap(phase: str)
+            Adds the time since the previous lap to a phase
+    """
+
+    __slots__ = ("times", "_last")
+
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self._last = perf_counter()
+
+    def lap(self, phase):
+        """Adds the time since the previous lap to a phase
+
+        Parameters
+        ----------
+        phase: str
+                The phase that just finished
+
+        Returns
+        -------
+        None
+        """
+
+        now = perf_counter()
+        self.times[phase] += now - self._last
+        self._last = now
+
+
+class PhaseStats:
+    """Accumulates the phase times of the frames of a simulation
+
+    Attributes
+    ----------
+    frames: int
+            The number of frames recorded
+    totals: Dict[str, float]
+            The seconds spent in each phase over all the frames
+    last: Dict[str, float]
+            The seconds spent in each phase in the last frame
+    callback: Callable[[int, Dict[str, float]], None]
+            Called with the frame number and its phase times after every frame
+
+    Methods
+    -------
+    record(times: Dict[str, float])
+            Adds the phase times of a frame
+    means()
+            Returns the mean seconds per frame of each phase
+    report()
+            Returns a table of the time spent in each phase
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """Forgets the frames recorded so far"""
+
+        self.frames = 0
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.last = dict.fromkeys(PHASES, 0.0)
+
+    def record(self, times):
+        """Adds the phase times of a frame
+
+        Parameters
+        ----------
+        times: Dict[str, float]
+                The seconds spent in each phase of the frame
+
+        Returns
+        -------
+        None
+        """
+
+        self.frames += 1
+        for phase, seconds in times.items():
+            self.totals[phase] += seconds
+        self.last = times
+        if self.callback is not None:
+            self.callback(self.frames, times)
+
+    def means(self):
+        """Returns the mean seconds per frame of each phase
+
+        Returns
+        -------
+        Dict[str, float]
+                The mean time of each phase
+        """
+
+        return {
+            phase: total / max(self.frames, 1) for phase, total in self.totals.items()
+        }
+
+    def report(self):
+        """Returns a table of the time spent in each phase
+
+        Returns
+        -------
+        str
+                One line per phase with its mean time per frame and its share
+        """
+
+        total = sum(self.totals.values()) or 1.0
+        lines = [f"{self.frames} frames"]
+        for phase, mean in self.means().items():
+            lines.append(
+                f"{phase:>10}: {mean * 1000:9.3f} ms/frame "
+                f"{100 * self.totals[phase] / total:5.1f}%"
+            )
+        return "\n".join(lines)
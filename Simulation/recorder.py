@@ -0,0 +1,410 @@
+"""Chunked, columnar on-disk recording of the trajectories of a run
+
+A recording is a directory with one binary file per column and a JSON header:
+
+    header.json     the columns, their dtypes, the walls of the floorplan
+                    and the table of chunks
+    counts.bin      the number of agents in each frame (int64)
+    positions.bin   (rows, 2) agent coordinates
+    velocities.bin  (rows, 2) agent velocities
+    cells.bin       (rows,) cell of each agent
+    ids.bin         (rows,) id of each agent
+
+The rows of all frames are appended one after the other, so the number of
+agents may change between frames. Frames are buffered in memory and written
+a chunk at a time, optionally by a background thread, and the header is
+rewritten after every chunk so that an interrupted recording stays readable.
+
+With the "delta" encoding, the rows of each frame are sorted by id and the
+positions are quantized and stored as keyframes and deltas (see `codec`),
+with the keyframe flags in keyframes.bin. Every chunk of the agent columns
+can also be compressed with zlib or lzma.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+
+from .codec import COMPRESSIONS, compress, encode_positions
+from .stages import Stage, current_agents
+
+logger = logging.getLogger("Simulation.Recorder")
+
+HEADER = "header.json"
+VERSION = 1
+
+# Columns recorded for every agent, with the shape of one row
+COLUMNS = {
+    "positions": (2,),
+    "velocities": (2,),
+    "cells": (),
+    "ids": (),
+}
+
+
+class _WriterThread(threading.Thread):
+    """Writes queued chunks in the background, keeping the first error"""
+
+    def __init__(self, write, max_pending):
+        super().__init__(name="TrajectoryRecorder", daemon=True)
+        self.write = write
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+
+    def run(self):
+        while True:
+            chunk = self.pending.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    self.write(chunk)
+                except Exception as error:
+                    self.error = error
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError("Writing the trajectory failed") from self.error
+
+
+class TrajectoryRecorder(Stage):
+    """Stage that streams the agents of every frame to a recording on disk
+
+    Attributes
+    ----------
+    path: str
+            The directory of the recording
+    chunk_rows: int
+            The number of agent rows buffered before a chunk is written
+    chunk_frames: int
+            The most frames buffered before a chunk is written
+    background: bool
+            Whether chunks are written by a background thread
+    float_dtype: np.dtype
+            The dtype in which velocities, and raw positions, are stored
+    encoding: str
+            "raw" or "delta", the encoding of the positions
+    resolution: float
+            The quantization step of delta encoded positions
+    keyframe_interval: int
+            The most frames between two keyframes of delta encoded positions
+    compression: str
+            "zlib", "lzma", or None, the compression of the chunks of the agent columns
+    frames: int
+            The number of frames written so far
+    rows: int
+            The number of agent rows written so far
+    chunks: List[Dict]
+            The frames, rows and byte ranges of every chunk written
+
+    With `background`, `frames`, `rows`, `chunks` and the header are only
+    updated by the writer thread, so they lag behind the frames buffered and
+    are only final once `on_finish` returns. The step loop never reads them.
+
+    Methods
+    -------
+    on_start(simulation: Simulation)
+            Creates the files of the recording
+    on_frame(simulation: Simulation, frame: int)
+            Buffers the agents of a frame, writing a chunk when the buffer is full
+    on_finish(simulation: Simulation)
+            Writes the last chunk and the header, and closes the files
+    flush()
+            Writes the buffered frames as a chunk
+    """
+
+    def __init__(
+        self,
+        path,
+        chunk_rows=1 << 20,
+        chunk_frames=256,
+        background=False,
+        float_dtype=np.float32,
+        encoding="raw",
+        resolution=0.01,
+        keyframe_interval=32,
+        compression=None,
+    ):
+        """Sets up the recorder, the files are only created when the run starts
+
+        Parameters
+        ----------
+        path: str
+                The directory of the recording, created if needed
+        chunk_rows: int
+                The number of agent rows buffered before a chunk is written,
+                which bounds the memory used by the buffer
+        chunk_frames: int
+                The most frames buffered before a chunk is written
+        background: bool
+                Whether chunks are written by a background thread, so that
+                the step loop does not wait for the disk
+        float_dtype: np.dtype
+                The dtype in which velocities, and raw positions, are stored
+        encoding: str
+                "raw" to store positions as floats, or "delta" to quantize
+                them and store int16 deltas against periodic keyframes
+        resolution: float
+                The quantization step of delta encoded positions, in the
+                units of the floorplan
+        keyframe_interval: int
+                The most frames between two keyframes of delta encoded positions
+        compression: str
+                "zlib", "lzma", or None, the compression of the chunks of
+                the agent columns
+
+        Returns
+        -------
+        None
+        """
+
+        self.path = path
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.chunk_frames = max(1, int(chunk_frames))
+        self.background = background
+        self.float_dtype = np.dtype(float_dtype)
+        if encoding not in ("raw", "delta"):
+            raise ValueError(f"Unknown encoding {encoding!r}")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}")
+        self.encoding = encoding
+        self.resolution = float(resolution)
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.compression = compression
+        self.dtypes = {
+            # Delta encoded positions are buffered at full precision
+            "positions": (
+                np.dtype(np.float64) if encoding == "delta" else self.float_dtype
+            ),
+            "velocities": self.float_dtype,
+            "cells": np.dtype(np.int32),
+            "ids": np.dtype(np.int64),
+        }
+        self._files = None
+        self._writer = None
+
+    def on_start(self, simulation):
+        """Creates the files of the recording
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being recorded
+
+        Returns
+        -------
+        None
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        self.num_cells = simulation.floorplan.num_cells
+        walls = dict.fromkeys(
+            wall for walls in simulation.floorplan.cells for wall in walls
+        )
+        self.walls = [
+            [*wall.endpoints[0], *wall.endpoints[1], wall.state] for wall in walls
+        ]
+        corners = np.array(self.walls, dtype=np.float64).reshape(-1, 5)[:, :4]
+        self.origin = (
+            corners.reshape(-1, 2).min(axis=0).tolist() if len(corners) else [0.0, 0.0]
+        )
+        self.frames = 0
+        self.rows = 0
+        self.chunks = []
+        self._buffer = []
+        self._buffered_rows = 0
+        per_frame = ["counts", "keyframes"] if self.encoding == "delta" else ["counts"]
+        self._bytes = dict.fromkeys([*per_frame, *COLUMNS], 0)
+        self._files = {
+            column: open(os.path.join(self.path, f"{column}.bin"), "wb")
+            for column in self._bytes
+        }
+        if self.background:
+            # At most two chunks wait in memory while the step loop runs ahead
+            self._writer = _WriterThread(self._write, max_pending=2)
+            self._writer.start()
+        self._write_header()
+
+    def on_frame(self, simulation, frame):
+        """Buffers the agents of a frame, writing a chunk when the buffer is full
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being recorded
+        frame: int
+                The frame number
+
+        Returns
+        -------
+        None
+        """
+
+        agents = current_agents(simulation)
+        self._buffer.append(
+            {
+                column: getattr(agents, column).astype(self.dtypes[column])
+                for column in COLUMNS
+            }
+        )
+        self._buffered_rows += len(agents)
+        if (
+            self._buffered_rows >= self.chunk_rows
+            or len(self._buffer) >= self.chunk_frames
+        ):
+            self.flush()
+
+    def on_finish(self, simulation):
+        """Writes the last chunk and the header, and closes the files
+
+        Parameters
+        ----------
+        simulation: Simulation
+                The simulation being recorded
+
+        Returns
+        -------
+        None
+        """
+
+        if self._files is None:
+            return
+        writer = self._writer
+        try:
+            # A failed writer is only reported once it has been stopped
+            self._flush(check=False)
+        finally:
+            if writer is not None:
+                writer.pending.put(None)
+                writer.join()
+            for file in self._files.values():
+                file.close()
+            self._files = None
+            self._writer = None
+        if writer is not None:
+            writer.check()
+        logger.debug(
+            "Recorded %d frames, %d rows, to %s", self.frames, self.rows, self.path
+        )
+
+    def flush(self):
+        """Writes the buffered frames as a chunk
+
+        Returns
+        -------
+        None
+        """
+
+        self._flush()
+
+    def _flush(self, check=True):
+        if not self._buffer:
+            return
+
+        frames = self._buffer
+        self._buffer = []
+        self._buffered_rows = 0
+        chunk = {
+            column: np.concatenate([frame[column] for frame in frames])
+            for column in COLUMNS
+        }
+        chunk["counts"] = np.array(
+            [len(frame["ids"]) for frame in frames], dtype=np.int64
+        )
+
+        if self._writer is not None:
+            if check:
+                self._writer.check()
+            self._writer.pending.put(chunk)
+        else:
+            self._write(chunk)
+
+    def _encode(self, chunk):
+        counts = chunk["counts"]
+        if self.encoding == "delta":
+            # Sort the rows of each frame by id so that consecutive frames line up
+            frame_of_row = np.repeat(np.arange(len(counts)), counts)
+            order = np.lexsort((chunk["ids"], frame_of_row))
+            for column in COLUMNS:
+                chunk[column] = chunk[column][order]
+            positions, chunk["keyframes"] = encode_positions(
+                chunk["positions"],
+                counts,
+                chunk["ids"],
+                np.array(self.origin),
+                self.resolution,
+                self.keyframe_interval,
+            )
+        else:
+            positions = chunk["positions"].tobytes()
+
+        encoded = {}
+        for column, data in chunk.items():
+            data = positions if column == "positions" else data.tobytes()
+            if column in COLUMNS:
+                data = compress(data, self.compression)
+            encoded[column] = data
+        return encoded
+
+    def _write(self, chunk):
+        counts = chunk["counts"]
+        rows = int(counts.sum())
+        record = {
+            "frames": [self.frames, self.frames + len(counts)],
+            "rows": [self.rows, self.rows + rows],
+            "bytes": {},
+        }
+        for column, data in self._encode(chunk).items():
+            self._files[column].write(data)
+            self._files[column].flush()
+            record["bytes"][column] = [
+                self._bytes[column],
+                self._bytes[column] + len(data),
+            ]
+            self._bytes[column] += len(data)
+
+        self.frames, self.rows = record["frames"][1], record["rows"][1]
+        self.chunks.append(record)
+        self._write_header()
+
+    def _write_header(self):
+        header = {
+            "version": VERSION,
+            "num_cells": self.num_cells,
+            "walls": self.walls,
+            "frames": self.frames,
+            "rows": self.rows,
+            "columns": {
+                "counts": {"dtype": np.dtype(np.int64).str, "shape": []},
+                **{
+                    column: {
+                        "dtype": self.dtypes[column].str,
+                        "shape": list(shape),
+                        "compression": self.compression,
+                    }
+                    for column, shape in COLUMNS.items()
+                },
+            },
+            "chunks": self.chunks,
+        }
+        if self.encoding == "delta":
+            header["columns"]["keyframes"] = {
+                "dtype": np.dtype(np.uint8).str,
+                "shape": [],
+            }
+            header["columns"]["positions"].update(
+                encoding="delta",
+                resolution=self.resolution,
+                origin=self.origin,
+                keyframe_interval=self.keyframe_interval,
+            )
+
+        # Replace the header atomically so readers never see a partial one
+        temporary = os.path.join(self.path, HEADER + ".tmp")
+        with open(temporary, "w") as file:
+            json.dump(header, file)
+        os.replace(temporary, os.path.join(self.path, HEADER))
@@ -0,0 +1,204 @@
+"""Random access to the frames of a recording made by `TrajectoryRecorder`
+
+The column files are opened with `numpy.memmap`, so opening a recording only
+reads its header and per-frame counts, and reading a frame only touches the
+pages holding its rows. Compressed or delta encoded columns are instead read
+and decoded a chunk at a time, keeping the last chunk of each column.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from .codec import decode_positions, decompress
+from .recorder import COLUMNS, HEADER, VERSION
+
+logger = logging.getLogger("Simulation.Replay")
+
+
+class TrajectoryReader:
+    """Memory-mapped reader of a recorded trajectory
+
+    Attributes
+    ----------
+    path: str
+            The directory of the recording
+    header: Dict
+            The parsed header of the recording
+    num_cells: int
+            The number of cells of the recorded floorplan
+    walls: np.ndarray
+            (w, 5) array of the endpoints x1, y1, x2, y2 and state of every wall
+    offsets: np.ndarray
+            (frames + 1,) offsets of the rows of each frame into the columns
+
+    Methods
+    -------
+    __len__()
+            Returns the number of frames recorded
+    refresh()
+            Re-reads the header, to follow a recording that is still being written
+    frame(index: int, columns: List[str])
+            Returns the columns of a frame
+    positions(index: int)
+            Returns the positions of the agents of a frame
+    """
+
+    def __init__(self, path):
+        """Opens a recording
+
+        Parameters
+        ----------
+        path: str
+                The directory of the recording
+
+        Returns
+        -------
+        None
+        """
+
+        self.path = path
+        self.refresh()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def refresh(self):
+        """Re-reads the header, to follow a recording that is still being written
+
+        Returns
+        -------
+        None
+        """
+
+        with open(os.path.join(self.path, HEADER)) as file:
+            self.header = json.load(file)
+        if self.header["version"] != VERSION:
+            raise ValueError(
+                f"Unsupported recording version {self.header['version']} in {self.path}"
+            )
+
+        self.num_cells = self.header["num_cells"]
+        self.walls = np.array(self.header.get("walls", []), dtype=np.float64)
+        self.walls = self.walls.reshape(-1, 5)
+
+        frames, rows = self.header["frames"], self.header["rows"]
+        self.offsets = np.zeros(frames + 1, dtype=np.int64)
+        np.cumsum(self._map("counts", frames), out=self.offsets[1:])
+        self._keyframes = (
+            self._map("keyframes", frames)
+            if "keyframes" in self.header["columns"]
+            else None
+        )
+
+        # Raw columns are mapped, the others are decoded by chunk when read
+        self._columns = {
+            column: self._map(column, rows)
+            for column, spec in self.header["columns"].items()
+            if column in COLUMNS and self._is_raw(spec)
+        }
+        self._chunk_starts = np.array(
+            [chunk["frames"][0] for chunk in self.header["chunks"]], dtype=np.int64
+        )
+        self._cache = {}
+
+    @staticmethod
+    def _is_raw(spec):
+        return spec.get("encoding", "raw") == "raw" and not spec.get("compression")
+
+    def _map(self, column, rows):
+        spec = self.header["columns"][column]
+        shape = (rows, *spec["shape"])
+        if not rows:
+            return np.empty(shape, dtype=spec["dtype"])
+        return np.memmap(
+            os.path.join(self.path, f"{column}.bin"),
+            dtype=spec["dtype"],
+            mode="r",
+            shape=shape,
+        )
+
+    def frame(self, index, columns=None):
+        """Returns the columns of a frame
+
+        Parameters
+        ----------
+        index: int
+                The frame, negative to count from the end
+        columns: List[str]
+                The columns to read, all of them by default
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+                Read-only views of the rows of the frame in each column
+        """
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame {index} is not in the recording")
+
+        start, end = self.offsets[index], self.offsets[index + 1]
+        result = {}
+        for column in columns or COLUMNS:
+            if column in self._columns:
+                result[column] = self._columns[column][start:end]
+            else:
+                result[column] = self._decode(column, index)
+        return result
+
+    def _read_chunk(self, column, number):
+        cached = self._cache.get(column)
+        if cached is not None and cached[0] == number:
+            return cached[1]
+
+        spec = self.header["columns"][column]
+        start, end = self.header["chunks"][number]["bytes"][column]
+        with open(os.path.join(self.path, f"{column}.bin"), "rb") as file:
+            file.seek(start)
+            data = decompress(file.read(end - start), spec.get("compression"))
+        if spec.get("encoding", "raw") == "raw":
+            data = np.frombuffer(data, dtype=spec["dtype"]).reshape(-1, *spec["shape"])
+
+        self._cache[column] = (number, data)
+        return data
+
+    def _decode(self, column, index):
+        number = int(np.searchsorted(self._chunk_starts, index, side="right")) - 1
+        chunk = self.header["chunks"][number]
+        data = self._read_chunk(column, number)
+
+        spec = self.header["columns"][column]
+        if spec.get("encoding", "raw") == "raw":
+            start = self.offsets[index] - chunk["rows"][0]
+            end = self.offsets[index + 1] - chunk["rows"][0]
+            return data[start:end]
+
+        first, last = chunk["frames"]
+        return decode_positions(
+            data,
+            np.diff(self.offsets[first : last + 1]),
+            self._keyframes[first:last],
+            index - first,
+            np.array(spec["origin"]),
+            spec["resolution"],
+        )
+
+    def positions(self, index):
+        """Returns the positions of the agents of a frame
+
+        Parameters
+        ----------
+        index: int
+                The frame, negative to count from the end
+
+        Returns
+        -------
+        np.ndarray
+                (n, 2) read-only view of the positions
+        """
+
+        return self.frame(index, ["positions"])["positions"]
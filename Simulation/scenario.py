@@ -0,0 +1,172 @@
+"""Scenario files, describing a whole run without any Python code
+
+A scenario is a JSON object with these keys, all optional:
+
+    floorplan   a floorplan file (see `Floorplan.load`) relative to the
+                scenario, "default" for `Floorplan.make_default_layout`, or
+                {"layout": "grid" | "corridor" | "mall", ...} to generate one
+                with the matching function of `layouts` and its arguments
+    distribution
+                the number of agents heading to each cell, as a list or as a
+                {cell: count} object, replacing that of the floorplan
+    params      {"basic_parameters": {...}, "repulsion_factors": {...}}
+                overriding the defaults of `Params`
+    sources     a list of `AgentSource` arguments, with "door" given as the
+                node number of a door of the floorplan
+"""
+
+import json
+import logging
+import os
+from dataclasses import fields
+
+from . import layouts
+from .floorplan import Floorplan
+from .params import Params
+from .sources import AgentSource
+
+logger = logging.getLogger("Simulation.Scenario")
+
+# Generators usable by the "layout" key of a floorplan
+LAYOUTS = {
+    "grid": layouts.grid_layout,
+    "corridor": layouts.corridor_layout,
+    "mall": layouts.mall_layout,
+}
+
+
+def _override(target, values, name):
+    known = {field.name for field in fields(target)}
+    for key, value in values.items():
+        if key not in known:
+            raise ValueError(f"Unknown parameter {name}.{key}")
+        setattr(target, key, value)
+
+
+def make_params(overrides):
+    """Returns the default parameters with some of them replaced
+
+    Parameters
+    ----------
+    overrides: Dict[str, Dict[str, Any]]
+            The values to replace, by group and by name
+
+    Returns
+    -------
+    Params
+            The parameters
+    """
+
+    params = Params()
+    for group, values in overrides.items():
+        if group not in {field.name for field in fields(params)}:
+            raise ValueError(f"Unknown parameter group {group}")
+        _override(getattr(params, group), values, group)
+    return params
+
+
+def make_floorplan(spec, directory=".", cache=None):
+    """Returns the floorplan described by the floorplan key of a scenario
+
+    Parameters
+    ----------
+    spec: str | Dict[str, Any]
+            A floorplan file, "default", or a layout and its arguments
+    directory: str
+            The directory that file paths are relative to
+    cache: FloorplanCache
+            Where the derived navigation data of a floorplan file is
+            reloaded from or stored
+
+    Returns
+    -------
+    Floorplan
+            The floorplan
+    """
+
+    if spec == "default":
+        return Floorplan.make_default_layout()
+    if isinstance(spec, str):
+        return Floorplan.load(os.path.join(directory, spec), cache)
+
+    arguments = dict(spec)
+    layout = arguments.pop("layout", None)
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {list(LAYOUTS)}")
+    return LAYOUTS[layout](**arguments)
+
+
+def make_sources(specs, floorplan):
+    """Returns the agent sources described by the sources key of a scenario
+
+    Parameters
+    ----------
+    specs: List[Dict[str, Any]]
+            The arguments of every source, with the door as a door node number
+    floorplan: Floorplan
+            The floorplan the doors belong to
+
+    Returns
+    -------
+    List[AgentSource]
+            The sources
+    """
+
+    sources = []
+    for spec in specs:
+        arguments = dict(spec)
+        if "door" in arguments:
+            arguments["door"] = floorplan.door_nodes[arguments["door"]]
+        arguments["schedule"] = [tuple(entry) for entry in spec.get("schedule", [])]
+        sources.append(AgentSource(**arguments))
+    return sources
+
+
+def load_scenario(path, cache=None):
+    """Reads a scenario file
+
+    Parameters
+    ----------
+    path: str
+            The scenario file
+    cache: FloorplanCache
+            Where the derived navigation data of its floorplan is reloaded
+            from or stored
+
+    Returns
+    -------
+    Tuple[Params, Floorplan, List[AgentSource]]
+            The parameters, the floorplan and the agent sources of the scenario
+    """
+
+    with open(path) as file:
+        scenario = json.load(file)
+
+    params = make_params(scenario.get("params", {}))
+    directory = os.path.dirname(os.path.abspath(path))
+    floorplan = make_floorplan(scenario.get("floorplan", "default"), directory, cache)
+
+    # Exit costs towards the new destinations are computed on first use
+    distribution = scenario.get("distribution")
+    if isinstance(distribution, dict):
+        counts = [0] * floorplan.num_cells
+        for cell, count in distribution.items():
+            counts[int(cell)] = count
+        distribution = counts
+    if distribution is not None:
+        if len(distribution) != floorplan.num_cells:
+            raise ValueError(
+                f"The distribution has {len(distribution)} cells, "
+                f"the floorplan {floorplan.num_cells}"
+            )
+        floorplan.distribution = distribution
+
+    sources = make_sources(scenario.get("sources", []), floorplan)
+    logger.debug(
+        "Loaded scenario %s: %d cells, %d agents, %d sources",
+        path,
+        floorplan.num_cells,
+        sum(floorplan.distribution),
+        len(sources),
+    )
+    return params, floorplan, sources
@@ -1,14 +1,14 @@
 import logging
 
 # from bisect import bisect_left
-from datetime import datetime
 from math import inf, sqrt
-from random import seed, uniform
 
 logger = logging.getLogger("Simulation.Core")
 
 from .agent import Agent
-from .wall import Wall
+from .neighbours import AgentGrid
+from .profiling import PhaseTimer
+from .streams import make_rng
 
 
 class Simulation:
@@ -24,20 +24,45 @@ class Simulation:
                     The floorplan of the simulation space
     frame: List[List[agents]]
                     The current frame of the simulation
+    neighbours: AgentGrid
+                    Buckets of agents used to find nearby agents
+    rng: np.random.Generator
+                    The random number stream of the simulation
+    profiler: PhaseStats
+                    Receives the time spent in each phase of every frame, None to
+                    disable the timing
+    exited: List[int]
+                    The ids of the agents removed at their destination in the last frame
+    sources: List[AgentSource]
+                    Sources that release agents over time
+    time: float
+                    The simulation time of the current frame
 
     Methods
     -------
-    __init__(self: Simulation, params: Params)
+    __init__(self: Simulation, params: Params, floorplan: Floorplan, rng: np.random.Generator, profiler: PhaseStats, sources: List[AgentSource])
                     Initializes the simulation
     initializeFrame(self: Simulation)
                     Initializes the first frame
-    runSimulation(self: Simulation)
+    run(self: Simulation, stages: List[Stage], every: int, stop: Callable[[Simulation], bool])
                     Runs the simulation
     nextFrame(self: Simulation)
                     Calculates the next frame of the simulation
+    population(self: Simulation)
+                    Returns the number of agents in the simulation
+    removeArrived(self: Simulation)
+                    Removes the agents that are in their destination cell
+    spawnAgents(self: Simulation)
+                    Releases the agents of every source for the coming frame
+    addAgents(self: Simulation, positions: np.ndarray, cells: np.ndarray, dest: int)
+                    Adds agents at rest
+    substeps(self: Simulation)
+                    Returns the number and length of the physics steps of a frame
+    moveAgents(self: Simulation, dt: float, timer: PhaseTimer)
+                    Moves the agents by one physics step
     """
 
-    def __init__(self, params, floorplan):
+    def __init__(self, params, floorplan, rng=None, profiler=None, sources=()):
         """Initialized the simulation
 
         Intializes the simulation with some basic properties
@@ -48,6 +73,13 @@ class Simulation:
                         The parameters of the simulation
         floorplan: Floorplan
                         The floorplan of the simulation
+        rng: np.random.Generator | np.random.SeedSequence | int
+                        The random number stream, or a seed for it. Defaults to
+                        a stream seeded with RANDOM_SEED, so that runs are reproducible
+        profiler: PhaseStats
+                        Receives the time spent in each phase of every frame
+        sources: List[AgentSource]
+                        Sources that release agents over time
 
         Returns
         -------
@@ -56,6 +88,9 @@ class Simulation:
 
         self.params = params
         self.floorplan = floorplan
+        self.rng = make_rng(params.basic_parameters.RANDOM_SEED if rng is None else rng)
+        self.profiler = profiler
+        self.sources = list(sources)
         self.initializeFrame()
 
     def initializeFrame(self):
@@ -70,10 +105,13 @@ class Simulation:
         """
         id = 0
         agents = [[] for _ in range(self.floorplan.num_cells)]
+        total = sum(self.floorplan.distribution)
+        xs = self.rng.uniform(0, self.params.basic_parameters.WIDTH / 2, total)
+        ys = self.rng.uniform(0, self.params.basic_parameters.HEIGHT, total)
         for dest, num_agents in enumerate(self.floorplan.distribution):
             for _ in range(num_agents):
-                x = uniform(0, self.params.basic_parameters.WIDTH / 2)
-                y = uniform(0, self.params.basic_parameters.HEIGHT)
+                x = float(xs[id])
+                y = float(ys[id])
                 cell = self.floorplan.find_cell(x, y)
                 # print(x, y, cell, dest)
                 # Create agent
@@ -82,9 +120,12 @@ class Simulation:
 
         # Create frame
         self.frame = agents
+        self.exited = []
+        self.time = 0.0
+        self._nextId = id
         # exit()
 
-    def run(self):
+    def run(self, stages=(), every=1, stop=None):
         """Run the simulation.
 
         Run an agent based simulation based on the
@@ -92,6 +133,16 @@ class Simulation:
 
         Parameters
         ----------
+        stages: List[Stage]
+                        Stages called with the simulation after every frame,
+                        e.g. to record it, and finished when the run ends
+        every: int
+                        Only yield, and call the stages on, every k-th frame and
+                        the last one
+        stop: Callable[[Simulation], bool]
+                        Called after every frame, the run ends early once it
+                        returns True. The run also ends once no agents are left
+                        and no source will release any more
 
         Yields
         ------
@@ -103,22 +154,39 @@ class Simulation:
         None
         """
 
-        # Reset random seed to current system time
-        # Initalize and save seed
-        startTime = datetime.now()
-        self.params.basic_parameters.RANDOM_SEED = (
-            startTime.hour * 10000 + startTime.minute * 100 + startTime.second
-        )
-        seed(self.params.basic_parameters.RANDOM_SEED)
-
-        # Yield the first frame
-        yield self.frame
+        for stage in stages:
+            stage.on_start(self)
 
-        for _ in range(self.params.basic_parameters.SIMULATION_LENGTH):
-            # Calculate the next frame and then yield it
-            self.nextFrame()
+        try:
+            # Yield the first frame
+            for stage in stages:
+                stage.on_frame(self, 0)
             yield self.frame
 
+            length = self.params.basic_parameters.SIMULATION_LENGTH
+            for frame in range(1, length + 1):
+                # Calculate the next frame and then yield it
+                self.nextFrame()
+                # An empty floorplan only ends the run once no source can refill it
+                finished = (
+                    frame == length
+                    or (
+                        not self.population()
+                        and all(source.exhausted(self.time) for source in self.sources)
+                    )
+                    or (stop is not None and stop(self))
+                )
+                if frame % every and not finished:
+                    continue
+                for stage in stages:
+                    stage.on_frame(self, frame)
+                yield self.frame
+                if finished:
+                    break
+        finally:
+            for stage in stages:
+                stage.on_finish(self)
+
     def nextFrame(self):
         """Calculates the next frame of the simulation
 
@@ -130,74 +198,193 @@ class Simulation:
         None
         """
 
-        self.moveAgents()
+        # The substeps of a frame are timed as one frame
+        timer = PhaseTimer() if self.profiler is not None else None
+        substeps, dt = self.substeps()
+        for _ in range(substeps):
+            self.moveAgents(dt, timer)
+        if timer is not None:
+            self.profiler.record(timer.times)
+        if self.params.basic_parameters.REMOVE_ARRIVED:
+            self.removeArrived()
+        if self.sources:
+            self.spawnAgents()
+        self.time += self.params.basic_parameters.DT
+
+    def population(self):
+        """Returns the number of agents in the simulation
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        int
+                The number of agents
+        """
+
+        return sum(map(len, self.frame))
+
+    def removeArrived(self):
+        """Removes the agents that are in their destination cell
+
+        Their ids are kept in `exited` until the next frame.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None
+        """
+
+        self.exited = []
+        for cell, agents in enumerate(self.frame):
+            if any(agent.dest == cell for agent in agents):
+                self.exited.extend(agent.age for agent in agents if agent.dest == cell)
+                self.frame[cell] = [agent for agent in agents if agent.dest != cell]
+
+    def spawnAgents(self):
+        """Releases the agents of every source for the coming frame
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None
+        """
+
+        for source in self.sources:
+            count = source.release(self.rng, self.time, self.params.basic_parameters.DT)
+            if count:
+                positions, cells = source.place(self.rng, count, self.floorplan)
+                self.addAgents(positions, cells, source.dest)
+
+    def addAgents(self, positions, cells, dest):
+        """Adds agents at rest
+
+        Parameters
+        ----------
+        positions: np.ndarray
+                (k, 2) array of the positions of the new agents
+        cells: np.ndarray
+                (k,) array of their cells
+        dest: int
+                Their destination cell
+
+        Returns
+        -------
+        None
+        """
+
+        for (x, y), cell in zip(positions.tolist(), cells.tolist()):
+            self.frame[cell].append(Agent(cell, x, y, self._nextId, dest))
+            self._nextId += 1
+
+    def substeps(self):
+        """Returns the number and length of the physics steps of a frame
+
+        A frame covers DT units of time, split into SUBSTEPS equal steps.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        Tuple[int, float]
+                The number of steps and the time covered by each
+        """
+
+        basic = self.params.basic_parameters
+        substeps = max(1, int(basic.SUBSTEPS))
+        return substeps, basic.DT / substeps
 
-    def moveAgents(self):
+    def moveAgents(self, dt=1.0, timer=None):
         """Implements movement of the agents each frame
 
         Parameters
         ----------
+        dt: float
+                The time covered by the step
+        timer: PhaseTimer
+                Laps the phases of the step if given
 
         Returns
         -------
         """
 
+        # Index agents by position for the agent-agent forces
+        self.neighbours = AgentGrid(
+            self.params.repulsion_factors.AGENT_FORCE_MARGIN, self.frame
+        )
+
+        # Draw the random forces of every agent at once
+        constant = self.params.repulsion_factors.RANDOM_FORCE_CONSTANT
+        random_forces = self.rng.uniform(
+            -constant, constant, size=(sum(map(len, self.frame)), 2)
+        ).tolist()
+        if timer is not None:
+            timer.lap("random")
+
+        # Agents are reflected at the same bounds as in ArraySimulation
+        width = self.params.basic_parameters.WIDTH
+        height = self.params.basic_parameters.HEIGHT
+
         # Calculate force on each agent
         new_frame = [[] for _ in range(self.floorplan.num_cells)]
         for cell_no, agents in enumerate(self.frame):
             for agent in agents:
-                fx, fy = self.calculateForce(agent)
+                fx, fy = self.calculateForce(agent, random_forces.pop(), timer)
+                if timer is not None:
+                    timer.lap("goal")
 
                 # Update velocity
-                logger.debug(
-                    f"Initial Position: {agent.x, agent.y}, Velocity: {agent.vx, agent.vy}"
-                )
-                agent.vx += fx
-                agent.vy += fy
+                agent.vx += fx * dt
+                agent.vy += fy * dt
                 v = sqrt(agent.vx**2 + agent.vy**2)
                 if v > self.params.basic_parameters.MAX_VELOCITY:
                     agent.vx *= self.params.basic_parameters.MAX_VELOCITY / v
                     agent.vy *= self.params.basic_parameters.MAX_VELOCITY / v
 
                 # Update position
-                # old_pos = (agent.x, agent.y)
-                agent.x += agent.vx
-                agent.y += agent.vy
+                old_pos = (agent.x, agent.y)
+                agent.x += agent.vx * dt
+                agent.y += agent.vy * dt
 
                 # Reflect of walls
                 if agent.x < 0:
                     agent.x = -agent.x
                     agent.vx = -agent.vx
-                elif agent.x > 100:
-                    agent.x = 200 - agent.x
+                elif agent.x > width:
+                    agent.x = 2 * width - agent.x
                     agent.vx = -agent.vx
 
                 if agent.y < 0:
                     agent.y = -agent.y
                     agent.vy = -agent.vy
-                elif agent.y > 100:
-                    agent.y = 200 - agent.y
+                elif agent.y > height:
+                    agent.y = 2 * height - agent.y
                     agent.vy = -agent.vy
-
-                logger.debug(
-                    f"Final Position: {agent.x, agent.y}, Velocity: {agent.vx, agent.vy}"
-                )
+                self.neighbours.move(agent, old_pos)
+                if timer is not None:
+                    timer.lap("integrate")
 
                 # Check for changes in the agent cell
-                # for wall in self.floorplan.cells[agent.cell]:
-                #     if wall.intersects((old_pos, (agent.x, agent.y))):
-                #         # print(
-                #         #     agent.cell,
-                #         #     wall.connection[wall.connection[0] == agent.cell],
-                #         # )
-                #         agent.cell = wall.connection[wall.connection[0] == agent.cell]
-                agent.cell = (agent.x > 50) + 1
+                agent.cell, _ = self.floorplan.cross_door(
+                    old_pos,
+                    (agent.x, agent.y),
+                    agent.cell,
+                    self.params.repulsion_factors.WALL_FORCE_MARGIN,
+                )
                 new_frame[agent.cell].append(agent)
+                if timer is not None:
+                    timer.lap("cells")
 
         # Update frame
         self.frame = new_frame
 
-    def calculateForce(self, agent):
+    def calculateForce(self, agent, random_force=None, timer=None):
         """Calculates the forces acting on a given agent
 
         Forces are of the following types:
@@ -209,6 +396,10 @@ class Simulation:
         ----------
         agent: Agent
                 The agent in consideration
+        random_force: Tuple[float, float]
+                The random force on the agent, drawn from `rng` if None
+        timer: PhaseTimer
+                Times the wall and agent forces if given, the caller laps the goal forces
 
         Returns
         -------
@@ -217,20 +408,16 @@ class Simulation:
         """
 
         # Random forces
-        fx = uniform(
-            -self.params.repulsion_factors.RANDOM_FORCE_CONSTANT,
-            self.params.repulsion_factors.RANDOM_FORCE_CONSTANT,
-        )
-        fy = uniform(
-            -self.params.repulsion_factors.RANDOM_FORCE_CONSTANT,
-            self.params.repulsion_factors.RANDOM_FORCE_CONSTANT,
-        )
+        if random_force is None:
+            constant = self.params.repulsion_factors.RANDOM_FORCE_CONSTANT
+            random_force = self.rng.uniform(-constant, constant, size=2)
+        fx, fy = random_force
 
         # Wall forces
-        for wall in self.floorplan.cells[agent.cell]:
-            if wall.state == Wall.DOOR:
-                continue
-
+        wall_index = self.floorplan.wall_index(
+            self.params.repulsion_factors.WALL_FORCE_MARGIN
+        )
+        for wall in wall_index.walls_near((agent.x, agent.y), agent.cell):
             # Get the perpendicular
             per = wall.get_perpendicular((agent.x, agent.y))
             if per == (inf, inf):
@@ -247,23 +434,33 @@ class Simulation:
                 )
                 fx += per[0] * force_per_length
                 fy += per[1] * force_per_length
+        if timer is not None:
+            timer.lap("wall")
 
         # Agent-agent forces
-        for other_agent in self.frame[agent.cell]:
+        for other_agent in self.neighbours.near(agent):
             # Get the connecting vector
             vec = agent.vec_to_agent(other_agent)
+            if not self.floorplan.sees_through_door(
+                (agent.x, agent.y),
+                agent.cell,
+                (other_agent.x, other_agent.y),
+                other_agent.cell,
+            ):
+                continue
 
             vec_length = sqrt(vec[0] ** 2 + vec[1] ** 2)
             if (
                 vec_length != 0
                 and vec_length < self.params.repulsion_factors.AGENT_FORCE_MARGIN
             ):
-                logger.debug(f"Vector Length: {vec_length}")
                 force_per_length = (
                     self.params.repulsion_factors.AGENT_FORCE_CONSTANT / vec_length**3
                 )
                 fx += vec[0] * force_per_length
                 fy += vec[1] * force_per_length
+        if timer is not None:
+            timer.lap("agent")
 
         if agent.cell == agent.dest:
             # Goal forces are not applicable
@@ -272,18 +469,18 @@ class Simulation:
         # Goal forces
         min_door = None
         min_distance = inf
-        for next_door in self.floorplan.doors[agent.cell]:
-            for dest_door in self.floorplan.doors[agent.dest]:
-                # Calculate total distance of the trip
-                dist = (
-                    next_door.distance_to_door((agent.x, agent.y))
-                    + self.floorplan.distances[next_door.door_node][dest_door.door_node]
-                )
-
-                if dist < min_distance:
-                    # Update closest door
-                    min_distance = dist
-                    min_door = next_door
+        offsets = self.floorplan.door_offsets
+        exit_costs = self.floorplan.exit_costs(agent.dest)[
+            offsets[agent.cell] : offsets[agent.cell + 1]
+        ]
+        for next_door, cost in zip(self.floorplan.doors[agent.cell], exit_costs):
+            # Calculate total distance of the trip
+            dist = next_door.distance_to_door((agent.x, agent.y)) + cost
+
+            if dist < min_distance:
+                # Update closest door
+                min_distance = dist
+                min_door = next_door
 
         if min_door == None:
             # Single cell floorplan
@@ -300,5 +497,4 @@ class Simulation:
             fx += vec[0] * force_per_length
             fy += vec[1] * force_per_length
 
-        logger.debug(f"Forces: {fx, fy}")
         return (fx, fy)
@@ -0,0 +1,156 @@
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .wall import Wall
+
+logger = logging.getLogger("Simulation.Sources")
+
+
+@dataclass
+class AgentSource:
+    """Releases agents into the simulation over time
+
+    Agents appear either along a door, a little inside one of the cells it
+    connects, or uniformly inside a rectangular region. The number released
+    each step is drawn from a Poisson distribution whose rate follows a
+    piecewise-constant schedule.
+
+    Attributes
+    ----------
+    dest: int
+            The destination cell of the released agents
+    schedule: List[Tuple[float, float]]
+            (start time, agents per unit of time) pairs, sorted by start time.
+            The rate is 0 before the first start time
+    door: Wall
+            The door the agents come in through
+    cell: int
+            The cell behind `door` the agents are released into, by default
+            the one that is not the outside (cell 0)
+    depth: float
+            How far inside `cell` the agents are released
+    region: Tuple[Tuple[float, float], Tuple[float, float]]
+            The lower and upper corners of the region, if there is no door
+
+    Methods
+    -------
+    rate(time: float)
+            Returns the release rate at a time
+    exhausted(time: float)
+            Tells whether no agent is released from a time on
+    release(rng: np.random.Generator, time: float, dt: float)
+            Draws the number of agents released during a step
+    place(rng: np.random.Generator, count: int, floorplan: Floorplan)
+            Draws the positions of released agents
+    """
+
+    dest: int
+    schedule: List[Tuple[float, float]] = field(default_factory=list)
+    door: Optional[Wall] = None
+    cell: Optional[int] = None
+    depth: float = 1.0
+    region: Optional[Tuple[Tuple[float, float], Tuple[float, float]]] = None
+
+    def __post_init__(self):
+        if (self.door is None) == (self.region is None):
+            raise ValueError("An agent source needs exactly one of a door or a region")
+        self.schedule = sorted(self.schedule)
+        self._starts = [start for start, _ in self.schedule]
+
+    def rate(self, time):
+        """Returns the release rate at a time
+
+        Parameters
+        ----------
+        time: float
+                The simulation time
+
+        Returns
+        -------
+        float
+                The expected number of agents released per unit of time
+        """
+
+        index = bisect_right(self._starts, time) - 1
+        return self.schedule[index][1] if index >= 0 else 0.0
+
+    def exhausted(self, time):
+        """Tells whether no agent is released from a time on
+
+        Parameters
+        ----------
+        time: float
+                The simulation time
+
+        Returns
+        -------
+        bool
+                Whether the rate is 0 at that time and at every later start
+        """
+
+        return self.rate(time) == 0 and all(
+            rate == 0 for start, rate in self.schedule if start > time
+        )
+
+    def release(self, rng, time, dt):
+        """Draws the number of agents released during a step
+
+        Parameters
+        ----------
+        rng: np.random.Generator
+                The random number stream of the simulation
+        time: float
+                The simulation time at the start of the step
+        dt: float
+                The time covered by the step
+
+        Returns
+        -------
+        int
+                The number of agents to release
+        """
+
+        rate = self.rate(time)
+        return int(rng.poisson(rate * dt)) if rate > 0 else 0
+
+    def place(self, rng, count, floorplan):
+        """Draws the positions of released agents
+
+        Parameters
+        ----------
+        rng: np.random.Generator
+                The random number stream of the simulation
+        count: int
+                The number of agents
+        floorplan: Floorplan
+                The floorplan of the simulation
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                (count, 2) array of positions, and (count,) array of their cells
+        """
+
+        if self.region is not None:
+            low, high = np.array(self.region, dtype=np.float64)
+            positions = low + rng.random((count, 2)) * (high - low)
+            return positions, floorplan.find_cells(positions[:, 0], positions[:, 1])
+
+        start, end = np.array(self.door.endpoints, dtype=np.float64)
+        along = end - start
+        normal = np.array([-along[1], along[0]]) / np.hypot(*along)
+
+        # Point the normal into the cell the agents are released into
+        cell = self.cell
+        if cell is None:
+            cell = next((c for c in self.door.connection if c != 0), 0)
+        centre = (start + end) / 2
+        if floorplan.find_cell(*(centre + normal * self.depth)) != cell:
+            normal = -normal
+
+        positions = start + rng.random((count, 1)) * along + normal * self.depth
+        return positions, np.full(count, cell, dtype=np.int64)
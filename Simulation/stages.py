@@ -0,0 +1,53 @@
+"""Stages that run inside the frame loop of `Simulation.run`
+
+A stage is handed the simulation when the run starts, after every frame
+(including the initial one) and when the run ends, whether it finished, was
+closed early or failed. Stages can so record or aggregate every frame without
+the caller having to copy the live, mutable frame that `run` yields.
+"""
+
+from .arrays import AgentArrays
+
+
+class Stage:
+    """Base class of the stages of a run, every hook does nothing by default
+
+    Methods
+    -------
+    on_start(simulation: Simulation)
+            Called before the initial frame
+    on_frame(simulation: Simulation, frame: int)
+            Called after every frame, with 0 for the initial frame
+    on_finish(simulation: Simulation)
+            Called once the run ends
+    """
+
+    def on_start(self, simulation):
+        pass
+
+    def on_frame(self, simulation, frame):
+        pass
+
+    def on_finish(self, simulation):
+        pass
+
+
+def current_agents(simulation):
+    """Returns the agents of the current frame of any engine as arrays
+
+    Parameters
+    ----------
+    simulation: Simulation | ArraySimulation | ParallelSimulation
+            The simulation
+
+    Returns
+    -------
+    AgentArrays
+            The live arrays of the array engines, or a copy of the agents of
+            the object engine
+    """
+
+    agents = getattr(simulation, "agents", None)
+    if isinstance(agents, AgentArrays):
+        return agents
+    return AgentArrays.from_frame(simulation.frame)
@@ -0,0 +1,68 @@
+"""Independent random number streams for simulations
+
+Every simulation draws from its own `numpy.random.Generator`. Streams for
+parallel runs or worker processes are spawned from a single seed with
+`numpy.random.SeedSequence`, so they are reproducible and do not overlap.
+"""
+
+import numpy as np
+
+
+def seed_sequence(seed=None):
+    """Returns the SeedSequence for a seed
+
+    Parameters
+    ----------
+    seed: None | int | Sequence[int] | np.random.SeedSequence | np.random.Generator
+            The seed, fresh OS entropy if None
+
+    Returns
+    -------
+    np.random.SeedSequence
+            The seed sequence
+    """
+
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        bit_generator = seed.bit_generator
+        return getattr(bit_generator, "seed_seq", None) or bit_generator._seed_seq
+    return np.random.SeedSequence(seed)
+
+
+def make_rng(seed=None):
+    """Returns a generator for a seed
+
+    Parameters
+    ----------
+    seed: None | int | Sequence[int] | np.random.SeedSequence | np.random.Generator
+            The seed, returned as is if it is already a generator
+
+    Returns
+    -------
+    np.random.Generator
+            The generator
+    """
+
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed_sequence(seed))
+
+
+def spawn_rngs(seed, n):
+    """Spawns independent generators from a seed
+
+    Parameters
+    ----------
+    seed: None | int | Sequence[int] | np.random.SeedSequence | np.random.Generator
+            The parent seed
+    n: int
+            The number of generators
+
+    Returns
+    -------
+    List[np.random.Generator]
+            The child generators
+    """
+
+    return [np.random.default_rng(child) for child in seed_sequence(seed).spawn(n)]
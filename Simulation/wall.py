@@ -15,6 +15,8 @@ class Wall:
             The two cells connected through the wall
     door_node: int
             The node index of a door in the graph
+    center: Tuple[float, float]
+            The center point of the wall
 
     Methods
     -------
@@ -59,6 +61,15 @@ class Wall:
         self.connection = connection
         self.door_node = -1
 
+    @property
+    def center(self):
+        """The center point of the wall"""
+
+        return (
+            (self.endpoints[0][0] + self.endpoints[1][0]) / 2,
+            (self.endpoints[0][1] + self.endpoints[1][1]) / 2,
+        )
+
     def orientation(self, a, b, c):
         """Checks the orientation of any three points
 
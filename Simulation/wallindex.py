@@ -0,0 +1,163 @@
+import logging
+from math import floor
+
+import numpy as np
+
+from .arrays import expand_ranges
+from .neighbours import bucket_keys
+from .wall import Wall
+
+logger = logging.getLogger("Simulation.WallIndex")
+
+
+class WallIndex:
+    """Uniform grid over the walls of a floorplan for wall force queries
+
+    Every wall (doors excluded) is registered in each bucket overlapped by its
+    bounding box padded by the force margin, so the walls registered in the
+    bucket of a point are a superset of the walls that can push on that point.
+
+    Attributes
+    ----------
+    margin: float
+            The distance up to which walls exert a force
+    walls: List[Wall]
+            The indexed walls
+    starts: np.ndarray
+    ends: np.ndarray
+            (w, 2) arrays of the endpoints of the walls
+    connections: np.ndarray
+            (w, 2) array of the cells connected through each wall
+
+    Methods
+    -------
+    __init__(cells: List[List[Wall]], margin: float)
+            Builds the grid
+    walls_near(point: Tuple[float, float], cell: int)
+            Returns the walls of a cell that can reach a point
+    candidates(points: np.ndarray, cells: np.ndarray)
+            Finds the candidate walls of many points at once
+    """
+
+    def __init__(self, cells, margin, bucket_size=None):
+        """Builds the grid
+
+        Parameters
+        ----------
+        cells: List[List[Wall]]
+                The list of walls for each cell
+        margin: float
+                The distance up to which walls exert a force
+        bucket_size: float
+                The width of each bucket, defaults to the margin
+
+        Returns
+        -------
+        None
+        """
+
+        self.margin = margin
+        self.bucket_size = bucket_size or max(margin, 1e-9)
+        self.walls = list(
+            dict.fromkeys(
+                wall for walls in cells for wall in walls if wall.state != Wall.DOOR
+            )
+        )
+
+        endpoints = np.array(
+            [wall.endpoints for wall in self.walls], dtype=np.float64
+        ).reshape(-1, 2, 2)
+        self.starts = endpoints[:, 0]
+        self.ends = endpoints[:, 1]
+        self.connections = np.array(
+            [wall.connection for wall in self.walls], dtype=np.int64
+        ).reshape(-1, 2)
+
+        # Buckets overlapped by the padded bounding box of each wall
+        low = np.floor(
+            (np.minimum(self.starts, self.ends) - margin) / self.bucket_size
+        ).astype(np.int64)
+        high = np.floor(
+            (np.maximum(self.starts, self.ends) + margin) / self.bucket_size
+        ).astype(np.int64)
+        spans = high - low + 1
+        wall_ids, entries = expand_ranges(
+            np.zeros(len(self.walls), dtype=np.int64), spans[:, 0] * spans[:, 1]
+        )
+        gx = low[wall_ids, 0] + entries // spans[wall_ids, 1]
+        gy = low[wall_ids, 1] + entries % spans[wall_ids, 1]
+
+        keys = bucket_keys(gx, gy)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.wall_ids = wall_ids[order]
+
+        # Per-bucket tuples for scalar queries
+        self._buckets = {}
+        unique_keys, starts = np.unique(self.keys, return_index=True)
+        for key, start, end in zip(
+            unique_keys.tolist(), starts, np.append(starts[1:], len(self.keys))
+        ):
+            self._buckets[key] = tuple(self.wall_ids[start:end].tolist())
+
+        logger.debug(
+            "Indexed %d walls into %d buckets", len(self.walls), len(self._buckets)
+        )
+
+    def walls_near(self, point, cell):
+        """Returns the walls of a cell that can reach a point
+
+        Parameters
+        ----------
+        point: Tuple[float, float]
+                The point in consideration
+        cell: int
+                The cell whose walls are considered
+
+        Returns
+        -------
+        List[Wall]
+                The candidate walls
+        """
+
+        key = bucket_keys(
+            floor(point[0] / self.bucket_size), floor(point[1] / self.bucket_size)
+        )
+        return [
+            self.walls[i]
+            for i in self._buckets.get(key, ())
+            if cell in self.walls[i].connection
+        ]
+
+    def candidates(self, points, cells=None):
+        """Finds the candidate walls of many points at once
+
+        Parameters
+        ----------
+        points: np.ndarray
+                (n, 2) array of points
+        cells: np.ndarray
+                (n,) array of the cell of each point, or None to consider walls of every cell
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+                Index arrays of (point, wall) candidate pairs
+        """
+
+        grid = np.floor(points / self.bucket_size).astype(np.int64)
+        keys = bucket_keys(grid[:, 0], grid[:, 1])
+        starts = np.searchsorted(self.keys, keys, side="left")
+        counts = np.searchsorted(self.keys, keys, side="right") - starts
+        point_ids, entries = expand_ranges(starts, counts)
+        wall_ids = self.wall_ids[entries]
+
+        if cells is not None:
+            connections = self.connections[wall_ids]
+            point_cells = cells[point_ids]
+            in_cell = (connections[:, 0] == point_cells) | (
+                connections[:, 1] == point_cells
+            )
+            point_ids, wall_ids = point_ids[in_cell], wall_ids[in_cell]
+
+        return point_ids, wall_ids
@@ -0,0 +1,110 @@
+import argparse
+import json
+import logging
+import sys
+
+from Simulation.benchmark import (
+    AGENT_COUNTS,
+    BASE_AGENTS,
+    BASE_CELLS,
+    CELL_COUNTS,
+    ENGINES,
+    TOLERANCE,
+    compare_results,
+    run_benchmarks,
+    sweep,
+    to_document,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the simulation engines across agent counts and floorplan sizes"
+    )
+    parser.add_argument(
+        "--engines", nargs="+", choices=ENGINES, default=ENGINES, help="engines to run"
+    )
+    parser.add_argument(
+        "--agents", nargs="+", type=int, default=AGENT_COUNTS, help="agent counts"
+    )
+    parser.add_argument(
+        "--cells", nargs="+", type=int, default=CELL_COUNTS, help="floorplan rooms"
+    )
+    parser.add_argument(
+        "--base-agents", type=int, default=BASE_AGENTS, help="agents while rooms vary"
+    )
+    parser.add_argument(
+        "--base-cells", type=int, default=BASE_CELLS, help="rooms while agents vary"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="only the two smallest sizes of each sweep"
+    )
+    parser.add_argument("--frames", type=int, default=20, help="frames per scenario")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the simulations")
+    parser.add_argument(
+        "--time-budget", type=float, default=30.0, help="seconds per scenario"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip measuring peak memory"
+    )
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=TOLERANCE, help="relative change allowed"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    agents, cells = sorted(args.agents), sorted(args.cells)
+    if args.quick:
+        agents, cells = agents[:2], cells[:2]
+    scenarios = sweep(args.engines, agents, cells, args.base_agents, args.base_cells)
+
+    results = []
+    for result in run_benchmarks(
+        scenarios, args.frames, args.seed, args.time_budget, not args.no_memory
+    ):
+        results.append(result)
+        if result.skipped:
+            logging.info("%-24s skipped, a smaller scenario was too slow", result.name)
+            continue
+        memory = (
+            f"{result.peak_memory / 2**20:8.1f} MiB"
+            if result.peak_memory is not None
+            else ""
+        )
+        logging.info(
+            "%-24s %9.2f fps, floorplan %7.3fs, setup %7.3fs %s",
+            result.name,
+            result.fps,
+            result.floorplan_seconds,
+            result.setup_seconds,
+            memory,
+        )
+
+    document = to_document(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_results(document, baseline, args.tolerance)
+        for regression in regressions:
+            logging.warning(
+                "Regression in %s: %s %.4g -> %.4g (%+.1f%%)",
+                regression["name"],
+                regression["metric"],
+                regression["baseline"],
+                regression["value"],
+                100 * regression["change"],
+            )
+        if regressions:
+            sys.exit(1)
+        logging.info("No regressions against %s", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
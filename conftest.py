@@ -0,0 +1,2 @@
+# Makes pytest put the repository root on sys.path, so the tests import the
+# Simulation package without it being installed
@@ -0,0 +1,72 @@
+import argparse
+import json
+import logging
+
+from Simulation import Floorplan, FloorplanCache, Params
+from Simulation.ensemble import EnsembleStats, run_ensemble
+from Simulation.scenario import load_scenario
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run many replications of one scenario and aggregate their statistics"
+    )
+    parser.add_argument(
+        "scenario", nargs="?", help="scenario file, the default layout if omitted"
+    )
+    parser.add_argument("--runs", type=int, default=50, help="number of replications")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="seed of the ensemble, the RANDOM_SEED of the scenario if omitted",
+    )
+    parser.add_argument("--frames", type=int, default=None, help="frames per run")
+    parser.add_argument("--cache", help="floorplan cache directory")
+    parser.add_argument("--output", help="write the summaries and statistics as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    cache = FloorplanCache(args.cache) if args.cache else None
+    if args.scenario:
+        params, floorplan, sources = load_scenario(args.scenario, cache)
+    else:
+        params, floorplan, sources = Params(), Floorplan.make_default_layout(), []
+    if args.frames is not None:
+        params.basic_parameters.SIMULATION_LENGTH = args.frames
+    if args.seed is not None:
+        params.basic_parameters.RANDOM_SEED = args.seed
+
+    stats = EnsembleStats()
+    for summary in run_ensemble(
+        params,
+        floorplan,
+        args.runs,
+        workers=args.workers,
+        seed=params.basic_parameters.RANDOM_SEED,
+        sources=sources,
+    ):
+        stats.add(summary)
+        logging.info(
+            "[%d/%d] run %d: %d/%d arrived, evacuation time %s, peak flow %d (%.2fs)",
+            len(stats),
+            args.runs,
+            summary.run,
+            summary.arrived,
+            summary.agents,
+            summary.evacuation_time,
+            summary.peak_flow,
+            summary.runtime,
+        )
+
+    aggregate = stats.aggregate()
+    print(json.dumps(aggregate, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"statistics": aggregate, "runs": stats.to_records()}, file)
+
+
+if __name__ == "__main__":
+    main()
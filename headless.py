@@ -1,68 +1,212 @@
-from collections import defaultdict
-
-import numpy as np
-from matplotlib import pyplot as plt
-
-from Simulation.simulation import Simulation
-from Simulation.params import Params
-from Simulation.wall import Wall
-from Simulation.floorplan import Floorplan
-
-walls = [
-	Wall(((0, 0), (50, 0)), 1, (0, 1)),
-	Wall(((50, 0), (100, 0)), 1, (0, 2)),
-	Wall(((100, 0), (100, 100)), 1, (0, 2)),
-	Wall(((100, 100), (50, 100)), 1, (0, 2)),
-	Wall(((50, 100), (0, 100)), 1, (0, 1)),
-	Wall(((0, 100), (0, 0)), 1, (0, 1)),
-	Wall(((50, 0), (50, 45)), 1, (1, 2)),
-	Wall(((50, 55), (50, 100)), 1, (1, 2)),
-	Wall(((50, 45), (50, 55)), 0, (1, 2)),
-]
-
-cells = defaultdict(lambda: [])
-for wall in walls:
-	cells[wall.connection[0]].append(wall)
-	cells[wall.connection[1]].append(wall)
-
-simulation = Simulation(
-	Params(), Floorplan([cells[i] for i in range(len(cells))], [0, 0, 100])
+import argparse
+import importlib.util
+import logging
+import time
+
+from Simulation import (
+    ArraySimulation,
+    Floorplan,
+    FloorplanCache,
+    ParallelSimulation,
+    Params,
+    PhaseStats,
+    Simulation,
+    Stage,
+    TrajectoryRecorder,
+    Wall,
 )
+from Simulation.metrics import DensityHeatmap, DoorFlows, FrameMetrics
+from Simulation.scenario import load_scenario
+from Simulation.stages import current_agents
+
+ENGINES = ("array", "object", "parallel")
+
+
+class Throughput(Stage):
+    """Logs the progress of the run every few seconds, and its throughput at the end"""
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+
+    def on_start(self, simulation):
+        self.start = self.last_report = time.perf_counter()
+        self.frame = 0
+        self.agent_frames = 0
+
+    def on_frame(self, simulation, frame):
+        agents = len(current_agents(simulation))
+        self.agent_frames += agents * (frame - self.frame)
+        self.frame = frame
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            logging.info(
+                "frame %d, %d agents, %.1f frames/s",
+                frame,
+                agents,
+                frame / (now - self.start),
+            )
+
+    def on_finish(self, simulation):
+        seconds = time.perf_counter() - self.start
+        logging.info(
+            "%d frames in %.2fs: %.1f frames/s, %.0f agent-frames/s",
+            self.frame,
+            seconds,
+            self.frame / seconds if seconds else float("inf"),
+            self.agent_frames / seconds if seconds else float("inf"),
+        )
+
+
+class Preview(Stage):
+    """Draws the walls once and the agents on every frame, with matplotlib"""
+
+    def on_start(self, simulation):
+        # Only imported when a preview is asked for
+        from matplotlib import pyplot as plt
+        from matplotlib.collections import LineCollection
+
+        self.plt = plt
+        plt.ion()
+        self.figure, axes = plt.subplots()
+        walls = dict.fromkeys(
+            wall for walls in simulation.floorplan.cells for wall in walls
+        )
+        for state, style in ((Wall.WALL, "k-"), (Wall.DOOR, "g:")):
+            segments = [wall.endpoints for wall in walls if wall.state == state]
+            axes.add_collection(
+                LineCollection(segments, colors=style[0], linestyles=style[1:])
+            )
+        axes.autoscale()
+        axes.set_aspect("equal")
+        self.scatter = axes.scatter([], [], s=4)
+
+    def on_frame(self, simulation, frame):
+        self.scatter.set_offsets(current_agents(simulation).positions)
+        self.figure.canvas.draw_idle()
+        self.plt.pause(0.001)
+
+    def on_finish(self, simulation):
+        self.plt.ioff()
+        self.plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a scenario at full speed without a display"
+    )
+    parser.add_argument(
+        "scenario", nargs="?", help="scenario file, the default layout if omitted"
+    )
+    parser.add_argument("--engine", choices=ENGINES, default="array", help="engine")
+    parser.add_argument("--workers", type=int, default=None, help="parallel workers")
+    parser.add_argument("--frames", type=int, default=None, help="frames to simulate")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument(
+        "--every", type=int, default=1, help="record and measure every k-th frame"
+    )
+    parser.add_argument("--record", help="directory to record the trajectories to")
+    parser.add_argument(
+        "--encoding",
+        choices=("raw", "delta"),
+        default="raw",
+        help="trajectory encoding",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=("zlib", "lzma"),
+        default=None,
+        help="chunk compression",
+    )
+    parser.add_argument("--metrics", help="CSV file to write per-frame metrics to")
+    parser.add_argument(
+        "--heatmap",
+        help="file to write the density heatmap to, as a PNG image or a .npz file",
+    )
+    parser.add_argument(
+        "--bucket-size", type=float, default=1.0, help="side of a heatmap bucket"
+    )
+    parser.add_argument(
+        "--flows", help="CSV file to write the crossings of every door to"
+    )
+    parser.add_argument(
+        "--flow-window",
+        type=int,
+        default=10,
+        help="frames the door flow rates are averaged over",
+    )
+    parser.add_argument("--cache", help="floorplan cache directory")
+    parser.add_argument(
+        "--profile", action="store_true", help="report the time spent in each phase"
+    )
+    parser.add_argument(
+        "--preview", action="store_true", help="plot the run with matplotlib"
+    )
+    args = parser.parse_args()
+    if args.preview and importlib.util.find_spec("matplotlib") is None:
+        parser.error("--preview needs matplotlib")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    cache = FloorplanCache(args.cache) if args.cache else None
+    if args.scenario:
+        params, floorplan, sources = load_scenario(args.scenario, cache)
+    else:
+        params, floorplan, sources = Params(), Floorplan.make_default_layout(), []
+    if args.frames is not None:
+        params.basic_parameters.SIMULATION_LENGTH = args.frames
+    if args.seed is not None:
+        params.basic_parameters.RANDOM_SEED = args.seed
+
+    profiler = PhaseStats() if args.profile else None
+    if args.engine == "parallel":
+        if sources or profiler:
+            parser.error("the parallel engine supports neither sources nor profiling")
+        simulation = ParallelSimulation(params, floorplan, workers=args.workers)
+    else:
+        engine = ArraySimulation if args.engine == "array" else Simulation
+        simulation = engine(params, floorplan, profiler=profiler, sources=sources)
+
+    stages = [Throughput()]
+    if args.record:
+        stages.append(
+            TrajectoryRecorder(
+                args.record,
+                background=True,
+                encoding=args.encoding,
+                compression=args.compression,
+            )
+        )
+    if args.metrics:
+        stages.append(FrameMetrics(args.metrics))
+    heatmap = DensityHeatmap(args.bucket_size) if args.heatmap else None
+    if heatmap is not None:
+        stages.append(heatmap)
+    flows = DoorFlows(args.flow_window) if args.flows else None
+    if flows is not None:
+        stages.append(flows)
+    if args.preview:
+        stages.append(Preview())
+
+    logging.info(
+        "Running %d frames of %d cells with the %s engine",
+        params.basic_parameters.SIMULATION_LENGTH,
+        floorplan.num_cells,
+        args.engine,
+    )
+    for _ in simulation.run(stages, every=args.every):
+        pass
+
+    if heatmap is not None:
+        if args.heatmap.endswith(".png"):
+            heatmap.save_image(args.heatmap)
+        else:
+            heatmap.save(args.heatmap)
+    if flows is not None:
+        flows.save(args.flows)
+    if profiler is not None:
+        logging.info(profiler.report())
+
 
-plt.ion()
-fig, ax = plt.subplots()
-
-wall_x, wall_y = [], []
-for wall in walls:
-	if wall.state == Wall.DOOR:
-		continue
-	points = (
-		(wall.endpoints[0][0], wall.endpoints[1][0]),
-		(wall.endpoints[0][1], wall.endpoints[1][1]),
-	)
-	for i in range(min(points[0]), max(points[0]) + 1):
-		for j in range(min(points[1]), max(points[1]) + 1):
-			wall_x.append(i)
-			wall_y.append(j)
-
-sc = ax.scatter(wall_x, wall_y)
-plt.xlim(0, 100)
-plt.ylim(0, 100)
-
-for agents in simulation.run():
-	# for i in range(len(agents)):
-	# print(f"{i}: ", end="")
-	# for agent in agents[i]:
-	#     print(f"({agent.x}, {agent.y}) ", end="")
-	# print()
-
-	x = [agent.x for cell_agents in agents for agent in cell_agents]
-	y = [agent.y for cell_agents in agents for agent in cell_agents]
-	x += wall_x
-	y += wall_y
-
-	sc.set_offsets(np.c_[x, y])
-	fig.canvas.draw_idle()
-	plt.pause(0.1)
-
-plt.waitforbuttonpress()
+if __name__ == "__main__":
+    main()
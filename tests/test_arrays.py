@@ -0,0 +1,114 @@
+import numpy as np
+
+from Simulation import (
+    AgentArrays,
+    AgentPool,
+    ArraySimulation,
+    Floorplan,
+    FrameView,
+    Params,
+    Simulation,
+)
+from Simulation.arrays import expand_ranges, group_indices
+
+
+def test_from_frame_keeps_every_agent():
+    simulation = Simulation(Params(), Floorplan.make_default_layout())
+    agents = AgentArrays.from_frame(simulation.frame)
+    objects = [agent for cell_agents in simulation.frame for agent in cell_agents]
+
+    assert len(agents) == len(objects)
+    np.testing.assert_array_equal(
+        agents.positions, [(agent.x, agent.y) for agent in objects]
+    )
+    np.testing.assert_array_equal(agents.cells, [agent.cell for agent in objects])
+    np.testing.assert_array_equal(agents.ids, [agent.age for agent in objects])
+
+
+def test_frame_view_groups_agents_by_cell():
+    agents = AgentArrays(
+        [[0.0, 0.0], [1.0, 1.0], [2.0, 2.0]],
+        np.zeros((3, 2)),
+        [2, 1, 2],
+        [0, 0, 0],
+        [10, 11, 12],
+    )
+    frame = FrameView(agents, 3)
+
+    assert len(frame) == 3
+    assert frame[0] == []
+    assert [agent.age for agent in frame[2]] == [10, 12]
+    assert [agent.x for agent in frame[-2]] == [1.0]
+    assert [len(cell) for cell in frame[1:]] == [1, 2]
+
+
+def test_expand_ranges_and_group_indices():
+    owners, indices = expand_ranges(np.array([5, 0, 2]), np.array([2, 0, 3]))
+    np.testing.assert_array_equal(owners, [0, 0, 2, 2, 2])
+    np.testing.assert_array_equal(indices, [5, 6, 2, 3, 4])
+
+    groups = {
+        int(key): indices.tolist()
+        for key, indices in group_indices(np.array([3, 1, 3, 2, 1]))
+    }
+    assert groups == {1: [1, 4], 2: [3], 3: [0, 2]}
+
+
+def _numbered(ids):
+    ids = np.asarray(ids)
+    return AgentArrays(
+        np.stack([ids, -ids], axis=1).astype(np.float64),
+        np.zeros((len(ids), 2)),
+        ids % 3,
+        np.zeros(len(ids), dtype=np.int64),
+        ids,
+    )
+
+
+def test_remove_moves_the_last_agents_into_the_holes():
+    agents = _numbered(np.arange(6))
+    remaining = agents.remove(np.array([1, 4, 5]))
+
+    np.testing.assert_array_equal(remaining.ids, [0, 3, 2])
+    np.testing.assert_array_equal(remaining.positions[:, 0], remaining.ids)
+    assert np.shares_memory(remaining.ids, agents.ids)
+
+
+def test_pool_grows_and_shrinks():
+    pool = AgentPool(_numbered(np.arange(4)))
+    assert pool.capacity == 4
+
+    pool.add(_numbered(np.arange(4, 7)))
+    assert pool.capacity == 8
+    np.testing.assert_array_equal(pool.agents.ids, np.arange(7))
+    pool.add(_numbered([7]))
+    assert pool.capacity == 8
+
+    # Still a quarter full
+    pool.remove(np.array([0, 2, 3, 5, 6, 7]))
+    assert pool.size == 2
+    assert pool.capacity == 8
+    assert sorted(pool.agents.ids.tolist()) == [1, 4]
+
+    pool.remove(np.array([0]))
+    assert pool.size == 1
+    assert pool.capacity == 2
+    np.testing.assert_array_equal(pool.agents.positions[:, 1], -pool.agents.ids)
+
+
+def test_arrived_agents_end_the_run():
+    params = Params()
+    params.basic_parameters.SIMULATION_LENGTH = 2000
+    params.basic_parameters.REMOVE_ARRIVED = True
+    floorplan = Floorplan.make_default_layout()
+    simulation = ArraySimulation(params, floorplan)
+    population = len(simulation.agents)
+
+    exited = []
+    frames = 0
+    for _ in simulation.run():
+        exited += simulation.exited.tolist()
+        frames += 1
+    assert len(simulation.agents) == 0
+    assert sorted(exited) == list(range(population))
+    assert frames < 2001
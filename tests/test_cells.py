@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from Simulation import ArraySimulation, Params, Simulation
+from Simulation.layouts import grid_layout, mall_layout
+from Simulation.stages import current_agents
+
+
+@pytest.mark.parametrize("engine", [ArraySimulation, Simulation])
+def test_cells_follow_positions(engine):
+    floorplan = mall_layout(3, seed=2)
+    floorplan.distribution = [0] * floorplan.num_cells
+    floorplan.distribution[1] = floorplan.distribution[3] = 100
+
+    params = Params()
+    params.basic_parameters.WIDTH = 60
+    params.basic_parameters.HEIGHT = 36
+    params.basic_parameters.SIMULATION_LENGTH = 60
+    simulation = engine(params, floorplan)
+    for _ in simulation.run():
+        pass
+
+    agents = current_agents(simulation)
+    found = floorplan.find_cells(agents.positions[:, 0], agents.positions[:, 1])
+    np.testing.assert_array_equal(agents.cells, found)
+
+
+@pytest.mark.parametrize("engine", [ArraySimulation, Simulation])
+def test_cells_follow_fast_agents(engine):
+    # Agents fast enough to cross a whole room in a few frames
+    floorplan = grid_layout(3, 4, room_size=6, distribution=[0] * 12 + [200])
+    params = Params()
+    params.basic_parameters.WIDTH = 24
+    params.basic_parameters.HEIGHT = 18
+    params.basic_parameters.SIMULATION_LENGTH = 40
+    params.basic_parameters.MAX_VELOCITY = 4
+    simulation = engine(params, floorplan)
+    for _ in simulation.run():
+        agents = current_agents(simulation)
+        found = floorplan.find_cells(agents.positions[:, 0], agents.positions[:, 1])
+        np.testing.assert_array_equal(agents.cells, found)
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from Simulation import (
+    ArraySimulation,
+    Floorplan,
+    Params,
+    TrajectoryReader,
+    TrajectoryRecorder,
+)
+from Simulation.codec import (
+    COMPRESSIONS,
+    DELTA,
+    KEYFRAME,
+    SUBSET_DELTA,
+    compress,
+    decode_positions,
+    decompress,
+    encode_positions,
+)
+from Simulation.stages import current_agents
+
+ORIGIN = np.array([-1.0, 2.0])
+RESOLUTION = 0.01
+
+
+def test_frames_round_trip():
+    rng = np.random.default_rng(0)
+    start = rng.uniform(0, 50, (6, 2))
+    frames = [
+        (start, np.arange(6)),
+        (start + 0.5, np.arange(6)),
+        # Agents 1 and 4 left
+        (start[[0, 2, 3, 5]] + 1.0, np.array([0, 2, 3, 5])),
+        # Agent 6 arrived
+        (np.vstack([start, [[7.0, 7.0]]]), np.arange(7)),
+        # Too far from the keyframe for an int16 delta
+        (np.vstack([start, [[7.0, 7.0]]]) + 400.0, np.arange(7)),
+    ]
+    positions = np.concatenate([frame[0] for frame in frames])
+    ids = np.concatenate([frame[1] for frame in frames])
+    counts = np.array([len(frame[1]) for frame in frames])
+
+    data, kinds = encode_positions(positions, counts, ids, ORIGIN, RESOLUTION, 32)
+    np.testing.assert_array_equal(
+        kinds, [KEYFRAME, DELTA, SUBSET_DELTA, KEYFRAME, KEYFRAME]
+    )
+    for index, (expected, _) in enumerate(frames):
+        decoded = decode_positions(data, counts, kinds, index, ORIGIN, RESOLUTION)
+        np.testing.assert_allclose(decoded, expected, atol=RESOLUTION / 2 + 1e-12)
+
+
+def test_keyframe_interval():
+    positions = np.zeros((5, 2))
+    counts, ids = np.ones(5, dtype=np.int64), np.zeros(5, dtype=np.int64)
+    _, kinds = encode_positions(positions, counts, ids, ORIGIN, 1.0, 2)
+    np.testing.assert_array_equal(kinds, [KEYFRAME, DELTA, KEYFRAME, DELTA, KEYFRAME])
+
+
+@pytest.mark.parametrize("compression", [None, *COMPRESSIONS])
+def test_compression_round_trip(compression):
+    data = np.arange(1000, dtype=np.int64).tobytes()
+    assert decompress(compress(data, compression), compression) == data
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_delta_recording_round_trip(tmp_path, compression):
+    params = Params()
+    params.basic_parameters.SIMULATION_LENGTH = 20
+    simulation = ArraySimulation(params, Floorplan.make_default_layout())
+    recorder = TrajectoryRecorder(
+        tmp_path / "run",
+        chunk_frames=8,
+        encoding="delta",
+        keyframe_interval=4,
+        compression=compression,
+    )
+    frames = []
+    for _ in simulation.run([recorder]):
+        agents = current_agents(simulation)
+        order = np.argsort(agents.ids)
+        frames.append((agents.ids[order], agents.positions[order]))
+
+    reader = TrajectoryReader(tmp_path / "run")
+    assert len(reader) == len(frames)
+    for index in (5, 0, 20, 13):
+        frame = reader.frame(index)
+        np.testing.assert_array_equal(frame["ids"], frames[index][0])
+        np.testing.assert_allclose(
+            frame["positions"], frames[index][1], atol=recorder.resolution / 2 + 1e-9
+        )
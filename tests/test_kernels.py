@@ -0,0 +1,42 @@
+import numpy as np
+
+import Simulation.arraysimulation
+from Simulation import ArraySimulation, Floorplan, Params
+from Simulation.geometry import perpendiculars
+from Simulation.kernels import fused_step
+from Simulation.streams import seed_sequence
+
+
+def test_kernel_matches_numpy(monkeypatch):
+    # The uncompiled kernel, so the comparison runs without numba
+    monkeypatch.setattr(
+        Simulation.arraysimulation,
+        "fused_step",
+        getattr(fused_step, "py_func", fused_step),
+    )
+    params = Params()
+    params.repulsion_factors.RANDOM_FORCE_CONSTANT = 0.5
+    floorplan = Floorplan.make_default_layout()
+    reference = ArraySimulation(
+        params, floorplan, rng=seed_sequence(1), backend="numpy"
+    )
+    kernel = ArraySimulation(params, floorplan, rng=seed_sequence(1), backend="numpy")
+    kernel.backend = "numba"
+
+    deviation = 0.0
+    for _ in range(30):
+        reference.nextFrame()
+        kernel.nextFrame()
+        np.testing.assert_array_equal(reference.agents.ids, kernel.agents.ids)
+        offsets = kernel.agents.positions - reference.agents.positions
+        deviation = max(deviation, np.hypot(offsets[:, 0], offsets[:, 1]).max())
+    assert deviation < 1e-9
+
+
+def test_zero_length_walls_are_skipped():
+    points = np.array([[1.0, 1.0], [2.0, 0.5]])
+    starts = np.array([[0.0, 0.0], [2.0, 0.0]])
+    ends = np.array([[0.0, 0.0], [2.0, 0.0]])
+    per, on_wall = perpendiculars(points, starts, ends)
+    assert np.all(np.isfinite(per))
+    assert not on_wall.any()
@@ -0,0 +1,60 @@
+import csv
+
+import numpy as np
+import pytest
+
+from Simulation import ArraySimulation, Floorplan, Params, Simulation
+from Simulation.metrics import DensityHeatmap, DoorFlows, FrameMetrics
+
+
+def short_run(engine=ArraySimulation, frames=30):
+    params = Params()
+    params.basic_parameters.SIMULATION_LENGTH = frames
+    return engine(params, Floorplan.make_default_layout())
+
+
+@pytest.mark.parametrize("every", [1, 3])
+def test_heatmap_counts_every_frame(every):
+    simulation = short_run()
+    population = len(simulation.agents)
+    heatmap = DensityHeatmap(bucket_size=2.0)
+    for _ in simulation.run([heatmap], every=every):
+        pass
+
+    assert heatmap.frames == 31 - (30 % every)
+    assert heatmap.total.sum() == population * heatmap.frames
+    np.testing.assert_allclose(
+        heatmap.mean_density().sum() * heatmap.bucket_size**2, population
+    )
+    assert np.all(heatmap.max_density() >= heatmap.mean_density())
+
+
+@pytest.mark.parametrize("engine", [ArraySimulation, Simulation])
+def test_door_flows_match_the_crossings(engine):
+    simulation = short_run(engine)
+    flows = DoorFlows(window=5)
+    crossings = []
+    for _ in simulation.run([flows]):
+        if getattr(simulation, "crossings", None) is not None:
+            crossings.append(simulation.crossings[1])
+
+    assert flows.counts.sum() > 0
+    if crossings:
+        np.testing.assert_array_equal(
+            flows.counts.sum(axis=1),
+            np.bincount(np.concatenate(crossings), minlength=len(flows.counts)),
+        )
+    assert np.all(flows.peak_rates >= flows.flow_rates)
+
+
+def test_frame_metrics_rows(tmp_path):
+    simulation = short_run(frames=10)
+    path = tmp_path / "metrics.csv"
+    for _ in simulation.run([FrameMetrics(path)]):
+        pass
+
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [int(row["frame"]) for row in rows] == list(range(11))
+    assert {int(row["agents"]) for row in rows} == {len(simulation.agents)}
+    assert all(float(row["mean_speed"]) >= 0 for row in rows)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from Simulation import Params
+from Simulation.layouts import grid_layout
+from Simulation.parallel import ParallelSimulation, partition_cells, route_workers
+
+
+def test_partition_cells_balances_connected_groups():
+    floorplan = grid_layout(1, 8, room_size=6)
+    weights = np.zeros(floorplan.num_cells)
+    weights[1:] = 10
+    owners = partition_cells(floorplan, weights, 4)
+
+    assert sorted(set(owners.tolist())) == [0, 1, 2, 3]
+    np.testing.assert_array_equal(np.bincount(owners[1:]), [2, 2, 2, 2])
+    # Every group of a corridor of rooms is a run of consecutive rooms
+    assert np.all(np.diff(owners[1:]) >= 0)
+
+
+def test_route_workers_follows_the_doors():
+    floorplan = grid_layout(1, 4, room_size=6)
+    owners = np.array([0, 0, 1, 2, 3])
+    hops = route_workers(floorplan, owners)
+
+    np.testing.assert_array_equal(np.diag(hops), [0, 1, 2, 3])
+    np.testing.assert_array_equal(hops[0], [0, 1, 1, 1])
+    np.testing.assert_array_equal(hops[3], [2, 2, 2, 3])
+
+
+def test_fast_agents_are_handed_over():
+    # Agents fast enough to land in the cells of workers that are not neighbours
+    floorplan = grid_layout(3, 4, room_size=6, distribution=[0] * 12 + [200])
+    params = Params()
+    params.basic_parameters.WIDTH = 24
+    params.basic_parameters.HEIGHT = 18
+    params.basic_parameters.SIMULATION_LENGTH = 40
+    params.basic_parameters.MAX_VELOCITY = 4
+    simulation = ParallelSimulation(params, floorplan, workers=4)
+    ids = np.sort(simulation.agents.ids)
+    for _ in simulation.run():
+        np.testing.assert_array_equal(np.sort(simulation.agents.ids), ids)
+
+    agents = simulation.agents
+    found = floorplan.find_cells(agents.positions[:, 0], agents.positions[:, 1])
+    np.testing.assert_array_equal(agents.cells, found)
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+
+from Simulation import Floorplan, FloorplanCache
+from Simulation.floorplan import DOOR_TABLES
+from Simulation.layouts import mall_layout
+
+
+def _timed_load(path, cache):
+    start = time.perf_counter()
+    floorplan = Floorplan.load(path, cache)
+    return time.perf_counter() - start, floorplan
+
+
+def test_warm_load_matches_cold_load(tmp_path):
+    path = str(tmp_path / "mall.json")
+    mall_layout(60, seed=1).save(path)
+
+    cold_times, warm_times = [], []
+    for run in range(3):
+        cache = FloorplanCache(str(tmp_path / f"cache{run}"))
+        cold_time, cold = _timed_load(path, cache)
+        warm_time, warm = _timed_load(path, cache)
+        cold_times.append(cold_time)
+        warm_times.append(warm_time)
+    assert min(warm_times) < min(cold_times)
+
+    for name in DOOR_TABLES:
+        np.testing.assert_array_equal(getattr(warm, name), getattr(cold, name))
+    for dest, num_agents in enumerate(cold.distribution):
+        if num_agents:
+            np.testing.assert_array_equal(
+                warm.distances_to_cell(dest), cold.distances_to_cell(dest)
+            )
+    # The door nodes are the same walls as the doors of the cells
+    for doors, start in zip(warm.doors, warm.door_offsets):
+        assert [door.door_node for door in doors] == warm.door_ids[
+            start : start + len(doors)
+        ].tolist()
+    assert warm.doors_between.keys() == cold.doors_between.keys()
+
+
+def test_unreadable_entries_are_ignored(tmp_path):
+    cache = FloorplanCache(str(tmp_path))
+    (tmp_path / "broken.npz").write_bytes(b"not a zip file")
+    assert cache.get("broken") is None
+    assert cache.get("missing") is None
+
+    cache.put("arrays", {"values": np.arange(3)})
+    np.testing.assert_array_equal(cache.get("arrays")["values"], np.arange(3))
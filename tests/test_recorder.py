@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pytest
+
+from Simulation import (
+    ArraySimulation,
+    Floorplan,
+    Params,
+    Stage,
+    TrajectoryReader,
+    TrajectoryRecorder,
+)
+from Simulation.stages import current_agents
+
+
+def short_run(frames=10):
+    params = Params()
+    params.basic_parameters.SIMULATION_LENGTH = frames
+    return ArraySimulation(params, Floorplan.make_default_layout())
+
+
+class FrameCopies(Stage):
+    def on_start(self, simulation):
+        self.frames = []
+
+    def on_frame(self, simulation, frame):
+        agents = current_agents(simulation)
+        self.frames.append(agents.take(np.arange(len(agents))))
+
+
+class FailingRecorder(TrajectoryRecorder):
+    def _write(self, chunk):
+        raise OSError("disk full")
+
+
+def test_failed_writer_is_stopped(tmp_path):
+    simulation = short_run()
+    recorder = FailingRecorder(tmp_path / "run", background=True)
+    recorder.on_start(simulation)
+    writer = recorder._writer
+    recorder.on_frame(simulation, 0)
+    recorder.flush()
+    while writer.error is None:
+        time.sleep(0.001)
+
+    # Frames still buffered when the run ends after the writer failed
+    recorder.on_frame(simulation, 1)
+    with pytest.raises(RuntimeError) as error:
+        recorder.on_finish(simulation)
+    assert isinstance(error.value.__cause__, OSError)
+    assert not writer.is_alive()
+    assert recorder._files is None
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_recording_round_trip(tmp_path, background):
+    simulation = short_run()
+    copies = FrameCopies()
+    recorder = TrajectoryRecorder(
+        tmp_path / "run", chunk_frames=3, background=background
+    )
+    for _ in simulation.run([copies, recorder]):
+        pass
+
+    reader = TrajectoryReader(tmp_path / "run")
+    assert len(reader) == len(copies.frames) == 11
+    assert len(reader.header["chunks"]) == 4
+    for index, agents in enumerate(copies.frames):
+        frame = reader.frame(index)
+        np.testing.assert_array_equal(
+            frame["positions"], agents.positions.astype(np.float32)
+        )
+        np.testing.assert_array_equal(frame["cells"], agents.cells)
+        np.testing.assert_array_equal(frame["ids"], agents.ids)
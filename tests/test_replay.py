@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from Simulation import (
+    ArraySimulation,
+    Floorplan,
+    Params,
+    TrajectoryReader,
+    TrajectoryRecorder,
+)
+from Simulation.stages import current_agents
+
+
+def test_frames_are_read_in_any_order(tmp_path):
+    params = Params()
+    params.basic_parameters.SIMULATION_LENGTH = 12
+    simulation = ArraySimulation(params, Floorplan.make_default_layout())
+    recorder = TrajectoryRecorder(tmp_path / "run", chunk_frames=5)
+    ids = []
+    for _ in simulation.run([recorder]):
+        ids.append(current_agents(simulation).ids.copy())
+
+    reader = TrajectoryReader(tmp_path / "run")
+    assert len(reader) == 13
+    for index in (7, 0, 12, 3, -1, -13):
+        np.testing.assert_array_equal(reader.frame(index)["ids"], ids[index])
+    assert set(reader.frame(4, ["cells"])) == {"cells"}
+    assert reader.positions(-1).shape == (len(ids[-1]), 2)
+    with pytest.raises(IndexError):
+        reader.frame(13)
+
+
+def test_refresh_follows_a_recording_in_progress(tmp_path):
+    simulation = ArraySimulation(Params(), Floorplan.make_default_layout())
+    recorder = TrajectoryRecorder(tmp_path / "run", chunk_frames=2)
+    recorder.on_start(simulation)
+    reader = TrajectoryReader(tmp_path / "run")
+    assert len(reader) == 0
+
+    for frame in range(3):
+        recorder.on_frame(simulation, frame)
+    reader.refresh()
+    assert len(reader) == 2
+
+    recorder.on_finish(simulation)
+    reader.refresh()
+    assert len(reader) == 3
+    np.testing.assert_array_equal(
+        reader.positions(2), simulation.agents.positions.astype(np.float32)
+    )
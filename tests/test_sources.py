@@ -0,0 +1,30 @@
+import pytest
+
+from Simulation import AgentSource, ArraySimulation, Params, Simulation
+from Simulation.layouts import grid_layout
+
+
+def test_schedule_rates():
+    source = AgentSource(1, [(10, 0.0), (0, 2.0), (5, 0.5)], region=((0, 0), (1, 1)))
+    assert source.rate(-1) == 0.0
+    assert source.rate(0) == 2.0
+    assert source.rate(7) == 0.5
+    assert source.rate(10) == 0.0
+    assert not source.exhausted(7)
+    assert source.exhausted(10)
+
+
+@pytest.mark.parametrize("engine", [ArraySimulation, Simulation])
+def test_delayed_source_fills_an_empty_floorplan(engine):
+    floorplan = grid_layout(1, 3, distribution=[0, 0, 0, 0])
+    params = Params()
+    params.basic_parameters.WIDTH = 30
+    params.basic_parameters.HEIGHT = 10
+    params.basic_parameters.SIMULATION_LENGTH = 20
+    source = AgentSource(3, [(5, 2.0), (10, 0.0)], region=((1, 1), (9, 9)))
+    simulation = engine(params, floorplan, sources=[source])
+
+    populations = [simulation.population() for _ in simulation.run()]
+    assert populations[0] == 0
+    assert len(populations) == 21
+    assert max(populations) > 0